@@ -0,0 +1,173 @@
+"""
+ManyMan - A Many-core Visualization and Management System
+Copyright (C) 2015
+University of Amsterdam - Computer Systems Architecture
+Jimi van der Woning and Roy Bakker
+Extended for Parallella by: Floris Turkenburg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from collections import deque
+from task import Status as TaskStatus
+from threading import Thread, Event
+from time import time
+import logging
+
+
+class Balancer(Thread):
+    """
+    Background load balancer. Every interval the utilization and the run
+    queue, i.e. the running tasks, of every core are inspected. A task is
+    moved from the busiest core to the least busy one when their queues
+    differ by at least two tasks, the busiest core is saturated ('high')
+    and the other has room ('low').
+
+    The gap between 'high' and 'low', an imbalance that has to persist for
+    'persistence' intervals and a 'cooldown' per moved task keep tasks from
+    bouncing between cores. At most 'max_moves' tasks are moved per
+    interval. Every move is kept in 'log' and handed to 'callback'.
+    """
+
+    def __init__(self, chip, **kwargs):
+        self.logger = logging.getLogger('Balancer')
+
+        self.chip = chip
+        self.cores = kwargs.get('cores', None) or \
+            [c.id for c in chip.cores]
+        self.interval = kwargs.get('interval', 5.)
+        self.high = kwargs.get('high', 90.)
+        self.low = kwargs.get('low', 50.)
+        self.persistence = kwargs.get('persistence', 3)
+        self.max_moves = kwargs.get('max_moves', 1)
+        self.cooldown = kwargs.get('cooldown', 60.)
+        self.callback = kwargs.get('callback', None)
+
+        self.log = deque(maxlen=kwargs.get('log_size', 100))
+        self.streak = 0
+
+        # Time of the last move of every task, keyed by task id
+        self.moved = dict()
+
+        self.running = True
+        self._stop_event = Event()
+
+        Thread.__init__(self)
+        self.daemon = True
+
+    def plan(self, now):
+        """
+        Plan the moves of this interval. Returns a list of (task, from_core,
+        to_core) tuples.
+        """
+        queues = dict((c, []) for c in self.cores)
+        for t in self.chip.tasks.values():
+            if t.status == TaskStatus.RUNNING and t.core in queues:
+                queues[t.core].append(t)
+
+        usage = dict(
+            (c.id, c.cpu_usage) for c in self.chip.cores if c.id in queues
+        )
+
+        def busy(c):
+            return len(queues[c]), usage[c]
+
+        moves = []
+        while len(moves) < self.max_moves:
+            src = max(self.cores, key=busy)
+            dst = min(self.cores, key=busy)
+            if len(queues[src]) - len(queues[dst]) < 2 or \
+                    usage[src] < self.high or usage[dst] > self.low:
+                break
+
+            candidates = [t for t in queues[src]
+                if now - self.moved.get(t.tid, 0) >= self.cooldown]
+            if not candidates:
+                break
+
+            # Moving the most demanding task relieves the core the most
+            t = max(candidates, key=lambda t: t.cpu_usage)
+            queues[src].remove(t)
+            queues[dst].append(t)
+            demand = min(100., t.cpu_usage)
+            usage[src] -= demand
+            usage[dst] += demand
+            moves.append((t, src, dst))
+
+        return moves
+
+    def apply(self, moves, now):
+        """Apply the planned moves through the chip."""
+        placement = self.chip.placement
+        for t, src, dst in moves:
+            try:
+                moved = self.chip.move_task(t.tid, dst)
+            except Exception as e:
+                self.logger.warning("Could not move %s: %s" % (t.tid, e))
+                moved = False
+
+            if moved:
+                placement.add(dst)
+                placement.add(src, -1)
+                self.logger.info("Moved %s from core %d to core %d" %
+                    (t.tid, src, dst))
+            self.moved[t.tid] = now
+
+            entry = {
+                "Time": now,
+                "ID": t.tid,
+                "From": src,
+                "To": dst,
+                "Success": bool(moved)
+            }
+            self.log.append(entry)
+
+            if self.callback:
+                self.callback(entry)
+
+    def balance(self):
+        """Inspect the cores once and move tasks when needed."""
+        now = time()
+
+        # Forget the tasks whose cooldown has passed
+        for tid, moved in self.moved.items():
+            if now - moved >= self.cooldown:
+                del self.moved[tid]
+
+        moves = self.plan(now)
+        if not moves:
+            self.streak = 0
+            return
+
+        self.streak += 1
+        if self.streak >= self.persistence:
+            self.streak = 0
+            self.apply(moves, now)
+
+    def run(self):
+        """Keep balancing on the configured interval."""
+        while self.running:
+            self._stop_event.wait(self.interval)
+            if not self.running:
+                break
+
+            try:
+                self.balance()
+            except Exception as e:
+                self.logger.warning("Exception while balancing: %s" % e)
+
+    def stop(self):
+        """Stop balancing."""
+        self.running = False
+        self._stop_event.set()
@@ -22,9 +22,12 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from core import Core, Status as CoreStatus
 from random import randint
 from math import floor
-import subprocess as sp
-from task import Task
-from threading import Thread
+from placement import PlacementIndex, core_loads
+from reactor import OutputReactor
+from sampler import CoreSampler, EcoreStatusReader
+from sensors import TemperatureSampler, XADC_PATH
+from task import Task, Status as TaskStatus
+from threading import Thread, Lock
 from time import sleep
 import logging
 import sys
@@ -62,10 +65,14 @@ class Chip(Thread):
         self.cores = []
         self.tasks = dict()
         self.dummy_mode = kwargs.get('dummy_mode', False)
+        self.sampler = None
+        self.reactor = None
+        self.temp_sampler = None
 
         self.running = True
         self.status = Status.PENDING
         self.task_count = 0
+        self.task_lock = Lock()
         self.temp = 0.0
 
         if self.frequency_tables:
@@ -78,6 +85,33 @@ class Chip(Thread):
             for i in range(cores):
                 self.cores.append(Core(i, dummy_mode=self.dummy_mode))
 
+        if not self.dummy_mode:
+            self.reactor = OutputReactor()
+            self.reactor.start()
+
+            # Only the ARM cores are listed in /proc/stat, the eCores are
+            # read from the status file of the Epiphany resource manager
+            self.sampler = CoreSampler(
+                [c for c in self.cores if not c.eCore],
+                tasks=self.tasks,
+                ecore_status=EcoreStatusReader(
+                    [c for c in self.cores if c.eCore],
+                    '%secore.status' % self.epiphany_status_dir
+                ),
+                interval=1. / kwargs.get('sample_frequency', 1)
+            )
+
+            self.temp_sampler = TemperatureSampler(
+                path=kwargs.get('temp_sensor_path', XADC_PATH),
+                interval=1. / kwargs.get('temp_sample_frequency', 10),
+                smoothing=kwargs.get('temp_smoothing', .3)
+            )
+
+        # Load of every core for smart placement, per frequency island
+        self.placement = PlacementIndex(
+            kwargs.get('clusters', voltage_islands)
+        )
+        self.update_placement()
 
         self.status = Status.CONNECTING
         self.start()
@@ -111,7 +145,9 @@ class Chip(Thread):
 
     def run(self):
         """Setup the connection to all cores and retrieve temperature."""
-
+        if not self.dummy_mode:
+            self.sampler.start()
+            self.temp_sampler.start()
 
         while self.running:
             sleep(1)
@@ -129,88 +165,144 @@ class Chip(Thread):
                 if all_active:
                     self.status = Status.RUNNING
             else:
-                # self.get_usage()
                 self.get_temp()
 
+            # The placement index is refreshed once per tick
+            self.update_placement()
+
     def stop(self):
         """Stop the chip control."""
         self.status = Status.EXITING
         self.running = False
 
+        if self.sampler:
+            self.sampler.stop()
+
+        if self.temp_sampler:
+            self.temp_sampler.stop()
+
         # Stop all cores and tasks
         for core in self.cores:
             for task in core.tasks.values():
-                self.logger.debug("Joining task %s..." % task.name)
+                self.logger.debug("Joining task %s..." % task.tid)
                 task.kill()
                 task.join()
                 self.logger.debug("Joined")
-            self.logger.debug("Joining core %s..." % core)
-            core.join()
-            self.logger.debug("Joined")
 
+        if self.reactor:
+            self.reactor.stop()
 
-    def get_usage(self):
-        if not self.dummy_mode:
-            ecore_status = open('%secore.status' % self.epiphany_status_dir, 'r')
-            lines = ecore_status.readlines()
-            for core in self.cores[2:]:
-                core.cpu_usage = float(lines[core.id-2].split()[2]) / 31.0 * 100.0
-
-            ecore_status.close()
 
     def get_temp(self):
         """Retrieve the Zynq chip's temperature."""
         if not self.dummy_mode:
-
-            p = sp.Popen('sudo /home/linaro/Documents/ManyMan/Para_backend/gettemp',
-                shell=True,
-                stdout=sp.PIPE,
-                stderr=sp.PIPE
-            )
-            # Show output, if any
-            out, err = p.communicate()
-            if len(err) > 0:
-                self.logger.warning(
-                    "Error when retrieving temperature: %s" % err
-                )
-
-            for line in out.split('\n'):
-                if "Current Temp" in line:
-                    self.temp = float(line.split()[3])
-        
+            # The sensor is sampled in the background by the temp sampler
+            if self.temp_sampler.temp is not None:
+                self.temp = self.temp_sampler.temp
         else:
             self.temp = 35.
-     
+
+    def update_placement(self):
+        """Snapshot the load of every core into the placement index."""
+        self.placement.update(core_loads(self.cores, self.tasks.values()))
+
+    def new_task_id(self):
+        """
+        Return a new task ID. Commands are executed concurrently, so the
+        task count is incremented under a lock.
+        """
+        with self.task_lock:
+            self.task_count += 1
+            return "T%04d" % self.task_count
 
     def add_task(self, name, program, core):
         """Add a task with the given name and program to the given core."""
-        self.task_count += 1
-        task_id = "T%04d" % self.task_count
+        if not 0 <= core < len(self.cores):
+            raise Exception("Invalid core %d." % core)
+        c = self.cores[core]
+
+        task_id = self.new_task_id()
         self.logger.debug("Adding task %s" % task_id)
-        t = Task(task_id, core, name, program, dummy_mode=self.dummy_mode)
-        self.cores[core].add_task(t)
+        t = Task(task_id, core, name, program, dummy_mode=self.dummy_mode,
+            reactor=self.reactor)
+        c.add_task(t)
         self.tasks[task_id] = t
         return task_id
 
+    def add_tasks(self, specs):
+        """
+        Add the tasks in 'specs', a list of (name, program, core) tuples.
+        Returns the IDs of the new tasks.
+        """
+        return [self.add_task(name, program, core)
+            for name, program, core in specs]
+
     def move_task(self, tid, to_core):
-        """Move the task with given Task ID (tid) to core 'to_core'."""
+        """
+        Move the task with given Task ID (tid) to core 'to_core'. Returns
+        whether the task was moved.
+        """
         t = self.tasks[tid]
         if to_core < 0:
             if self.cores[t.core].pause_task(t):
                 self.cores[t.core].tasks.pop(t.tid)
                 t.core = -1
+                return True
         elif not self.cores[to_core].eCore:
             self.cores[t.core].move_task(t, self.cores[to_core])
+            return True
+        return False
+
+    def move_tasks(self, moves):
+        """
+        Move the tasks in 'moves', a list of (tid, to_core) tuples, in one
+        pass. Returns the IDs of the moved tasks.
+        """
+        moved = []
+        for tid, to_core in moves:
+            if self.move_task(tid, to_core):
+                moved.append(tid)
+        return moved
+
+    def wait_for(self, tasks, status):
+        """
+        Wait until all given tasks have reached the given status, or have
+        ended. Returns the IDs of the tasks that reached the status.
+        """
+        ended = (TaskStatus.KILLED, TaskStatus.FINISHED, TaskStatus.FAILED)
+        for t in tasks:
+            while t.status != status and t.status not in ended:
+                # Allow for a context switch
+                sleep(.1)
+        return [t.tid for t in tasks if t.status == status]
 
     def pause_task(self, tid):
         """Pause the task with ID 'tid'."""
         t = self.tasks[tid]
-        self.cores[t.core].pause_task(t)
+        return self.cores[t.core].pause_task(t)
 
     def resume_task(self, tid):
         """Resume the task with ID 'tid'."""
         t = self.tasks[tid]
-        self.cores[t.core].resume_task(t)
+        return self.cores[t.core].resume_task(t)
+
+    def pause_tasks(self, tids):
+        """
+        Pause the tasks with the IDs in 'tids'. All tasks are signalled
+        before waiting for any of them. Returns the IDs of the paused tasks.
+        """
+        tasks = [self.tasks[tid] for tid in tids]
+        stopped = [t for t in tasks if t.stop()]
+        return self.wait_for(stopped, TaskStatus.STOPPED)
+
+    def resume_tasks(self, tids):
+        """
+        Resume the tasks with the IDs in 'tids'. All tasks are signalled
+        before waiting for any of them. Returns the IDs of the resumed tasks.
+        """
+        tasks = [self.tasks[tid] for tid in tids]
+        continued = [t for t in tasks if t.cont()]
+        return self.wait_for(continued, TaskStatus.RUNNING)
 
     def kill_task(self, tid):
         """Kill the task with ID 'tid'."""
@@ -220,20 +312,36 @@ class Chip(Thread):
             self.tasks.pop(t.tid)
             return output
 
+    def kill_tasks(self, tids):
+        """
+        Kill the tasks with the IDs in 'tids'. All tasks are signalled
+        before any of them is joined. Returns the output of every killed
+        task, keyed by its ID.
+        """
+        tasks = [self.tasks[tid] for tid in tids]
+        killed = [t for t in tasks if t.kill()]
+
+        outputs = dict()
+        for t in killed:
+            t.join()
+            outputs[t.tid] = t.output
+            self.tasks.pop(t.tid)
+        return outputs
+
     def duplicate_task(self, tid):
         """Duplicate the task with ID 'tid'."""
         t = self.tasks[tid]
         if t.core >= 0:
             raise Exception("Running tasks cannot be duplicated.")
 
-        self.task_count += 1
-        task_id = "T%04d" % self.task_count
+        task_id = self.new_task_id()
         d = Task(
             task_id,
             -1,
             t.pname,
             t.program,
             dummy_mode=t.dummy_mode,
+            reactor=self.reactor,
             status=t._status
         )
         d.output = t.output
@@ -21,10 +21,8 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from random import randint
 from task import Status as TaskStatus
-from threading import Thread
 from time import sleep
 import logging
-import subprocess as sp
 
 class Status:
     """Core statuses."""
@@ -42,7 +40,7 @@ class Status:
         return self.names[self.value]
 
 
-class Core(Thread):
+class Core(object):
     """Core object, containing all information about a core."""
 
     def __init__(self, core, **kwargs):
@@ -67,12 +65,8 @@ class Core(Thread):
 
         self._voltage = 1.
 
-        Thread.__init__(self)
-
         self.setup()
 
-        self.start()
-
     def __repr__(self):
         if self.status != Status.RUNNING:
             return "Core %d: connection not yet established." % self.id
@@ -116,64 +110,26 @@ class Core(Thread):
             return dict_repr
 
     def setup(self):
-        """Execute mpstat on the given core."""
+        """
+        Prepare the core. The utilization of the ARM cores is published by
+        the chip's CoreSampler.
+        """
         self.status = Status.CONNECTING
 
-        if not self.dummy_mode:
-            if not self.eCore:
-                self.p = sp.Popen(
-                    'mpstat -P %d 1' % self.id,
-                    shell=True,
-                    stdout=sp.PIPE,
-                    stderr=sp.STDOUT
-                )
-
-
-    def run(self):
-        """Continuously read the output of mpstat."""
-        if self.dummy_mode:
+        if self.dummy_mode or self.eCore:
             self.status = Status.RUNNING
-            return
-
-        while 1:
-            if not self.eCore:
-                line = self.p.stdout.readline()
-
-                if not line:
-                    break
-            else:
-                self.status = Status.RUNNING
-                return
 
-            if self.status == Status.CONNECTING:
-                self.status = Status.RUNNING
+    def update_usage(self, cpu_usage):
+        """
+        Set the CPU usage as measured by the chip's CoreSampler and the
+        memory usage of this core's tasks.
+        """
+        self.cpu_usage = cpu_usage
 
-            for task in self.tasks.values():
-                try:
-                    if task.status != TaskStatus.KILLING and task.p_top != None:
-                        task_line = task.p_top.stdout.readline()
-                        if task_line:
-                            task.parse_perf(task_line)                
-                except:
-                    continue
-  
-            if not self.eCore:          
-                self.parse_perf(line)
-            
-
-    def parse_perf(self, line):
-        """Retrieve the process data from mpstat's output."""
-        
-        stats = line.split()
-        if len(stats) >= 4:
-            if stats[1] in ("PM", "AM"):
-                if stats[2] == str(self.id):
-                    self.cpu_usage = float(stats[3].replace(",", "."))
-                    # self.logger.debug("Core %d CPU_usage: %f" % (self.id, self.cpu_usage))
-            elif stats[1] == str(self.id):
-                self.cpu_usage = float(stats[2].replace(",", "."))
-                # self.logger.debug("Core %d CPU_usage: %f" % (self.id, self.cpu_usage))
+        if self.status == Status.CONNECTING:
+            self.status = Status.RUNNING
 
+        # The tasks have been sampled in the same tick
         total_mem = 0
         for task in self.tasks.values():
             total_mem += task.mem_usage
@@ -189,6 +145,7 @@ class Core(Thread):
     def move_task(self, t, to_core):
         """Move the given task 't' to core 'to_core'.""" 
         t.move(to_core.id)
+        self.tasks.pop(t.tid, None)
         to_core.add_task(t)
 
 
@@ -211,6 +168,9 @@ class Core(Thread):
                 # Allow for a context switch
                 sleep(.1)
                 pass
+            return True
+        else:
+            return False
 
     def kill_task(self, t):
         """Kill the given task."""
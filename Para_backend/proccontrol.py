@@ -0,0 +1,152 @@
+"""
+ManyMan - A Many-core Visualization and Management System
+Copyright (C) 2015
+University of Amsterdam - Computer Systems Architecture
+Jimi van der Woning and Roy Bakker
+Extended for Parallella by: Floris Turkenburg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import subprocess as sp
+
+PROC_PATH = "/proc"
+CPU_SETSIZE = 1024
+NCPUBITS = 8 * ctypes.sizeof(ctypes.c_ulong)
+
+# Locations of coreutils' stdbuf preload library, which sets the buffering
+# mode of the standard streams of the program it is preloaded into.
+LIBSTDBUF_PATHS = (
+    "/usr/lib/coreutils/libstdbuf.so",
+    "/usr/libexec/coreutils/libstdbuf.so",
+    "/usr/lib/arm-linux-gnueabihf/coreutils/libstdbuf.so",
+    "/usr/lib/x86_64-linux-gnu/coreutils/libstdbuf.so"
+)
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+
+class cpu_set_t(ctypes.Structure):
+    """The kernel's cpu_set_t bitmask."""
+    _fields_ = [('bits', ctypes.c_ulong * (CPU_SETSIZE / NCPUBITS))]
+
+
+def find_libstdbuf():
+    """Return the path of libstdbuf, or None when it is not installed."""
+    for path in LIBSTDBUF_PATHS:
+        if os.path.exists(path):
+            return path
+    return None
+
+LIBSTDBUF = find_libstdbuf()
+
+
+def set_affinity(pid, cpus):
+    """
+    Restrict the thread or process with the given pid (0 for the calling
+    thread) to the given list of cpus.
+    """
+    mask = cpu_set_t()
+    for cpu in cpus:
+        mask.bits[cpu / NCPUBITS] |= 1 << (cpu % NCPUBITS)
+
+    if _libc.sched_setaffinity(pid, ctypes.sizeof(mask), ctypes.byref(mask)):
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+
+
+def thread_ids(pid, path=PROC_PATH):
+    """Return the ids of all threads of the process 'pid'."""
+    try:
+        return [int(t) for t in os.listdir('%s/%d/task' % (path, pid))]
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            raise OSError(errno.ESRCH, os.strerror(errno.ESRCH))
+        raise
+
+
+def sudo(argv):
+    """
+    Execute the command in 'argv' through sudo. Only used for processes
+    that are owned by root, i.e. the Epiphany programs.
+    """
+    p = sp.Popen(['sudo', '-n'] + argv, stdout=sp.PIPE, stderr=sp.PIPE)
+    out, err = p.communicate()
+    if p.returncode != 0:
+        raise OSError(errno.EPERM, err.strip() or os.strerror(errno.EPERM))
+
+
+def set_process_affinity(pid, cpus):
+    """Restrict all threads of the process 'pid' to the given cpus."""
+    try:
+        for tid in thread_ids(pid):
+            try:
+                set_affinity(tid, cpus)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+                # The thread has exited in the meantime
+    except OSError as e:
+        if e.errno != errno.EPERM:
+            raise
+        sudo(['taskset', '-apc', ','.join(map(str, cpus)), str(pid)])
+
+
+def signal_group(pgid, sig):
+    """
+    Send the signal 'sig' to all processes in the process group 'pgid'.
+    Returns False when the group no longer exists.
+    """
+    try:
+        os.killpg(pgid, sig)
+    except OSError as e:
+        if e.errno == errno.ESRCH:
+            return False
+        if e.errno != errno.EPERM:
+            raise
+        sudo(['kill', '-%d' % sig, '--', '-%d' % pgid])
+    return True
+
+
+def spawn(argv, cpus, **kwargs):
+    """
+    Start the program in 'argv' on the given cpus, in a new process group
+    and, unless 'line_buffered' is False, with a line-buffered stdout. The
+    program is executed directly, so the pid of the returned Popen object
+    is the pid of the program.
+    """
+    env = kwargs.pop('env', None)
+    if env is None:
+        env = os.environ.copy()
+
+    if kwargs.pop('line_buffered', True):
+        if LIBSTDBUF:
+            env['LD_PRELOAD'] = ' '.join(
+                filter(None, [LIBSTDBUF, env.get('LD_PRELOAD')])
+            )
+            env['_STDBUF_O'] = 'L'
+        else:
+            argv = ['stdbuf', '-oL'] + list(argv)
+
+    def setup():
+        # Executed in the child, between fork and exec
+        os.setpgrp()
+        set_affinity(0, cpus)
+
+    return sp.Popen(argv, env=env, preexec_fn=setup, close_fds=True,
+        **kwargs)
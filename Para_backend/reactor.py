@@ -0,0 +1,176 @@
+"""
+ManyMan - A Many-core Visualization and Management System
+Copyright (C) 2015
+University of Amsterdam - Computer Systems Architecture
+Jimi van der Woning and Roy Bakker
+Extended for Parallella by: Floris Turkenburg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from threading import Thread, Lock
+import errno
+import fcntl
+import logging
+import os
+import select
+
+READ_SIZE = 65536
+
+if hasattr(select, 'epoll'):
+    POLL_IN = select.EPOLLIN
+    POLL_HUP = select.EPOLLHUP | select.EPOLLERR
+else:
+    POLL_IN = select.POLLIN
+    POLL_HUP = select.POLLHUP | select.POLLERR
+
+
+def set_nonblocking(fd):
+    """Put the file descriptor 'fd' in non-blocking mode."""
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+class OutputReactor(Thread):
+    """
+    Single I/O reactor for the output pipes of all tasks. Ready pipes are
+    read in large non-blocking chunks, split into lines and handed to their
+    task through task.process_line(line). Once a pipe reaches EOF the task
+    is notified through task.process_eof(pipe).
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger('OutputReactor')
+
+        if hasattr(select, 'epoll'):
+            self.poller = select.epoll()
+        else:
+            self.poller = select.poll()
+
+        self.running = True
+        self.pipes = dict()
+        self.lock = Lock()
+
+        # Self-pipe to wake up the poller on (un)registration and stop
+        self._wake_r, self._wake_w = os.pipe()
+        set_nonblocking(self._wake_r)
+        set_nonblocking(self._wake_w)
+        self.poller.register(self._wake_r, POLL_IN)
+
+        Thread.__init__(self)
+        self.daemon = True
+
+    def register(self, task, pipe):
+        """Start reading the given output pipe of the given task."""
+        fd = pipe.fileno()
+        set_nonblocking(fd)
+
+        with self.lock:
+            self.pipes[fd] = [task, pipe, ""]
+            self.poller.register(fd, POLL_IN | POLL_HUP)
+
+        self._wake()
+
+    def unregister(self, fd):
+        """Stop reading the pipe with file descriptor 'fd'."""
+        with self.lock:
+            entry = self.pipes.pop(fd, None)
+            if entry is not None:
+                try:
+                    self.poller.unregister(fd)
+                except (KeyError, IOError, OSError, ValueError):
+                    pass
+        return entry
+
+    def _wake(self):
+        """Interrupt a blocking poll."""
+        try:
+            os.write(self._wake_w, "x")
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def _read(self, fd):
+        """Read all available data from the pipe 'fd'."""
+        entry = self.pipes.get(fd)
+        if entry is None:
+            return
+
+        task, pipe, partial = entry
+        eof = False
+        chunks = [partial]
+        while 1:
+            try:
+                data = os.read(fd, READ_SIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                data = ""
+
+            if not data:
+                eof = True
+                break
+            chunks.append(data)
+
+        lines = "".join(chunks).split('\n')
+        entry[2] = lines.pop()
+
+        done = False
+        for line in lines:
+            if task.process_line("%s\n" % line) is False:
+                # The task is not interested in any further output
+                done = True
+                break
+
+        if eof and entry[2] and not done:
+            # Hand over the last line, even when it was not terminated
+            task.process_line(entry[2])
+
+        if eof or done:
+            self.unregister(fd)
+            task.process_eof(pipe)
+
+    def run(self):
+        """Dispatch the output of all registered pipes."""
+        while self.running:
+            try:
+                events = self.poller.poll(-1)
+            except (IOError, OSError, select.error) as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for fd, event in events:
+                if fd == self._wake_r:
+                    try:
+                        while os.read(self._wake_r, READ_SIZE):
+                            pass
+                    except OSError:
+                        pass
+                    continue
+
+                try:
+                    self._read(fd)
+                except Exception as e:
+                    self.logger.warning(
+                        "Exception while reading task output: %s" % e
+                    )
+                    entry = self.unregister(fd)
+                    if entry is not None:
+                        entry[0].process_eof(entry[1])
+
+    def stop(self):
+        """Stop the reactor."""
+        self.running = False
+        self._wake()
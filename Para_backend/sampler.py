@@ -0,0 +1,468 @@
+"""
+ManyMan - A Many-core Visualization and Management System
+Copyright (C) 2015
+University of Amsterdam - Computer Systems Architecture
+Jimi van der Woning and Roy Bakker
+Extended for Parallella by: Floris Turkenburg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from task import Status as TaskStatus
+from threading import Thread, Event
+from time import time
+import errno
+import logging
+import os
+
+PROC_PATH = "/proc"
+PROC_STAT = "/proc/stat"
+READ_SIZE = 65536
+
+# Task statuses in which the task's process exists and can be sampled
+SAMPLED_STATUSES = (
+    TaskStatus.RUNNING,
+    TaskStatus.STOPPING,
+    TaskStatus.STOPPED,
+    TaskStatus.CONTINUING
+)
+
+
+def read_file(fd):
+    """Read the full contents of the kept-open file descriptor 'fd'."""
+    os.lseek(fd, 0, os.SEEK_SET)
+    chunks = []
+    while 1:
+        chunk = os.read(fd, READ_SIZE)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return "".join(chunks)
+
+
+def parse_proc_stat(data, busy, total):
+    """
+    Parse the per-cpu lines of /proc/stat into the lists 'busy' and 'total',
+    indexed by cpu number. Both lists are grown when needed.
+    """
+    for line in data.split('\n'):
+        if not line.startswith('cpu') or line[3:4] in ('', ' '):
+            # Skip the aggregated 'cpu' line and all non-cpu lines
+            continue
+
+        fields = line.split()
+        cpu = int(fields[0][3:])
+
+        # user nice system idle iowait irq softirq steal; the guest times
+        # are already accounted for in user and nice.
+        values = map(int, fields[1:9])
+        t = sum(values)
+        idle = sum(values[3:5])
+
+        while len(total) <= cpu:
+            busy.append(0)
+            total.append(0)
+        busy[cpu] = t - idle
+        total[cpu] = t
+
+
+def parse_pid_stat(data):
+    """
+    Parse the contents of /proc/<pid>/stat. Returns a tuple of the parent's
+    process id, the used cpu time in jiffies (utime + stime), the cpu time
+    of the waited-for children (cutime + cstime), the number of threads and
+    the process' start time.
+    """
+    # The command name may contain spaces, so split after its closing ')'
+    fields = data[data.rfind(')') + 2:].split()
+    return int(fields[1]), int(fields[11]) + int(fields[12]), \
+        int(fields[13]) + int(fields[14]), int(fields[17]), int(fields[19])
+
+
+def read_mem_total(path):
+    """Read the total amount of memory in kB from /proc/meminfo."""
+    f = open(os.path.join(path, 'meminfo'), 'r')
+    try:
+        for line in f:
+            if line.startswith('MemTotal:'):
+                return int(line.split()[1])
+    finally:
+        f.close()
+    return 0
+
+
+class ProcessTree:
+    """
+    Index of the parent of every process in /proc. The index is refreshed
+    incrementally: only the stat files of processes that appeared since the
+    last refresh are read.
+    """
+
+    def __init__(self, **kwargs):
+        self.path = kwargs.get('path', PROC_PATH)
+
+        # Parent process id, keyed by pid
+        self.parents = dict()
+        self.children = dict()
+
+    def _read_parent(self, pid):
+        """Read the parent's process id of the process 'pid'."""
+        f = open(os.path.join(self.path, str(pid), 'stat'), 'r')
+        try:
+            return parse_pid_stat(f.read())[0]
+        finally:
+            f.close()
+
+    def set_parent(self, pid, ppid):
+        """Update the parent of 'pid', e.g. after it has been reparented."""
+        if pid in self.parents:
+            self.parents[pid] = ppid
+
+    def refresh(self):
+        """Rebuild the index from the current contents of /proc."""
+        parents = dict()
+        for entry in os.listdir(self.path):
+            if not entry.isdigit():
+                continue
+
+            pid = int(entry)
+            ppid = self.parents.get(pid)
+            if ppid is None or ppid not in self.parents:
+                # A new process, or one whose parent has exited since
+                try:
+                    ppid = self._read_parent(pid)
+                except (IOError, OSError, ValueError, IndexError):
+                    # The process has ended in the meantime
+                    continue
+            parents[pid] = ppid
+
+        children = dict()
+        for pid, ppid in parents.iteritems():
+            children.setdefault(ppid, []).append(pid)
+
+        self.parents = parents
+        self.children = children
+
+    def descendants(self, pid):
+        """Return the process 'pid' followed by all of its descendants."""
+        if pid not in self.parents:
+            return []
+
+        pids = [pid]
+        i = 0
+        while i < len(pids):
+            pids.extend(self.children.get(pids[i], ()))
+            i += 1
+        return pids
+
+
+class TaskSampler:
+    """
+    Samples the CPU and memory usage of all tracked tasks from
+    /proc/<pid>/stat and /proc/<pid>/statm in one pass. The usage of a task
+    is summed over its process and all of its descendants.
+    """
+
+    def __init__(self, **kwargs):
+        self.logger = logging.getLogger('TaskSampler')
+
+        self.path = kwargs.get('path', PROC_PATH)
+        self.clock_ticks = float(os.sysconf('SC_CLK_TCK'))
+        self.page_size = os.sysconf('SC_PAGE_SIZE') / 1024.
+        self.mem_total = kwargs.get('mem_total') or \
+            read_mem_total(self.path)
+        self.tree = kwargs.get('tree', None) or ProcessTree(path=self.path)
+
+        # Kept-open descriptors keyed by pid, and the previous sample keyed
+        # by the pid of the task's process
+        self._fds = dict()
+        self._prev = dict()
+
+    def _open(self, pid):
+        """Open the stat and statm files of the process with given pid."""
+        base = os.path.join(self.path, str(pid))
+        stat = os.open(os.path.join(base, 'stat'), os.O_RDONLY)
+        try:
+            statm = os.open(os.path.join(base, 'statm'), os.O_RDONLY)
+        except OSError:
+            os.close(stat)
+            raise
+        self._fds[pid] = (stat, statm)
+        return stat, statm
+
+    def _close(self, pid):
+        """Forget the process with given pid."""
+        for fd in self._fds.pop(pid, ()):
+            os.close(fd)
+
+    def _sample_process(self, pid):
+        """
+        Sample a single process. Returns a tuple of the cumulative cpu time
+        in jiffies, the number of threads, the resident set size in pages
+        and the start time, or None when the process has ended.
+        """
+        try:
+            stat, statm = self._fds.get(pid) or self._open(pid)
+            ppid, jiffies, child_jiffies, threads, start = \
+                parse_pid_stat(read_file(stat))
+            rss = int(read_file(statm).split()[1])
+        except (IOError, OSError, ValueError, IndexError):
+            self._close(pid)
+            return None
+
+        self.tree.set_parent(pid, ppid)
+        return jiffies + child_jiffies, threads, rss, start
+
+    def sample(self, tasks):
+        """Update the CPU and memory usage of the given tasks."""
+        now = time()
+        seen = set()
+        roots = set()
+
+        self.tree.refresh()
+
+        for task in tasks:
+            if task.status not in SAMPLED_STATUSES:
+                continue
+
+            try:
+                root = task.pid
+            except Exception:
+                # The process id is not known (yet)
+                continue
+
+            pids = []
+            jiffies = threads = rss = 0
+            start = None
+            for pid in self.tree.descendants(root):
+                sample = self._sample_process(pid)
+                if sample is None:
+                    continue
+                if pid == root:
+                    start = sample[3]
+
+                seen.add(pid)
+                pids.append(pid)
+                jiffies += sample[0]
+                threads += sample[1]
+                rss += sample[2]
+
+            if start is None:
+                # The task's process has ended in the meantime
+                continue
+            roots.add(root)
+
+            # Time spent by reaped children moves into their parent's
+            # cutime and cstime, so the sum only drops when a process
+            # leaves the tree without being waited for.
+            prev = self._prev.get(root)
+            if prev and prev[2] == start and now > prev[1]:
+                task.cpu_usage = max(
+                    0.0,
+                    100.0 * (jiffies - prev[0]) / self.clock_ticks /
+                        (now - prev[1])
+                )
+            self._prev[root] = (jiffies, now, start)
+
+            task.pids = pids
+            task.threads = threads
+            task.rss = int(rss * self.page_size)
+            if self.mem_total > 0:
+                task.mem_usage = 100.0 * task.rss / self.mem_total
+
+        for pid in self._fds.keys():
+            if pid not in seen:
+                self._close(pid)
+        for root in self._prev.keys():
+            if root not in roots:
+                del self._prev[root]
+
+    def close(self):
+        """Close all kept-open descriptors."""
+        for pid in self._fds.keys():
+            self._close(pid)
+        self._prev.clear()
+
+
+class EcoreStatusReader:
+    """
+    Reads the utilization of the eCores from the ecore.status file written
+    by the Epiphany resource manager. The file is kept open and only read
+    again when its inode, size or modification time has changed. It is not
+    memory-mapped, since the resource manager rewrites it in place and
+    reading a mapping of a file that has shrunk raises SIGBUS.
+    """
+
+    def __init__(self, cores, path):
+        self.logger = logging.getLogger('EcoreStatusReader')
+
+        # The eCores in the order of the rows of the status file
+        self.cores = cores
+        self.path = path
+
+        self._fd = None
+        self._stat = None
+
+    def _reopen(self):
+        """Open the current version of the file."""
+        self.close()
+        self._fd = os.open(self.path, os.O_RDONLY)
+
+    def read(self):
+        """
+        Update the utilization of the eCores when the file has changed.
+        Returns whether the file was parsed.
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            # The resource manager is not running
+            self.close()
+            self._stat = None
+            return False
+
+        key = (st.st_ino, st.st_size, st.st_mtime)
+        if key == self._stat:
+            return False
+
+        if self._fd is None or key[0] != self._stat[0]:
+            # The file has been replaced
+            self._reopen()
+        self._stat = key
+
+        # Every row holds the utilization in its third column, on a scale
+        # from 0 to 31
+        data = read_file(self._fd)
+        start = 0
+        for core in self.cores:
+            end = data.find('\n', start)
+            if end < 0:
+                end = len(data)
+            fields = data[start:end].split()
+            if len(fields) > 2:
+                core.update_usage(float(fields[2]) / 31.0 * 100.0)
+            start = end + 1
+            if start >= len(data):
+                break
+
+        return True
+
+    def close(self):
+        """Close the file."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class CoreSampler(Thread):
+    """
+    Chip-level sampler that reads /proc/stat once per tick and publishes the
+    utilization of every core to its Core object. The tasks in 'tasks' are
+    sampled on the same tick by a TaskSampler, and the eCores by the
+    optional EcoreStatusReader 'ecore_status'.
+    """
+
+    def __init__(self, cores, **kwargs):
+        self.logger = logging.getLogger('CoreSampler')
+
+        self.cores = cores
+        self.tasks = kwargs.get('tasks', dict())
+        self.interval = kwargs.get('interval', 1.)
+        self.path = kwargs.get('path', PROC_STAT)
+        self.task_sampler = kwargs.get('task_sampler', None) or TaskSampler()
+        self.ecore_status = kwargs.get('ecore_status', None)
+
+        self.running = True
+        self._stop_event = Event()
+        self._fd = None
+        self._busy = []
+        self._total = []
+        self.usage = []
+
+        Thread.__init__(self)
+        self.daemon = True
+
+    def sample(self):
+        """Take one sample and compute the utilization since the last one."""
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDONLY)
+
+        busy, total = [], []
+        parse_proc_stat(read_file(self._fd), busy, total)
+
+        prev_busy, prev_total = self._busy, self._total
+        usage = [0.0] * len(total)
+        for cpu in xrange(min(len(total), len(prev_total))):
+            d_total = total[cpu] - prev_total[cpu]
+            if d_total > 0:
+                usage[cpu] = min(
+                    100.0,
+                    max(0.0, 100.0 * (busy[cpu] - prev_busy[cpu]) / d_total)
+                )
+
+        self._busy, self._total = busy, total
+        self.usage = usage
+        return usage
+
+    def publish(self, usage):
+        """Hand the sampled utilization to all cores."""
+        self.task_sampler.sample(self.tasks.values())
+
+        for core in self.cores:
+            if core.id < len(usage):
+                core.update_usage(usage[core.id])
+            else:
+                # Offline cpus are absent from /proc/stat
+                core.update_usage(0.0)
+
+        if self.ecore_status:
+            try:
+                self.ecore_status.read()
+            except (IOError, OSError, ValueError) as e:
+                self.logger.warning(
+                    "Could not read %s: %s" % (self.ecore_status.path, e)
+                )
+
+    def run(self):
+        """Keep sampling on the configured interval."""
+        try:
+            # Prime the counters, the first deltas are taken one tick later
+            self.sample()
+        except (IOError, OSError) as e:
+            self.logger.critical("Could not read %s: %s" % (self.path, e))
+            return
+
+        while self.running:
+            self._stop_event.wait(self.interval)
+            if not self.running:
+                break
+
+            try:
+                self.publish(self.sample())
+            except (IOError, OSError, ValueError) as e:
+                self.logger.warning("Could not sample %s: %s" % (self.path, e))
+
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self.task_sampler.close()
+        if self.ecore_status:
+            self.ecore_status.close()
+
+    def stop(self):
+        """Stop sampling."""
+        self.running = False
+        self._stop_event.set()
@@ -0,0 +1,128 @@
+"""
+ManyMan - A Many-core Visualization and Management System
+Copyright (C) 2015
+University of Amsterdam - Computer Systems Architecture
+Jimi van der Woning and Roy Bakker
+Extended for Parallella by: Floris Turkenburg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from collections import deque
+from sampler import read_file
+from threading import Thread, Event
+from time import time
+import logging
+import os
+
+# IIO device of the Zynq's XADC
+XADC_PATH = "/sys/bus/iio/devices/iio:device0"
+
+
+class TemperatureSensor:
+    """
+    The XADC temperature sensor. The offset and scale are read once, the
+    raw value is re-read from a kept-open descriptor on every sample.
+    """
+
+    def __init__(self, path=XADC_PATH):
+        self.path = path
+        self.offset = None
+        self.scale = None
+        self._fd = None
+
+    def _read_value(self, name):
+        """Read a single value from the sensor's directory."""
+        f = open(os.path.join(self.path, name), 'r')
+        try:
+            return f.read().strip()
+        finally:
+            f.close()
+
+    def open(self):
+        """Read the sensor's constants and open its raw value."""
+        self.offset = int(self._read_value('in_temp0_offset'))
+        self.scale = float(self._read_value('in_temp0_scale'))
+        self._fd = os.open(
+            os.path.join(self.path, 'in_temp0_raw'),
+            os.O_RDONLY
+        )
+
+    def read(self):
+        """Return the current temperature in degrees Celsius."""
+        if self._fd is None:
+            self.open()
+        raw = int(read_file(self._fd))
+        return (raw + self.offset) * self.scale / 1000.
+
+    def close(self):
+        """Close the raw value."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class TemperatureSampler(Thread):
+    """
+    Samples the chip's temperature on a fixed interval. The last reading is
+    kept in 'raw_temp', an exponentially smoothed value in 'temp' and the
+    most recent smoothed values, as (time, temperature) tuples, in
+    'history'.
+    """
+
+    def __init__(self, **kwargs):
+        self.logger = logging.getLogger('TemperatureSampler')
+
+        self.sensor = TemperatureSensor(kwargs.get('path', XADC_PATH))
+        self.interval = kwargs.get('interval', .1)
+        self.smoothing = kwargs.get('smoothing', .3)
+        self.history = deque(maxlen=kwargs.get('history', 600))
+
+        self.raw_temp = None
+        self.temp = None
+
+        self.running = True
+        self._stop_event = Event()
+
+        Thread.__init__(self)
+        self.daemon = True
+
+    def sample(self):
+        """Read the sensor once and update the smoothed temperature."""
+        try:
+            t = self.sensor.read()
+        except (IOError, OSError, ValueError) as e:
+            self.logger.warning("Could not read the temperature: %s" % e)
+            self.sensor.close()
+            return
+
+        self.raw_temp = t
+        if self.temp is None:
+            self.temp = t
+        else:
+            self.temp += self.smoothing * (t - self.temp)
+        self.history.append((time(), self.temp))
+
+    def run(self):
+        """Keep sampling on the configured interval."""
+        while self.running:
+            self.sample()
+            self._stop_event.wait(self.interval)
+
+        self.sensor.close()
+
+    def stop(self):
+        """Stop sampling."""
+        self.running = False
+        self._stop_event.set()
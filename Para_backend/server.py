@@ -19,18 +19,36 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from SocketServer import BaseRequestHandler as brh, TCPServer as tcps
+from balancer import Balancer
 from chip import Chip
 from messageprocessor import MessageProcessor
-from threading import Thread
+from collections import deque
+from framing import encode_message, encode_status, ReceiveBuffer
+from threading import Thread, Lock
 from time import sleep, time
-import SocketServer
 import config
+import errno
+import fcntl
 import json
 import logging
+import os
+import select
+import socket
 import sys
 import subprocess as sp
 
+if hasattr(select, 'epoll'):
+    POLL_IN = select.EPOLLIN
+    POLL_OUT = select.EPOLLOUT
+    POLL_HUP = select.EPOLLHUP | select.EPOLLERR
+else:
+    POLL_IN = select.POLLIN
+    POLL_OUT = select.POLLOUT
+    POLL_HUP = select.POLLHUP | select.POLLERR
+
+# Errors of non-blocking socket operations that have to be retried later
+WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
 default_settings = {
     'address': ['', 11111],
     'dummy_mode': False,
@@ -46,6 +64,20 @@ default_settings = {
     'eVolt_command': 'sudo /home/linaro/Documents/parallella-utils-master/power_management/evolt',
     'voltage_timeout': 3,
     'status_frequency': 1,
+    'send_queue_limit': 8388608,
+    'command_workers': 4,
+    'balancer': False,
+    'balancer_interval': 5,
+    'balancer_high': 90,
+    'balancer_low': 50,
+    'balancer_persistence': 3,
+    'balancer_max_moves': 1,
+    'balancer_cooldown': 60,
+    'balancer_log_size': 100,
+    'sample_frequency': 1,
+    'temp_sensor_path': '/sys/bus/iio/devices/iio:device0',
+    'temp_sample_frequency': 10,
+    'temp_smoothing': 0.3,
     'frequency_timeout': 3,
     'chip_name': 'Parallella',
     'chip_cores': 18,
@@ -69,16 +101,148 @@ default_settings = {
 
 
 class Client:
-    """Client object for storing front-end connections."""
-
-    def __init__(self, request, name):
+    """
+    Client object for storing front-end connections. All messages to the
+    client are queued and written by the server's event loop whenever the
+    connection accepts more data, so a slow client does not stall the
+    others. Only the latest status frame is kept queued; the other messages
+    are never dropped. A client that lets more than 'queue_limit' bytes pile
+    up is too slow to keep up and is disconnected instead.
+    """
+
+    def __init__(self, request, name, queue_limit=8388608, wake=None):
+        self.logger = logging.getLogger('Client')
         self.request = request
         self.name = name
         self.initialized = False
 
+        # Clients in the delta status mode need a full status frame first
+        self.status_mode = 'full'
+        self.resync = True
+        self.encoding = 'json'
+
+        self.closed = False
+        self.queue = deque()
+        self.queue_limit = queue_limit
+        self.queued = 0
+        self.dropped = 0
+        self.sent = 0
+        self.wake = wake
+        self._status = None
+        self._out = None
+        self._out_offset = 0
+        self.lock = Lock()
+
+    def send(self, data, status=False):
+        """
+        Queue the encoded message 'data'. A status frame replaces the
+        status frame that is still queued, if any. Closes the client when
+        the queue exceeds its limit.
+        """
+        with self.lock:
+            if self.closed:
+                return
 
-class Server(SocketServer.TCPServer):
-    """Server object. Sets up, handles and closes client connections."""
+            if status and self._status is not None:
+                self.queued += len(data) - len(self._status[0])
+                self._status[0] = data
+                self.dropped += 1
+                return
+
+            if self.queued + len(data) > self.queue_limit:
+                self.logger.warning(
+                    "Disconnecting %s, which does not keep up with its " \
+                    "messages." % self.name
+                )
+                self._close()
+            else:
+                entry = [data]
+                if status:
+                    self._status = entry
+                self.queue.append(entry)
+                self.queued += len(data)
+
+        if self.wake:
+            self.wake()
+
+    def send_msg(self, msg):
+        """Encode the message 'msg' in the client's encoding and queue it."""
+        if self.encoding == 'binary':
+            self.send(encode_message(msg))
+        else:
+            self.send("%s\n" % json.dumps(msg))
+
+    def status_queued(self):
+        """Return whether a status frame is still waiting to be sent."""
+        return self._status is not None
+
+    def wants_write(self):
+        """Return whether any data is waiting to be written."""
+        return self._out is not None or len(self.queue) > 0
+
+    def write(self):
+        """
+        Write as much of the queued data as the connection accepts without
+        blocking. Raises socket.error when the connection is broken.
+        """
+        while not self.closed:
+            if self._out is None:
+                with self.lock:
+                    if not self.queue:
+                        return
+                    entry = self.queue.popleft()
+                    if entry is self._status:
+                        self._status = None
+                    self.queued -= len(entry[0])
+                self._out = memoryview(entry[0])
+                self._out_offset = 0
+
+            try:
+                n = self.request.send(self._out[self._out_offset:])
+            except socket.error, e:
+                if e.args[0] in WOULD_BLOCK:
+                    return
+                raise
+
+            self._out_offset += n
+            if self._out_offset == len(self._out):
+                self._out = None
+                self.sent += 1
+
+    def close(self):
+        """Drop all queued messages and refuse any new ones."""
+        with self.lock:
+            self._close()
+        self._out = None
+
+    def _close(self):
+        """
+        Drop all queued messages and refuse any new ones. Must be called
+        with the lock held. The message that is being written is left to
+        the event loop, which closes the connection.
+        """
+        self.closed = True
+        self.queue.clear()
+        self.queued = 0
+        self._status = None
+
+    def as_dict(self):
+        """Represent the send queue of the client as a dictionary."""
+        return {
+            "Name": self.name,
+            "Queued": len(self.queue),
+            "Bytes": self.queued,
+            "Dropped": self.dropped,
+            "Sent": self.sent
+        }
+
+
+class Server:
+    """
+    Server object. Sets up, handles and closes client connections. All
+    connections are served at once by a single event loop, which reads and
+    writes them without blocking.
+    """
 
     def __init__(self, address, chip, settings):
         self.logger = logging.getLogger('Server')
@@ -87,11 +251,34 @@ class Server(SocketServer.TCPServer):
         self.connection_count = 0
         self.clients = []
         self.frequency_scaler = None
+        self.balancer = None
         self.frequency_thread = None
         self.voltage_handler = None
         self.voltage_thread = None
+        self.running = True
+        self.handlers = dict()
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(address)
+        self.socket.listen(socket.SOMAXCONN)
+        self.socket.setblocking(0)
+
+        if hasattr(select, 'epoll'):
+            self.poller = select.epoll()
+        else:
+            self.poller = select.poll()
+        self.poller.register(self.socket.fileno(), POLL_IN)
+
+        # Self-pipe to wake up the poller when data has been queued
+        self._wake_r, self._wake_w = os.pipe()
+        for fd in (self._wake_r, self._wake_w):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.poller.register(self._wake_r, POLL_IN)
+
         self.logger.debug("Initialized on port %d" % address[1])
-        tcps.__init__(self, address, MessageHandler)
+        self.init_balancer()
         # self.init_frequency_scaler()
         self.init_voltage_handler()
         return
@@ -114,16 +301,54 @@ class Server(SocketServer.TCPServer):
         self.voltage_thread.deamon = True
         self.logger.info("Initialized the VoltageHandler")
 
+    def init_balancer(self):
+        """Initialize the load balancer, when it is enabled."""
+        if not self.settings['balancer']:
+            return
+
+        self.balancer = Balancer(
+            self.chip,
+            # Tasks only run on the ARM cores
+            cores=[c.id for c in self.chip.cores if not c.eCore],
+            interval=self.settings['balancer_interval'],
+            high=self.settings['balancer_high'],
+            low=self.settings['balancer_low'],
+            persistence=self.settings['balancer_persistence'],
+            max_moves=self.settings['balancer_max_moves'],
+            cooldown=self.settings['balancer_cooldown'],
+            log_size=self.settings['balancer_log_size'],
+            callback=self.send_migration
+        )
+        self.logger.info("Initialized the Balancer")
+
+    def send_migration(self, migration):
+        """Send a move of the load balancer to all initialized clients."""
+        for client in list(self.clients):
+            if client.initialized:
+                self.processor.send_migration_log(client, [migration])
+
     def serve_forever(self, max_lines):
         """Keep serving client connections."""
         # self.frequency_thread.start()
         self.voltage_thread.start()
-        self.processor = MessageProcessor(self, max_lines)
+        self.processor = MessageProcessor(
+            self,
+            max_lines,
+            self.settings['command_workers']
+        )
+        if self.balancer:
+            self.balancer.start()
 
         self.logger.info("Started")
         try:
-            tcps.serve_forever(self)
+            self.loop()
         finally:
+            self.server_close()
+            if self.balancer:
+                self.balancer.stop()
+                self.balancer.join()
+                self.logger.info('Stopped the Balancer')
+            self.processor.commands.stop()
             # self.frequency_scaler.running = False
             # self.frequency_thread.join()
             # self.logger.info("Stopped the FrequencyScaler")
@@ -135,84 +360,264 @@ class Server(SocketServer.TCPServer):
             self.logger.info("Stopped the VoltageHandler")
             self.logger.info("Stopped")
 
-    def finish_request(self, request, client_address):
-        """A client has successfully connected."""
-        self.logger.info("New connection from %s." % client_address[0])
-        self.connection_count += 1
-        client = Client(request, "Client%d" % self.connection_count)
-        self.clients.append(client)
-        self.RequestHandlerClass(request, client_address, self, client)
+    def accept(self):
+        """Accept all pending client connections."""
+        while True:
+            try:
+                request, client_address = self.socket.accept()
+            except socket.error, e:
+                if e.args[0] not in WOULD_BLOCK:
+                    self.logger.warning("Could not accept: %s" % e)
+                return
+
+            self.logger.info("New connection from %s." % client_address[0])
+            request.setblocking(0)
+            self.connection_count += 1
+            client = Client(
+                request,
+                "Client%d" % self.connection_count,
+                self.settings['send_queue_limit'],
+                self._wake
+            )
+            handler = MessageHandler(self, client)
+            self.handlers[handler.fd] = handler
+            self.poller.register(handler.fd, handler.events)
+            self.clients.append(client)
 
-    def close_request(self, request):
+    def close_request(self, handler):
         """A client has disconnected."""
-        for client in self.clients:
-            if client.request == request:
-                self.logger.info("Closed connection to %s." % client.name)
-                self.clients.remove(client)
-                break
-        return tcps.close_request(self, request)
+        client = handler.client
+        self.logger.info("Closed connection to %s." % client.name)
+        self.handlers.pop(handler.fd, None)
+        try:
+            self.poller.unregister(handler.fd)
+        except (KeyError, IOError, OSError, ValueError):
+            pass
+        if client in self.clients:
+            self.clients.remove(client)
+        client.close()
+        client.request.close()
+
+    def _wake(self):
+        """Interrupt a blocking poll, e.g. when data has been queued."""
+        try:
+            os.write(self._wake_w, "x")
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
 
+    def loop(self):
+        """Serve all client connections until the server is shut down."""
+        while self.running:
+            # Only wait for writability while data is queued
+            for handler in self.handlers.values():
+                if handler.client.closed:
+                    # The client did not keep up with its messages
+                    self.close_request(handler)
+                    continue
+
+                events = POLL_IN
+                if handler.client.wants_write():
+                    events |= POLL_OUT
+                if events != handler.events:
+                    handler.events = events
+                    self.poller.modify(handler.fd, events)
 
-class MessageHandler(SocketServer.BaseRequestHandler):
-    """Handler for all received messages. Calls the messageprocessor."""
+            try:
+                events = self.poller.poll(-1)
+            except (IOError, OSError, select.error), e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for fd, event in events:
+                if fd == self.socket.fileno():
+                    self.accept()
+                elif fd == self._wake_r:
+                    try:
+                        while os.read(self._wake_r, 4096):
+                            pass
+                    except OSError:
+                        pass
+                elif fd in self.handlers:
+                    handler = self.handlers[fd]
+                    if not handler.handle_event(event):
+                        self.close_request(handler)
 
-    def __init__(self, request, client_address, server, client):
+    def shutdown(self):
+        """Stop the event loop."""
+        self.running = False
+        self._wake()
+
+    def server_close(self):
+        """Close all client connections and the listening socket."""
+        for handler in self.handlers.values():
+            self.close_request(handler)
+        self.poller.close()
+        self.socket.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+
+class MessageHandler:
+    """
+    Handler for the connection of a single client. Reads and writes the
+    connection without blocking and calls the messageprocessor for every
+    complete received message.
+    """
+
+    def __init__(self, server, client):
         self.logger = logging.getLogger('MessageHandler')
+        self.server = server
         self.client = client
-        self.buffer = ""
-        brh.__init__(self, request, client_address, server)
-        return
-
-    def handle(self):
+        self.request = client.request
+        self.fd = client.request.fileno()
+        self.events = POLL_IN
+        self.buffer = ReceiveBuffer()
+
+    def handle_event(self, event):
+        """
+        Handle the poll event 'event' of the connection. Returns False once
+        the connection has been closed.
+        """
+        if event & POLL_IN and not self.handle_read():
+            return False
+        if event & POLL_OUT and not self.handle_write():
+            return False
+        if event & POLL_HUP and not event & POLL_IN:
+            return False
+        return True
+
+    def handle_read(self):
         """Handle all received messages."""
-        while True:
-            try:
-                data = self.request.recv(1024)
-                if not data:
-                    break
-
-                if '\n' in data:
-                    # A message is not complete until receiving linebreak
-                    parts = data.split('\n')
-                    self.server.processor.process(
-                        self.client,
-                        "%s%s" % (self.buffer, parts[0])
-                    )
+        try:
+            if not self.buffer.recv(self.request):
+                return False
+        except socket.error, e:
+            return e.args[0] in WOULD_BLOCK
 
-                    # Handle any adjacent fully received messages
-                    for part in parts[1:-1]:
-                        self.server.processor.process(self.client, part)
+        try:
+            # A message is not complete until receiving linebreak
+            msg = self.buffer.next_line()
+            while msg is not None:
+                self.server.processor.process(self.client, msg)
+                msg = self.buffer.next_line()
+        except:
+            self.logger.error("Exception occurred in MessageHandler")
+            return False
+        return True
 
-                    self.buffer = parts[-1]
-                else:
-                    self.buffer += data
-            except:
-                self.logger.error("Exception occurred in MessageHandler")
-                break
+    def handle_write(self):
+        """Write the queued messages."""
+        try:
+            self.client.write()
+        except socket.error, e:
+            self.logger.debug(
+                'Could not send to %s: %s' % (self.client.name, e)
+            )
+            return False
+        return True
 
 
 class StatusSender:
-    """Module that sends the chip status at adjustable intervals."""
+    """
+    Module that sends the chip status at adjustable intervals. Clients in
+    the delta status mode receive a full status frame first, followed by
+    status_delta frames with only the changed fields. Every frame carries
+    a sequence number, so a client can detect a missed frame and request
+    a resync.
+    """
 
     def __init__(self, chip, server):
         self.logger = logging.getLogger('StatusSender')
         self.chip = chip
         self.server = server
         self.running = True
+        self.seq = 0
+        self.state = None
+
+    def delta(self, prev, cur):
+        """
+        Return the fields of the chip dictionary 'cur' that changed since
+        'prev'. Cores are keyed by their index and tasks by their ID.
+        """
+        chip = dict(
+            (k, v) for k, v in cur.iteritems()
+            if k not in ('Cores', 'Tasks') and prev.get(k) != v
+        )
+
+        cores = dict()
+        for i, core in enumerate(cur['Cores']):
+            old = prev['Cores'][i] if i < len(prev['Cores']) else dict()
+            changed = dict(
+                (k, v) for k, v in core.iteritems() if old.get(k) != v
+            )
+            if changed:
+                cores[i] = changed
+
+        removed = dict((task['ID'], task) for task in prev['Tasks'])
+        tasks = dict()
+        for task in cur['Tasks']:
+            old = removed.pop(task['ID'], dict())
+            changed = dict(
+                (k, v) for k, v in task.iteritems() if old.get(k) != v
+            )
+            if changed:
+                tasks[task['ID']] = changed
+
+        return {
+            'chip': chip,
+            'cores': cores,
+            'tasks': tasks,
+            'removed': removed.keys()
+        }
 
     def send_forever(self, interval):
         """Keep sending the status messages on the specified interval."""
         while self.running:
             try:
                 sleep(1. / interval)
-                msg = {
-                    'type': 'status',
-                    'content': {
-                        'chip': self.chip.as_dict()
-                    }
-                }
-                for client in self.server.clients:
-                    client.request.sendall("%s\n" % json.dumps(msg))
+                clients = list(self.server.clients)
+                stats = [client.as_dict() for client in clients]
+                chip = self.chip.as_dict()
+                prev, self.state = self.state, chip
+                self.seq += 1
+
+                # Encode every kind of frame at most once for all clients
+                contents = dict()
+                frames = dict()
+                for client in clients:
+                    if not client.initialized:
+                        continue
+
+                    if client.status_mode == 'delta' and prev and \
+                            not client.resync and not client.status_queued():
+                        kind = 'status_delta'
+                    else:
+                        # A full frame, which also replaces a frame the
+                        # client has not received yet
+                        kind = 'status'
+                        client.resync = False
+
+                    if kind not in contents:
+                        if kind == 'status':
+                            content = {'chip': chip}
+                        else:
+                            content = self.delta(prev, chip)
+                        content['clients'] = stats
+                        content['seq'] = self.seq
+                        contents[kind] = content
+
+                    key = (kind, client.encoding)
+                    if key not in frames:
+                        if client.encoding == 'binary':
+                            frames[key] = encode_status(contents[kind], chip)
+                        else:
+                            frames[key] = "%s\n" % json.dumps({
+                                'type': kind,
+                                'content': contents[kind]
+                            })
+                    client.send(frames[key], status=True)
             except Exception, e:
                 self.logger.warning(
                     'Exception occurred in StatusSender: %s' % e
@@ -523,6 +928,11 @@ class App:
             self.settings['chip_orientation'],
             self.settings['voltage_islands'],
             status_dir=self.settings['epiphany_status_dir'],
+            sample_frequency=self.settings['sample_frequency'],
+            temp_sensor_path=self.settings['temp_sensor_path'],
+            temp_sample_frequency=self.settings['temp_sample_frequency'],
+            temp_smoothing=self.settings['temp_smoothing'],
+            clusters=self.settings['frequency_islands'],
             dummy_mode=self.settings['dummy_mode']
         )
         self.logger.info("Setup chip control")
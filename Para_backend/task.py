@@ -19,14 +19,17 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+from proccontrol import spawn, set_process_affinity, signal_group
 from random import random, randint
-from string import split
-from threading import Thread
-from time import sleep
+from threading import Event
 import logging
+import os
+import shlex
 import subprocess as sp
 import signal
 
+EPIPHANY_LIBRARY_PATH = "/opt/adapteva/esdk/tools/host/lib"
+
 
 
 class Status:
@@ -62,7 +65,7 @@ class Status:
         return self.names[self.value]
 
 
-class Task(Thread):
+class Task(object):
     """Task object, contains all information about a task."""
 
     def __init__(self, tid, core, name, program, **kwargs):
@@ -74,24 +77,27 @@ class Task(Thread):
         self.program = program
         self.pcall = None
         self.dummy_mode = kwargs.get('dummy_mode', False)
+        self.reactor = kwargs.get('reactor', None)
+        self.p = None
+        self.ended = Event()
 
         self._pid = -1
-        self.ppid = -1
-        self.inter_pids = []
-        self._error_count = 0
-        self.p_top = None
+        self.pgid = -1
+        # Process ids of the task's process tree, as last sampled
+        self.pids = []
 
         self._status = kwargs.get('status', Status.NEW)
         self.cpu_usage = 0.0
         self.mem_usage = 0.0
+        self.rss = 0
+        self.threads = 0
         self.output = []
 
-        Thread.__init__(self)
-
         if self._status == Status.NEW:
             self.create()
 
-        self.start()
+        if self.dummy_mode:
+            self.status = Status.RUNNING
 
     def __repr__(self):
         return "Task %s: %.1f%% CPU, %.1f%% MEM" % (
@@ -134,7 +140,9 @@ class Task(Thread):
             "Name": self.pname,
             "Status": "%s" % Status(self.status),
             "CPU": self.cpu_usage,
-            "MEM": self.mem_usage
+            "MEM": self.mem_usage,
+            "RSS": self.rss,
+            "Threads": self.threads
         }
 
     def create(self):
@@ -145,119 +153,71 @@ class Task(Thread):
         if self.dummy_mode:
             return
 
-        self.pcall = self.program.split(' ')[0]
-
-
-        self.p = sp.Popen(
-            'if [ -x %s ]; then echo "PPID: $$"; taskset -c %02d sudo -E '\
-                'LD_LIBRARY_PATH=/opt/adapteva/esdk/tools/host/lib:$LD_LIBRARY_PATH '\
-                'EPIPHANY_HDF=$EPIPHANY_HDF stdbuf -oL %s; else '\
-                'echo \'ERROR: Program not found\' 1>&2; fi' \
-                % (self.pcall, self.core, self.program),
-            shell=True,
-            bufsize=1,
-            stdout=sp.PIPE,
-            stderr=sp.STDOUT
-        )
-
-
-    def run(self):
-        """Read and process the output of the task."""
-        if self.dummy_mode:
-            self.status = Status.RUNNING
+        try:
+            args = shlex.split(self.program)
+            if not args or not os.access(args[0], os.X_OK):
+                raise OSError("Program not found")
+            self.pcall = args[0]
+
+            # Epiphany programs need root access. The sudo environment is
+            # filtered, so stdbuf has to be executed by sudo itself.
+            self.p = spawn(
+                [
+                    'sudo', '-E',
+                    'LD_LIBRARY_PATH=%s:%s' % (EPIPHANY_LIBRARY_PATH,
+                        os.environ.get('LD_LIBRARY_PATH', '')),
+                    'EPIPHANY_HDF=%s' % os.environ.get('EPIPHANY_HDF', ''),
+                    'stdbuf', '-oL'
+                ] + args,
+                [self.core],
+                line_buffered=False,
+                stdout=sp.PIPE,
+                stderr=sp.STDOUT
+            )
+        except (ValueError, OSError) as e:
+            self.logger.critical("Could not start the task:\n %s" % e)
+            self.status = Status.FAILED
             return
 
-        while 1:
-        
-            if self.status == Status.STOPPED:
-                # Skip when stopped
-                sleep(.1)
-                continue
+        # The program is a child of sudo, which leads the process group.
+        # Its usage is accounted for through the process tree of sudo.
+        self._pid = self.p.pid
+        self.pgid = self.p.pid
+        self.logger.debug("Set pid to %d" % self._pid)
 
-            if self.p.poll() == None:
-                line = self.p.stdout.readline()
-            else:
-                self.logger.debug("program terminated")
-                break
-
-            if not line:
-                if self.status == Status.STOPPED:
-                    # Skip when stopped
-                    continue
-                else:
-                    # The task will have ended
-                    self.logger.debug("Breaking")
-                    break
-
-            if self.status == Status.CREATING:
-                # Setup the task, i.e. retrieve its parent's process id (ppid)
-                try:
-                    parts = line.split()
-                    if parts[0] == "ERROR:":
-                        raise ValueError(" ".join(parts[1:]))
-                    if parts[0] != "PPID:":
-                        if self._error_count > 100:
-                            raise ValueError("Could not determine ppid.")
-                        self._error_count += 1
-                        continue
-
-                    self.ppid = int(parts[1])
-                    self.logger.debug("Set ppid to %d" % self.ppid)
-                    
-
-                    self.p_top = sp.Popen(
-                        'top -b -d1 -p %d | grep %d --line-buffered' \
-                            % (self.pid, self.pid),
-                        shell=True,
-                        stdout=sp.PIPE,
-                        stderr=sp.STDOUT
-                    )
-                    self.logger.debug("p_top started")
-                    self.status = Status.RUNNING
-
-
-                except ValueError as e:
-                    self.logger.critical("Could not start the task:\n %s" % e)
-                    self.status = Status.FAILED
-                    break
+        self.status = Status.RUNNING
+        self.reactor.register(self, self.p.stdout)
 
-            else:
-                self.logger.debug("%s: %s" % (self.name, line[:-1]))
-                self.output += [line]
+    def process_line(self, line):
+        """
+        Process a line of output of the task. Returns False when no further
+        output should be read.
+        """
+        self.logger.debug("%s: %s" % (self.tid, line[:-1]))
+        self.output += [line]
 
-            line = None
+        return True
 
+    def process_eof(self, pipe):
+        """The output pipe of the task has been closed."""
+        if self.p is None or pipe is not self.p.stdout:
+            # Output of an earlier process of this task
+            return
 
+        self.logger.debug("Output of %s ended" % self.tid)
         if self.status not in (Status.KILLED, Status.FAILED):
             # The task has successfully ended
             self.status = Status.FINISHED
-            try:
-                self.p_top.kill()
-            except:
-                self.logger.debug("p_top could not be killed.")
-
-            self.p_top = None
             self.cpu_usage = 0.0
             self.mem_usage = 0.0
 
-    def parse_perf(self, line):
-
-        if self.status not in (Status.KILLED, Status.FAILED, Status.FINISHED):
-            
-            # Per task line of 'top' is of format:
-            # PID USER PR NI VIRT RES SHR S %CPU %MEM TIME+ COMMAND
-            parts = line.split()
-            if len(parts) >= 10:    
-                pid = parts[0]
-                try:
-                    # self.logger.info("Task: %s; parts: %s" % (self.pid, parts))
-                    if self.pid == int(pid):
-                        self.cpu_usage = float(parts[8].replace(",", "."))
-                        self.mem_usage = float(parts[9].replace(",", "."))
-                except:
-                    pass
-
+        self.ended.set()
 
+    def join(self, timeout=None):
+        """Wait until the output of the task has ended."""
+        if self.dummy_mode or self.p is None:
+            return
+        self.ended.wait(timeout)
 
     def move(self, core):
         """Move the task to the specified core."""
@@ -268,51 +228,33 @@ class Task(Thread):
 
         self.logger.debug("Attempting to move to core %02d" % core)
 
-        p = sp.Popen(
-            'sudo taskset -pc %02d %d' % (core, self.pid),
-            shell=True,
-            stdout=sp.PIPE,
-            stderr=sp.STDOUT
-        )
-        p.communicate()
+        try:
+            for pid in self.pids or [self.pid]:
+                set_process_affinity(pid, [core])
+        except Exception as e:
+            self.logger.warning("Moving exited with some errors: %s" % e)
 
         self.core = core
-        self.p.send_signal(signal.SIGCONT)
-
-        p = sp.Popen(
-            'sudo kill -CONT %d' % (self.pid),
-            shell=True,
-            stdout=sp.PIPE,
-            stderr=sp.PIPE
-        )
-
-
-        # Show output, if any
-        out, err = p.communicate()
-        if len(err) > 0:
-            self.logger.warning("Continuing exited with some errors: %s" % err)
-        if len(out) > 0:
-            self.output += [out]
-
-        for pid in self.inter_pids:
-            p = sp.Popen(
-                'sudo kill -CONT %d' % (pid),
-                shell=True,
-                stdout=sp.PIPE,
-                stderr=sp.PIPE
-            )
-            # Show output, if any
-            out, err = p.communicate()
-            if len(err) > 0:
-                self.logger.warning("Continuing exited with some errors: %s" % err)
-            if len(out) > 0:
-                self.output += [out]
-
+        self.signal(signal.SIGCONT, "Continuing")
 
         self.status = Status.RUNNING
         return True
 
-
+    def signal(self, sig, action):
+        """
+        Send the signal 'sig' to the process group of the task. 'action'
+        describes the operation in the log messages.
+        """
+        try:
+            if not signal_group(self.pgid, sig):
+                self.logger.warning(
+                    "%s failed: the program has already ended" % action
+                )
+                return False
+        except OSError as e:
+            self.logger.warning("%s exited with some errors: %s" % (action, e))
+            return False
+        return True
 
     def stop(self):
         """Stop the task."""
@@ -327,20 +269,7 @@ class Task(Thread):
         self.logger.debug("Stopping the program...")
         self.status = Status.STOPPING
 
-        p = sp.Popen(
-            'sudo kill -STOP %d' % (self.pid),
-            shell=True,
-            stdout=sp.PIPE,
-            stderr=sp.PIPE
-        )
-
-        # Show output, if any
-        out, err = p.communicate()
-        if len(err) > 0:
-            self.logger.warning("Stopping exited with some errors: %s" % err)
-        if len(out) > 0:
-            self.output += [out]
-        self.p.send_signal(signal.SIGSTOP)
+        self.signal(signal.SIGSTOP, "Stopping")
 
         self.status = Status.STOPPED
         self.logger.debug("Stopped the program")
@@ -359,36 +288,7 @@ class Task(Thread):
         self.logger.debug("Continuing the program...")
         self.status = Status.CONTINUING
 
-        self.p.send_signal(signal.SIGCONT)
-        p = sp.Popen(
-            'sudo kill -CONT %d' % (self.pid),
-            shell=True,
-            stdout=sp.PIPE,
-            stderr=sp.PIPE
-        )
-        # Show output, if any
-        out, err = p.communicate()
-        if len(err) > 0:
-            self.logger.warning("Continuing exited with some errors: %s" % err)
-        if len(out) > 0:
-            self.output += [out]
-
-
-        for pid in self.inter_pids:
-            p = sp.Popen(
-                'sudo kill -CONT %d' % (pid),
-                shell=True,
-                stdout=sp.PIPE,
-                stderr=sp.PIPE
-            )
-            # Show output, if any
-            out, err = p.communicate()
-            if len(err) > 0:
-                self.logger.warning("Continuing exited with some errors: %s" % err)
-            if len(out) > 0:
-                self.output += [out]
-
-        
+        self.signal(signal.SIGCONT, "Continuing")
 
         self.status = Status.RUNNING
         self.logger.debug("Continued the program")
@@ -399,7 +299,7 @@ class Task(Thread):
         if self.dummy_mode:
             self.status = Status.KILLED
             return True
-        
+
         if self.status not in (Status.RUNNING, Status.STOPPED):
             self.logger.warning("Attempting to kill a non-running task.")
             return False
@@ -407,27 +307,9 @@ class Task(Thread):
         self.logger.debug("Killing the program...")
         self.status = Status.KILLING
 
-        try:
-            self.p_top.kill()
-        except:
-            self.logger.debug("p_top could not be killed.")
-
-        self.p_top = None
-
-        p = sp.Popen(
-            'sudo kill %d' % (self.pid),
-            shell=True,
-            stdout=sp.PIPE,
-            stderr=sp.PIPE
-        )
-
-        # Show output, if any
-        out, err = p.communicate()
-        if len(err) > 0:
-            self.logger.warning("Killing exited with some errors: %s" % err)
-        if len(out) > 0:
-            self.output += [out]
-
+        # A stopped program only handles the SIGTERM once it is continued
+        if self.signal(signal.SIGTERM, "Killing"):
+            signal_group(self.pgid, signal.SIGCONT)
 
         self.status = Status.KILLED
         self.logger.debug("Killed the program")
@@ -435,84 +317,11 @@ class Task(Thread):
         self.mem_usage = 0.0
         return True
 
-    def get_child_pid(self, ppid):
-        """Retrieve the child PID from its PPID."""
-        command = self.pcall.split("/")[-1]
-
-        # Obtain all processes with the given ppid
-        p2 = sp.Popen(
-            'ps -a -o pid,ppid,comm | grep %d' % (ppid),
-            shell=True,
-            stdout=sp.PIPE,
-            stderr=sp.PIPE
-        )
-        self.logger.debug("ps for child pid opened for ppid: %d" % ppid)
-        try:
-            err = p2.stderr.readlines()
-            if len(err) > 0:
-                self.logger.warning("Error in get_child_pid: %s" % err)
-                raise Exception("Get_pid exited with errors: %s" % err)
-        except:
-            self.logger.warning("Could not communicate with ps for ppid: %d" %ppid)
-            return -1
-
-        out = p2.stdout.read()
-
-        pid = -1
-        try:
-            for i, line in enumerate(split(out, '\n')[:-1]):
-                self.logger.debug("Line %d: %s" % (i, line))
-
-                # Retrieve the pid, ppid and command
-                try:
-                    npid, nppid, comm = split(line)[:3]
-                    npid = int(npid)
-                    nppid = int(nppid)
-                except:
-                    self.logger.warning(
-                        "Encountered an invalid line of process information..."
-                    )
-                    continue
-
-                if npid != ppid:
-                    if pid > 0:
-                        self.logger.debug(
-                            "Found pid %d after %d was found earlier.." % \
-                            (npid, pid)
-                        )
-                    pid = npid
-
-                    # The sudo command needed for Epiphany programs causes an extra
-                    # process to come in between, so recursively checks for children
-                    # until the program is found. 
-                    if str(comm) not in command:
-                        self.inter_pids = [pid] + self.inter_pids
-                        pid = self.get_child_pid(pid)
-                    else:
-                        return pid
-        except:
-            self.logger.warning("Something went wrong when getting child pid!!")
-
-        return pid
-
     def get_pid(self):
         """Get the current process id of the task."""
         if self.dummy_mode:
             return 9999
 
-        if self.ppid < 0:
-            raise Exception(
-                "Could not determine the process id, since the parent's " \
-                "process id could not be found."
-            )
-
-        # Try to get the pid from memory
-        if self._pid < 0:
-            pid = self.get_child_pid(self.ppid)
-
-            self.logger.debug("Set pid to %d" % pid)
-            self._pid = pid
-
         if self._pid < 0:
             raise Exception("Could not determine the process id.")
 
@@ -525,9 +334,6 @@ class Task(Thread):
     def set_status(self, value):
         """Setter for the task status. Logs it."""
         self._status = value
-
-        if value == Status.CREATING:
-            self._error_count = 0
         self.logger.debug("Status changed to %s" % Status(self.status))
 
     # Define getters and setters
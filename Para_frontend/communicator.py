@@ -19,12 +19,29 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+from framing import ReceiveBuffer
 from messageprocessor import MessageProcessor
 from kivy.logger import Logger
 from threading import Thread
 import json
 import socket
 
+# Message types that are answered with a command_result message
+command_msg_types = (
+    'task_start',
+    'task_move',
+    'task_pause',
+    'task_resume',
+    'task_stop',
+    'task_duplicate',
+    'task_start_batch',
+    'task_move_batch',
+    'task_pause_batch',
+    'task_resume_batch',
+    'task_stop_batch',
+    'core_set_voltage'
+)
+
 
 class Communicator(Thread):
     """Communicator between ManyMan's front- and back-end."""
@@ -35,7 +52,10 @@ class Communicator(Thread):
         self.sock = None
         self.running = True
         self.initialized = False
-        self.readbuf = ""
+        self.binary = False
+        self.buffer = None
+        self.request_count = 0
+        self.pending = dict()
 
         self.init_processor()
         self.init_connection()
@@ -54,12 +74,20 @@ class Communicator(Thread):
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.connect(tuple(self.manyman.settings['address']))
+            self.buffer = ReceiveBuffer(self.manyman.settings['bufsize'])
             Logger.info("Communicator: Connected to the server")
 
+            # Offer the configured encoding, with JSON as the fallback
+            encodings = ['json']
+            if self.manyman.settings['encoding'] != 'json':
+                encodings.insert(0, self.manyman.settings['encoding'])
+
             self.send_msg({
                 'type': 'client_init',
                 'content': {
-                    'name': 'PQ Labs Q3'
+                    'name': 'PQ Labs Q3',
+                    'status': self.manyman.settings['status_mode'],
+                    'encodings': encodings
                 }
             })
         except Exception as e:
@@ -72,34 +100,50 @@ class Communicator(Thread):
         """Continuously check for messages."""
         try:
             while self.running:
-                data = self.sock.recv(self.manyman.settings['bufsize'])
-
-                if not data:
+                if not self.buffer.recv(self.sock):
                     self.running = False
                     break
 
-                if '\n' in data:
-                    # Data is not complete until a newline character has been
-                    # received
-                    parts = data.split('\n')
-                    self.processor.process("%s%s" % (self.readbuf, parts[0]))
-
-                    # Process any adjacent fully received messages
-                    for part in parts[1:-1]:
-                        self.processor.process(part)
-
-                    self.readbuf = parts[-1]
-                else:
-                    self.readbuf += data
+                self.process_buffer()
         except:
             self.running = False
             self.sock.close()
 
+    def process_buffer(self):
+        """
+        Process all complete messages in the read buffer. Messages are
+        newline-delimited JSON until the server has switched to binary
+        frames in its server_init message.
+        """
+        while True:
+            if self.binary:
+                msg = self.buffer.next_frame()
+            else:
+                # Data is not complete until a newline character has been
+                # received
+                msg = self.buffer.next_line()
+            if msg is None:
+                break
+
+            self.processor.process(msg)
+
     def send_msg(self, msg):
         """Send a given message to the back-end."""
+        if msg['type'] in command_msg_types:
+            self.request_count += 1
+            msg['content']['request_id'] = self.request_count
+            self.pending[self.request_count] = msg['type']
+
         Logger.debug("Communicator: Sending: %s" % json.dumps(msg))
         self.sock.send("%s\n" % json.dumps(msg))
 
+    def resync_status(self):
+        """Send a status_resync message."""
+        self.send_msg({
+            'type': 'status_resync',
+            'content': {}
+        })
+
     def start_task(self, name, task, core=None):
         """Send a start_task message."""
         msg = {
@@ -164,6 +208,76 @@ class Communicator(Thread):
             }
         })
 
+    def start_tasks(self, tasks):
+        """
+        Send a task_start_batch message. 'tasks' is a list of (name,
+        program, core) tuples, where core may be None for smart-start.
+        """
+        specs = []
+        for name, program, core in tasks:
+            spec = {
+                'name': name,
+                'program': program
+            }
+            if core != None:
+                spec['core'] = core
+            specs.append(spec)
+
+        self.send_msg({
+            'type': 'task_start_batch',
+            'content': {
+                'tasks': specs
+            }
+        })
+
+    def move_tasks(self, moves):
+        """
+        Send a task_move_batch message. 'moves' is a list of (task, dest)
+        tuples, where dest may be None for smart-move.
+        """
+        specs = []
+        for task, dest in moves:
+            spec = {
+                'id': task.tid
+            }
+            if dest != None:
+                spec['to_core'] = dest
+            specs.append(spec)
+
+        self.send_msg({
+            'type': 'task_move_batch',
+            'content': {
+                'moves': specs
+            }
+        })
+
+    def pause_tasks(self, tasks):
+        """Send a task_pause_batch message."""
+        self.send_msg({
+            'type': 'task_pause_batch',
+            'content': {
+                'ids': tasks
+            }
+        })
+
+    def resume_tasks(self, tasks):
+        """Send a task_resume_batch message."""
+        self.send_msg({
+            'type': 'task_resume_batch',
+            'content': {
+                'ids': tasks
+            }
+        })
+
+    def stop_tasks(self, tasks):
+        """Send a task_stop_batch message."""
+        self.send_msg({
+            'type': 'task_stop_batch',
+            'content': {
+                'ids': tasks
+            }
+        })
+
     def request_output(self, task, offset=0):
         """Send a task_output_request message with given offset."""
         msg = {
@@ -0,0 +1,299 @@
+"""
+ManyMan - A Many-core Visualization and Management System
+Copyright (C) 2015
+University of Amsterdam - Computer Systems Architecture
+Jimi van der Woning and Roy Bakker
+Extended for Parallella by: Floris Turkenburg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import struct
+
+# Encodings of the messages from the back-end to a front-end. The encoding
+# is offered in client_init and confirmed in server_init.
+encodings = (
+    'json',
+    'binary'
+)
+
+# Every binary frame starts with its kind and the length of its payload
+FRAME_HEADER = struct.Struct('!BI')
+FRAME_JSON = 0
+FRAME_STATUS = 1
+FRAME_STATUS_DELTA = 2
+
+STATUS_HEADER = struct.Struct('!IHH')
+COUNT = struct.Struct('!H')
+TASK_RECORD = struct.Struct('!hffii')
+
+# Metrics of the cores, sent as one fixed-width array per field. Missing
+# values are sent as NaN or -1 and left out again when decoding.
+CORE_FIELDS = (
+    ('CPU', 'f'),
+    ('MEM', 'f'),
+    ('Frequency', 'i'),
+    ('Voltage', 'f')
+)
+
+NAN = float('nan')
+
+# Initial size of a receive buffer
+READ_SIZE = 4096
+
+
+def pack_string(s):
+    """Pack the string 's' with a one-byte length prefix."""
+    if isinstance(s, unicode):
+        s = s.encode('utf-8')
+    s = s[:255]
+    return "%s%s" % (chr(len(s)), s)
+
+
+def unpack_string(data, offset):
+    """Unpack a string at 'offset'. Returns the string and the new offset."""
+    end = offset + 1 + ord(data[offset])
+    return data[offset + 1:end].decode('utf-8'), end
+
+
+def encode_frame(kind, payload):
+    """Prefix the payload with the frame header."""
+    return "%s%s" % (FRAME_HEADER.pack(kind, len(payload)), payload)
+
+
+def encode_message(msg):
+    """Encode any message as a JSON frame."""
+    return encode_frame(FRAME_JSON, json.dumps(msg))
+
+
+def encode_status(content, chip):
+    """
+    Encode the content of a status or a status_delta message as a binary
+    frame. The full chip dictionary 'chip' provides the records of the
+    cores and tasks that are listed in a delta.
+    """
+    if 'cores' in content:
+        kind = FRAME_STATUS_DELTA
+        cores = sorted(int(i) for i in content['cores'])
+        tasks = content['tasks'].keys()
+        removed = content['removed']
+        extra = content['chip']
+    else:
+        kind = FRAME_STATUS
+        cores = range(len(chip['Cores']))
+        tasks = [task['ID'] for task in chip['Tasks']]
+        removed = []
+        extra = dict(
+            (k, v) for k, v in chip.iteritems() if k not in ('Cores', 'Tasks')
+        )
+
+    parts = [
+        STATUS_HEADER.pack(content['seq'], len(cores), len(tasks)),
+        struct.pack('!%dH' % len(cores), *cores)
+    ]
+
+    records = [chip['Cores'][i] for i in cores]
+    for field, fmt in CORE_FIELDS:
+        missing = NAN if fmt == 'f' else -1
+        parts.append(struct.pack(
+            '!%d%s' % (len(records), fmt),
+            *[core.get(field, missing) for core in records]
+        ))
+    for core in records:
+        parts.append(pack_string(core['Status']))
+
+    index = dict((task['ID'], task) for task in chip['Tasks'])
+    for tid in tasks:
+        task = index[tid]
+        parts.append(pack_string(task['ID']))
+        parts.append(pack_string(task['Name']))
+        parts.append(pack_string(task['Status']))
+        parts.append(TASK_RECORD.pack(
+            task['Core'],
+            task['CPU'],
+            task['MEM'],
+            task.get('RSS', -1),
+            task.get('Threads', -1)
+        ))
+
+    parts.append(COUNT.pack(len(removed)))
+    for tid in removed:
+        parts.append(pack_string(tid))
+
+    # The remaining chip fields differ per chip and are sent as JSON
+    parts.append(json.dumps({
+        'chip': extra,
+        'clients': content.get('clients', [])
+    }))
+
+    return encode_frame(kind, "".join(parts))
+
+
+def decode_status(kind, payload):
+    """Decode a binary status frame into a status(_delta) message."""
+    seq, n_cores, n_tasks = STATUS_HEADER.unpack_from(payload, 0)
+    offset = STATUS_HEADER.size
+
+    fmt = '!%dH' % n_cores
+    indices = struct.unpack_from(fmt, payload, offset)
+    offset += struct.calcsize(fmt)
+
+    cores = [{"Core": i} for i in indices]
+    for field, fmt in CORE_FIELDS:
+        fmt = '!%d%s' % (n_cores, fmt)
+        values = struct.unpack_from(fmt, payload, offset)
+        offset += struct.calcsize(fmt)
+        for core, value in zip(cores, values):
+            if value == value and value != -1:
+                core[field] = value
+    for core in cores:
+        core["Status"], offset = unpack_string(payload, offset)
+
+    tasks = []
+    for _ in xrange(n_tasks):
+        task = dict()
+        task["ID"], offset = unpack_string(payload, offset)
+        task["Name"], offset = unpack_string(payload, offset)
+        task["Status"], offset = unpack_string(payload, offset)
+        task["Core"], task["CPU"], task["MEM"], rss, threads = \
+            TASK_RECORD.unpack_from(payload, offset)
+        offset += TASK_RECORD.size
+        if rss != -1:
+            task["RSS"] = rss
+        if threads != -1:
+            task["Threads"] = threads
+        tasks.append(task)
+
+    removed = []
+    n_removed, = COUNT.unpack_from(payload, offset)
+    offset += COUNT.size
+    for _ in xrange(n_removed):
+        tid, offset = unpack_string(payload, offset)
+        removed.append(tid)
+
+    rest = json.loads(payload[offset:])
+
+    if kind == FRAME_STATUS:
+        chip = rest['chip']
+        chip["Cores"] = cores
+        chip["Tasks"] = tasks
+        return {
+            'type': 'status',
+            'content': {
+                'chip': chip,
+                'clients': rest['clients'],
+                'seq': seq
+            }
+        }
+
+    return {
+        'type': 'status_delta',
+        'content': {
+            'chip': rest['chip'],
+            'cores': dict((core["Core"], core) for core in cores),
+            'tasks': dict((task["ID"], task) for task in tasks),
+            'removed': removed,
+            'clients': rest['clients'],
+            'seq': seq
+        }
+    }
+
+
+def decode_frame(data, offset=0, size=None):
+    """
+    Decode the frame at 'offset' in the first 'size' bytes of 'data'.
+    Returns the message and the offset of the next frame, or None and
+    'offset' when the frame has not been received completely yet.
+    """
+    if size is None:
+        size = len(data)
+    if size - offset < FRAME_HEADER.size:
+        return None, offset
+
+    kind, length = FRAME_HEADER.unpack_from(data, offset)
+    start = offset + FRAME_HEADER.size
+    end = start + length
+    if size < end:
+        return None, offset
+
+    payload = bytes(data[start:end])
+    if kind == FRAME_JSON:
+        return json.loads(payload), end
+    elif kind in (FRAME_STATUS, FRAME_STATUS_DELTA):
+        return decode_status(kind, payload), end
+
+    raise ValueError("Unknown frame kind: %d" % kind)
+
+
+class ReceiveBuffer:
+    """
+    Receive buffer of a connection. Data is received into a bytearray with
+    recv_into and complete messages are found by scanning from offsets, so
+    every received byte is copied and scanned only once. The buffer only
+    grows when a single message does not fit.
+    """
+
+    def __init__(self, size=READ_SIZE):
+        self.data = bytearray(size)
+
+        # Start of the first unprocessed message, end of the received data
+        # and the offset where the scan for a newline continues
+        self.start = 0
+        self.end = 0
+        self.scan = 0
+
+    def recv(self, sock):
+        """
+        Receive the available data from the socket 'sock'. Returns the
+        number of received bytes, which is 0 once the connection is closed.
+        """
+        if self.end == len(self.data):
+            if self.start > 0:
+                # Move the unprocessed data to the front
+                n = self.end - self.start
+                self.data[:n] = self.data[self.start:self.end]
+                self.scan -= self.start
+                self.start = 0
+                self.end = n
+            else:
+                self.data.extend(bytearray(len(self.data)))
+
+        n = sock.recv_into(memoryview(self.data)[self.end:])
+        self.end += n
+        return n
+
+    def consume(self, offset):
+        """Mark all data up to 'offset' as processed."""
+        self.start = self.scan = offset
+        if self.start == self.end:
+            self.start = self.end = self.scan = 0
+
+    def next_line(self):
+        """Return the next newline-delimited message, or None."""
+        i = self.data.find('\n', self.scan, self.end)
+        if i < 0:
+            self.scan = self.end
+            return None
+
+        line = bytes(self.data[self.start:i])
+        self.consume(i + 1)
+        return line
+
+    def next_frame(self):
+        """Return the message of the next length-prefixed frame, or None."""
+        msg, offset = decode_frame(self.data, self.start, self.end)
+        if msg is not None:
+            self.consume(offset)
+        return msg
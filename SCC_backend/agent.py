@@ -0,0 +1,261 @@
+"""
+ManyMan - A Many-core Visualization and Management System
+Copyright (C) 2012
+University of Amsterdam - Computer Systems Architecture
+Jimi van der Woning and Roy Bakker
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from pipes import quote
+from threading import Event, Lock
+import logging
+import os
+import subprocess as sp
+
+# Shell loop that is executed on the cores. Every request is a single line
+# "<id> <command>". Every line of the command's output is replied as
+# "<id> > <line>", followed by "<id> = <exit code>" once it has completed.
+# Commands are executed one at a time, unless the request is sent as
+# "<id> & <command>": that command runs in the background and replies
+# whenever it completes. Every reply line is a single write, so the lines of
+# concurrent commands do not mix.
+AGENT_SCRIPT = r'''
+run() {
+    out=$(eval "$2" 2>&1 </dev/null)
+    rc=$?
+    if [ -n "$out" ]; then
+        printf '%s\n' "$out" | while IFS= read -r l; do
+            printf '%s > %s\n' "$1" "$l"
+        done
+    fi
+    printf '%s = %d\n' "$1" "$rc"
+}
+while IFS= read -r line; do
+    id=${line%% *}
+    command=${line#* }
+    case $command in
+        "& "*) run "$id" "${command#& }" & ;;
+        *) run "$id" "$command" ;;
+    esac
+done
+'''
+
+
+class Request:
+    """A command that has been sent to an agent."""
+
+    def __init__(self, rid, command):
+        self.id = rid
+        self.command = command
+        self.output = []
+        self.rc = None
+        self.done = Event()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the reply. Returns the exit code of the command, or None
+        when no reply was received.
+        """
+        self.done.wait(timeout)
+        return self.rc
+
+
+class Agent:
+    """
+    Long-lived command agent. The agent is started once and accepts any
+    number of pipelined commands over its stdin. Replies are matched to
+    their requests by id, so multiple threads can use one agent at once.
+    The output of the agent is read by the chip's OutputReactor.
+
+    The agent executes its commands in order, one at a time, so a slow
+    command delays every command sent after it. Long-running commands, such
+    as checkpoints, must therefore be sent with 'background' set.
+    """
+
+    def __init__(self, name, argv, **kwargs):
+        self.logger = logging.getLogger('Agent')
+
+        self.name = name
+        self.argv = argv
+        self.reactor = kwargs.get('reactor', None)
+        self.timeout = kwargs.get('timeout', 30)
+
+        self.p = None
+        # Protects the process and the pending requests
+        self.lock = Lock()
+        # Serializes the writes to the agent, which may block
+        self.write_lock = Lock()
+        self.pending = dict()
+        self._next_id = 0
+
+    def start(self):
+        """Start the agent. Must be called with the lock held."""
+        self.logger.debug("Starting the agent on %s" % self.name)
+        self.p = sp.Popen(
+            self.argv,
+            stdin=sp.PIPE,
+            stdout=sp.PIPE,
+            stderr=sp.STDOUT,
+            close_fds=True
+        )
+        self.reactor.register(self, self.p.stdout)
+
+    def batch(self, commands, background=False):
+        """
+        Send all given commands in a single write. Returns their Request
+        objects, without waiting for the replies. When 'background' is set,
+        the commands run in the background on the core, so they do not delay
+        the commands sent after them.
+        """
+        requests = []
+        lines = []
+        for command in commands:
+            if '\n' in command:
+                raise ValueError("Commands cannot contain line breaks")
+
+        # The lock is only held to register the requests, so that replies
+        # can be processed while a write blocks on a full pipe
+        with self.lock:
+            for command in commands:
+                self._next_id += 1
+                r = Request(self._next_id, command)
+                requests.append(r)
+                lines.append("%d %s%s\n" %
+                    (r.id, "& " if background else "", command))
+
+            try:
+                if self.p is None or self.p.poll() is not None:
+                    self.start()
+            except (IOError, OSError) as e:
+                self.fail(requests, e)
+                return requests
+
+            p = self.p
+            for r in requests:
+                self.pending[r.id] = r
+
+        try:
+            with self.write_lock:
+                p.stdin.write("".join(lines))
+                p.stdin.flush()
+        except (IOError, OSError, ValueError) as e:
+            # ValueError: the agent was stopped and its stdin closed
+            with self.lock:
+                for r in requests:
+                    self.pending.pop(r.id, None)
+            self.fail(requests, e)
+
+        return requests
+
+    def fail(self, requests, error):
+        """Fail the given requests, which could not be sent."""
+        self.logger.warning(
+            "Could not send to the agent on %s: %s" % (self.name, error)
+        )
+        for r in requests:
+            r.done.set()
+
+    def submit(self, command, background=False):
+        """Send a single command, without waiting for its reply."""
+        return self.batch([command], background)[0]
+
+    def call(self, command, timeout=None, background=False):
+        """
+        Execute a single command and wait for its reply. Returns a tuple of
+        the exit code, or None when no reply was received, and the lines of
+        output.
+        """
+        r = self.submit(command, background)
+        rc = r.wait(timeout or self.timeout)
+        return rc, r.output
+
+    def process_line(self, line):
+        """Process a line of output of the agent."""
+        parts = line.rstrip('\n').split(' ', 2)
+        try:
+            r = self.pending.get(int(parts[0]))
+        except ValueError:
+            r = None
+
+        if r is None or len(parts) < 2:
+            # Not a reply, e.g. a message of ssh
+            self.logger.debug("%s: %s" % (self.name, line.rstrip('\n')))
+            return True
+
+        if parts[1] == '>':
+            r.output.append("%s\n" % (parts[2] if len(parts) > 2 else ""))
+        elif parts[1] == '=':
+            with self.lock:
+                self.pending.pop(r.id, None)
+            r.rc = int(parts[2])
+            r.done.set()
+
+        return True
+
+    def process_eof(self, pipe):
+        """The agent has exited, fail all outstanding requests."""
+        with self.lock:
+            if self.p is not None:
+                if pipe is not self.p.stdout:
+                    # Output of an earlier agent process
+                    return
+                self.logger.warning("The agent on %s exited" % self.name)
+                self.p = None
+
+            pending = self.pending.values()
+            self.pending.clear()
+
+        for r in pending:
+            r.done.set()
+
+    def stop(self):
+        """Stop the agent."""
+        with self.lock:
+            p, self.p = self.p, None
+
+        if p is not None:
+            try:
+                p.stdin.close()
+                p.wait()
+            except (IOError, OSError):
+                pass
+
+
+class RemoteAgent(Agent):
+    """Agent on one of the cores, reached through its ssh master."""
+
+    def __init__(self, core, **kwargs):
+        host = "root@rck%02d" % core
+        Agent.__init__(
+            self,
+            "rck%02d" % core,
+            [
+                'ssh', '-S', os.path.expanduser('~/.ssh/%s' % host), host,
+                'sh -c %s' % quote(AGENT_SCRIPT)
+            ],
+            **kwargs
+        )
+
+
+class LocalAgent(Agent):
+    """Stand-in for a RemoteAgent that executes its commands locally."""
+
+    def __init__(self, core, **kwargs):
+        Agent.__init__(
+            self,
+            "local%02d" % core,
+            ['sh', '-c', AGENT_SCRIPT],
+            **kwargs
+        )
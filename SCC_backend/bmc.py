@@ -0,0 +1,201 @@
+"""
+ManyMan - A Many-core Visualization and Management System
+Copyright (C) 2012
+University of Amsterdam - Computer Systems Architecture
+Jimi van der Woning and Roy Bakker
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from random import randint, uniform
+from threading import Thread, Event, Lock
+import logging
+import subprocess as sp
+
+# Program that keeps a session with the board management controller open,
+# reading BMC commands from stdin and writing their replies to stdout
+BMC_COMMAND = "sccBmc"
+
+# Voltage island powered by each of the OPVR voltage regulators
+OPVR_ISLANDS = {
+    "VCC0": 3,
+    "VCC1": 4,
+    "VCC3": 5,
+    "VCC4": 0,
+    "VCC5": 1,
+    "VCC7": 2
+}
+
+
+class BmcSession:
+    """
+    Persistent session with the BMC. Every request writes a status command
+    to the session, whose reply lines are handed to the callback by the
+    chip's OutputReactor. The session is restarted when it has exited.
+    """
+
+    def __init__(self, callback, **kwargs):
+        self.logger = logging.getLogger('BmcSession')
+
+        self.callback = callback
+        self.command = kwargs.get('command', BMC_COMMAND)
+        self.reactor = kwargs.get('reactor', None)
+
+        self.p = None
+        self.lock = Lock()
+
+    def start(self):
+        """Start the session. Must be called with the lock held."""
+        self.logger.debug("Opening a session with the BMC")
+        self.p = sp.Popen(
+            self.command,
+            shell=True,
+            stdin=sp.PIPE,
+            stdout=sp.PIPE,
+            stderr=sp.STDOUT,
+            close_fds=True
+        )
+        self.reactor.register(self, self.p.stdout)
+
+    def request(self):
+        """Request the status of the board."""
+        with self.lock:
+            try:
+                if self.p is None or self.p.poll() is not None:
+                    self.start()
+                self.p.stdin.write("status\n")
+                self.p.stdin.flush()
+            except (IOError, OSError) as e:
+                self.logger.warning("Could not send to the BMC: %s" % e)
+
+    def process_line(self, line):
+        """Process a line of output of the session."""
+        self.callback(line)
+        return True
+
+    def process_eof(self, pipe):
+        """The session has exited, it is restarted on the next request."""
+        with self.lock:
+            if self.p is not None and pipe is self.p.stdout:
+                self.logger.warning("The BMC session exited")
+                self.p = None
+
+    def close(self):
+        """Close the session."""
+        with self.lock:
+            p, self.p = self.p, None
+
+        if p is not None:
+            try:
+                p.stdin.close()
+                p.wait()
+            except (IOError, OSError):
+                pass
+
+
+class StandInSession:
+    """
+    Stand-in for the BMC session, used in dummy mode. Every request replies
+    the next status from 'replies' when given, otherwise a made-up status
+    that wanders around like a loaded chip.
+    """
+
+    def __init__(self, callback, **kwargs):
+        self.callback = callback
+        self.replies = list(kwargs.get('replies', []))
+        self.current = 7.5
+        self.voltages = dict((rail, 1.1) for rail in OPVR_ISLANDS)
+
+    def status(self):
+        """Return the lines of a made-up status."""
+        self.current = min(38., max(7.5, self.current + .3 * randint(-10, 10)))
+        lines = ["3V3SCC: 3.30 V %.2f A\n" % self.current]
+        for rail in sorted(self.voltages):
+            self.voltages[rail] = min(
+                1.3,
+                max(.7, self.voltages[rail] + uniform(-.01, .01))
+            )
+            lines.append("OPVR %s: %.3f V\n" % (rail, self.voltages[rail]))
+        return lines
+
+    def request(self):
+        """Request the status of the board."""
+        if self.replies:
+            lines = self.replies.pop(0)
+        else:
+            lines = self.status()
+
+        for line in lines:
+            self.callback(line)
+
+    def close(self):
+        """Close the session."""
+        pass
+
+
+class BmcSampler(Thread):
+    """
+    Samples the power consumption of the chip and the voltage of every
+    voltage island through one persistent BMC session. The last readings
+    are kept in 'power' (in Watts) and in the per-island array 'voltages',
+    which holds None for islands that have not been read yet.
+    """
+
+    def __init__(self, **kwargs):
+        self.logger = logging.getLogger('BmcSampler')
+
+        self.interval = kwargs.get('interval', 1.)
+        self.islands = kwargs.get('islands', len(OPVR_ISLANDS))
+
+        self.power = None
+        self.voltages = [None] * self.islands
+        self.samples = 0
+
+        session = kwargs.get('session', BmcSession)
+        self.session = session(self.parse_line, **kwargs.get('options', {}))
+
+        self.running = True
+        self._stop_event = Event()
+
+        Thread.__init__(self)
+        self.daemon = True
+
+    def parse_line(self, line):
+        """Parse a line of the status of the board."""
+        fields = line.split()
+        try:
+            if line.startswith("3V3SCC:"):
+                _, u, _, i, _ = fields
+                self.power = float(u) * float(i)
+                self.samples += 1
+            elif line.startswith("OPVR VCC"):
+                _, rail, u, _ = fields
+                island = OPVR_ISLANDS.get(rail.rstrip(':'))
+                if island is not None and island < self.islands:
+                    self.voltages[island] = float(u)
+        except ValueError:
+            self.logger.debug("Unexpected status line: %s" % line.strip())
+
+    def run(self):
+        """Keep sampling on the configured interval."""
+        while self.running:
+            self.session.request()
+            self._stop_event.wait(self.interval)
+
+        self.session.close()
+
+    def stop(self):
+        """Stop sampling."""
+        self.running = False
+        self._stop_event.set()
@@ -18,12 +18,16 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+from agent import RemoteAgent, LocalAgent
+from bmc import BmcSampler, BmcSession, StandInSession, BMC_COMMAND
+from ckptstore import CheckpointStore, STORE_DIR
 from core import Core, Status as CoreStatus
-from random import randint
-import subprocess as sp
-from task import Task
-from threading import Thread
-from time import sleep
+from migration import MigrationEngine, Stage, STAGING_DIR
+from placement import PlacementIndex, core_loads
+from reactor import OutputReactor
+from task import Task, Status as TaskStatus
+from threading import Thread, Lock
+from time import sleep, time
 import logging
 
 class Status:
@@ -57,15 +61,69 @@ class Chip(Thread):
         self.cores = []
         self.tasks = dict()
         self.dummy_mode = kwargs.get('dummy_mode', False)
+        self.reactor = None
+        self.agents = []
+        self.store = None
 
         self.running = True
         self.power_usage = 25
         self.status = Status.PENDING
         self.task_count = 0
+        self.task_lock = Lock()
 
         for i in range(cores):
             self.cores.append(Core(i, dummy_mode=self.dummy_mode))
 
+        if not self.dummy_mode:
+            self.reactor = OutputReactor()
+            self.reactor.start()
+
+            # One command agent per core, started on its first command.
+            # Local agents execute all commands on the host instead.
+            if kwargs.get('agent_mode', 'ssh') == 'local':
+                agent = LocalAgent
+            else:
+                agent = RemoteAgent
+            self.agents = [agent(i, reactor=self.reactor)
+                for i in range(cores)]
+
+            self.store = CheckpointStore(
+                self.agents,
+                path=kwargs.get('store_dir', STORE_DIR)
+            )
+        if self.dummy_mode:
+            session = StandInSession
+            options = dict()
+        else:
+            session = BmcSession
+            options = dict(
+                command=kwargs.get('bmc_command', BMC_COMMAND),
+                reactor=self.reactor
+            )
+        self.bmc = BmcSampler(
+            session=session,
+            options=options,
+            islands=len(voltage_islands),
+            interval=1. / kwargs.get('bmc_sample_frequency', 1)
+        )
+
+        self.store_gc_interval = kwargs.get('store_gc_interval', 300)
+        self._last_gc = time()
+
+        self.migration = MigrationEngine(
+            self,
+            store=self.store,
+            workers=kwargs.get('migration_workers', 8),
+            staging_dir=kwargs.get('migration_staging_dir', STAGING_DIR),
+            compress=kwargs.get('migration_compress', True)
+        )
+
+        # Load of every core for smart placement, per frequency island
+        self.placement = PlacementIndex(
+            kwargs.get('clusters', voltage_islands)
+        )
+        self.update_placement()
+
         self.status = Status.CONNECTING
         self.start()
 
@@ -83,7 +141,8 @@ class Chip(Thread):
             "Status": "%s" % Status(self.status),
             "Cores": [],
             "Tasks": [],
-            "Power": self.power_usage
+            "Power": self.power_usage,
+            "Migrations": self.migration.progress()
         }
         
         for core in self.cores:
@@ -98,6 +157,8 @@ class Chip(Thread):
 
     def run(self):
         """Setup the connection to all cores and retrieve power usage."""
+        self.bmc.start()
+
         while self.running:
             sleep(1)
 
@@ -116,101 +177,232 @@ class Chip(Thread):
             else:
                 self.get_power()
 
+            # The placement index is refreshed once per tick
+            self.update_placement()
+
+            if self.store and time() - self._last_gc > self.store_gc_interval:
+                self._last_gc = time()
+                try:
+                    self.store.gc()
+                except (IOError, OSError) as e:
+                    self.logger.warning("Checkpoint store gc failed: %s" % e)
+
     def stop(self):
         """Stop the chip control."""
         self.status = Status.EXITING
         self.running = False
+        self.bmc.stop()
 
         # Stop all cores and tasks
         for core in self.cores:
             for task in core.tasks.values():
-                self.logger.debug("Joining task %s..." % task.name)
+                self.logger.debug("Joining task %s..." % task.tid)
                 task.join()
                 self.logger.debug("Joined")
             self.logger.debug("Joining core %s..." % core)
+            core.stop()
             core.join()
             self.logger.debug("Joined")
 
+        if self.store:
+            # Parked tasks do not survive the back-end
+            for task in self.tasks.values():
+                if task.context:
+                    self.store.release(task.context)
+                    task.context = None
+            try:
+                self.store.gc()
+            except (IOError, OSError) as e:
+                self.logger.warning("Checkpoint store gc failed: %s" % e)
+
+        for agent in self.agents:
+            agent.stop()
+
+        if self.reactor:
+            self.reactor.stop()
+
     def get_power(self):
         """Retrieve the chip's power consumption."""
-        if self.dummy_mode:
-            self.power_usage = min(
-                125,
-                max(25, self.power_usage + randint(-10, 10))
-            )
-        else:
-            p = sp.Popen(
-                'sccBmc -c status',
-                shell=True,
-                stdout=sp.PIPE,
-                stderr=sp.PIPE
-            )
-    
-            # Show output, if any
-            out, err = p.communicate()
-            if len(err) > 0:
-                self.logger.warning(
-                    "Error when retrieving power: %s" % err
-                )
-
-            # Retrieve power usage information
-            for line in out.split('\n'):
-                if "3V3SCC:" in line:
-                    _, u, _, i, _ = line.split()
-                    self.power_usage = float(u) * float(i)
-                elif "OPVR VCC0:" in line:
-                    _, _, i, _ = line.split()
-                    for c in self.voltage_islands[3]:
-                        self.cores[c].voltage = float(i)
-                elif "OPVR VCC1:" in line:
-                    _, _, i, _ = line.split()
-                    for c in self.voltage_islands[4]:
-                        self.cores[c].voltage = float(i)
-                elif "OPVR VCC3:" in line:
-                    _, _, i, _ = line.split()
-                    for c in self.voltage_islands[5]:
-                        self.cores[c].voltage = float(i)
-                elif "OPVR VCC4:" in line:
-                    _, _, i, _ = line.split()
-                    for c in self.voltage_islands[0]:
-                        self.cores[c].voltage = float(i)
-                elif "OPVR VCC5:" in line:
-                    _, _, i, _ = line.split()
-                    for c in self.voltage_islands[1]:
-                        self.cores[c].voltage = float(i)
-                elif "OPVR VCC7:" in line:
-                    _, _, i, _ = line.split()
-                    for c in self.voltage_islands[2]:
-                        self.cores[c].voltage = float(i)
+        # The BMC is sampled in the background by the BMC sampler
+        if self.bmc.power is not None:
+            self.power_usage = self.bmc.power
+
+        for island, voltage in enumerate(self.bmc.voltages):
+            if voltage is None:
+                continue
+            for c in self.voltage_islands[island]:
+                self.cores[c].voltage = voltage
+
+    def update_placement(self):
+        """Snapshot the load of every core into the placement index."""
+        self.placement.update(core_loads(self.cores, self.tasks.values()))
+
+    def new_task_id(self):
+        """
+        Return a new task ID. Commands are executed concurrently, so the
+        task count is incremented under a lock.
+        """
+        with self.task_lock:
+            self.task_count += 1
+            return "T%04d" % self.task_count
 
     def add_task(self, name, program, core):
         """Add a task with the given name and program to the given core."""
-        self.task_count += 1
-        task_id = "T%04d" % self.task_count
+        if not 0 <= core < len(self.cores):
+            raise Exception("Invalid core %d." % core)
+        c = self.cores[core]
+
+        task_id = self.new_task_id()
         self.logger.debug("Adding task %s" % task_id)
-        t = Task(task_id, core, name, program, dummy_mode=self.dummy_mode)
-        self.cores[core].add_task(t)
+        t = Task(task_id, core, name, program, dummy_mode=self.dummy_mode,
+            reactor=self.reactor, agents=self.agents)
+        c.add_task(t)
         self.tasks[task_id] = t
         return task_id
 
+    def add_tasks(self, specs):
+        """
+        Add the tasks in 'specs', a list of (name, program, core) tuples.
+        Returns the IDs of the new tasks.
+        """
+        return [self.add_task(name, program, core)
+            for name, program, core in specs]
+
     def move_task(self, tid, to_core):
-        """Move the task with given Task ID (tid) to core 'to_core'."""
+        """
+        Move the task with given Task ID (tid) to core 'to_core'. Returns
+        whether the task was moved.
+        """
         t = self.tasks[tid]
         if to_core < 0:
-            if self.cores[t.core].checkpoint_task(t):
+            if self.migration.park(t):
                 t.core = -1
-        else:
-            self.cores[t.core].move_task(t, self.cores[to_core])
+                return True
+            return False
+
+        migrations = self.migrate_tasks([(tid, to_core)])
+        return len(migrations) > 0 and migrations[0].stage == Stage.DONE
+
+    def migrate_tasks(self, moves):
+        """
+        Migrate the tasks in 'moves', a list of (tid, to_core) tuples, in
+        parallel. Returns the list of migrations.
+        """
+        return self.migration.migrate(
+            [(self.tasks[tid], to_core) for tid, to_core in moves]
+        )
+
+    def move_tasks(self, moves):
+        """
+        Move the tasks in 'moves', a list of (tid, to_core) tuples. Tasks
+        that move off the chip are parked, all others are migrated in
+        parallel. Returns the IDs of the moved tasks.
+        """
+        moved = []
+        migrations = []
+        for tid, to_core in moves:
+            if to_core < 0:
+                t = self.tasks[tid]
+                if self.migration.park(t):
+                    t.core = -1
+                    moved.append(tid)
+            else:
+                migrations.append((tid, to_core))
+
+        for m in self.migrate_tasks(migrations):
+            if m.stage == Stage.DONE:
+                moved.append(m.task.tid)
+        return moved
+
+    def signal_tasks(self, tids, sig, action, statuses, via, to):
+        """
+        Send the signal 'sig' to the tasks with the IDs in 'tids' that are
+        in one of the given 'statuses'. The commands for all tasks on a core
+        are sent to its agent in one write, and the replies are awaited once
+        every core has been signalled. The tasks go through status 'via' to
+        status 'to'. 'action' describes the operation in the log messages.
+        Returns the signalled tasks.
+        """
+        tasks = [self.tasks[tid] for tid in tids]
+        if self.dummy_mode:
+            for t in tasks:
+                t.status = to
+            return tasks
+
+        commands = dict()
+        for t in tasks:
+            if t.status not in statuses:
+                self.logger.warning("%s %s failed: status is %s" %
+                    (action, t.tid, TaskStatus(t.status)))
+                continue
+
+            try:
+                command = 'kill -%s %d' % (sig, t.pid)
+            except Exception as e:
+                self.logger.warning("%s %s failed: %s" % (action, t.tid, e))
+                continue
+
+            t.status = via
+            commands.setdefault(t.core, []).append((t, command))
+
+        requests = []
+        for core, pending in commands.iteritems():
+            sent = self.agents[core].batch([c for _, c in pending])
+            requests.extend(zip([t for t, _ in pending], sent))
+
+        signalled = []
+        for t, r in requests:
+            rc = r.wait(self.agents[t.core].timeout)
+            if rc is None:
+                self.logger.warning("%s %s failed: no reply from core %02d" %
+                    (action, t.tid, t.core))
+            elif rc != 0:
+                self.logger.warning("%s %s exited with some errors: %s" %
+                    (action, t.tid, "".join(r.output)))
+            else:
+                t.output += r.output
+                signalled.append(t)
+            t.status = to
+
+        return signalled
 
     def pause_task(self, tid):
         """Pause the task with ID 'tid'."""
         t = self.tasks[tid]
-        self.cores[t.core].pause_task(t)
+        return self.cores[t.core].pause_task(t)
 
     def resume_task(self, tid):
         """Resume the task with ID 'tid'."""
         t = self.tasks[tid]
-        self.cores[t.core].resume_task(t)
+        return self.cores[t.core].resume_task(t)
+
+    def pause_tasks(self, tids):
+        """
+        Pause the tasks with the IDs in 'tids'. Returns the IDs of the
+        paused tasks.
+        """
+        return [t.tid for t in self.signal_tasks(
+            tids,
+            'STOP',
+            "Stopping",
+            (TaskStatus.RUNNING, ),
+            TaskStatus.STOPPING,
+            TaskStatus.STOPPED
+        )]
+
+    def resume_tasks(self, tids):
+        """
+        Resume the tasks with the IDs in 'tids'. Returns the IDs of the
+        resumed tasks.
+        """
+        return [t.tid for t in self.signal_tasks(
+            tids,
+            'CONT',
+            "Continuing",
+            (TaskStatus.STOPPED, ),
+            TaskStatus.CONTINUING,
+            TaskStatus.RUNNING
+        )]
 
     def kill_task(self, tid):
         """Kill the task with ID 'tid'."""
@@ -220,23 +412,49 @@ class Chip(Thread):
             self.tasks.pop(t.tid)
             return output
 
+    def kill_tasks(self, tids):
+        """
+        Kill the tasks with the IDs in 'tids'. All tasks are signalled
+        before any of them is joined. Returns the output of every killed
+        task, keyed by its ID.
+        """
+        killed = self.signal_tasks(
+            tids,
+            'TERM',
+            "Killing",
+            (TaskStatus.RUNNING, TaskStatus.STOPPED),
+            TaskStatus.KILLING,
+            TaskStatus.KILLED
+        )
+
+        outputs = dict()
+        for t in killed:
+            t.join()
+            outputs[t.tid] = t.output
+            self.tasks.pop(t.tid)
+        return outputs
+
     def duplicate_task(self, tid):
         """Duplicate the task with ID 'tid'."""
         t = self.tasks[tid]
         if t.core >= 0:
             raise Exception("Running tasks cannot be duplicated.")
 
-        self.task_count += 1
-        task_id = "T%04d" % self.task_count
+        task_id = self.new_task_id()
         d = Task(
             task_id,
             -1,
             t.pname,
             t.program,
             dummy_mode=t.dummy_mode,
+            reactor=self.reactor,
+            agents=self.agents,
             status=t._status
         )
         d._cfile = t._cfile
+        if t.context:
+            # Share the chunks of the stored context
+            d.context = self.store.link(t.context, task_id)
         d.output = t.output
         self.tasks[task_id] = d
 
@@ -0,0 +1,165 @@
+"""
+ManyMan - A Many-core Visualization and Management System
+Copyright (C) 2012
+University of Amsterdam - Computer Systems Architecture
+Jimi van der Woning and Roy Bakker
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from task import CONTEXTS_DIR
+from threading import Lock
+from time import time
+import logging
+import os
+import shutil
+
+# Location of the store on the shared filesystem
+STORE_DIR = "%s/store" % CONTEXTS_DIR
+
+# Executed on a core: split the context file into chunks, copy the chunks
+# that are not in the store yet and write the manifest, which lists the
+# hashes of all chunks in order.
+PUT_COMMAND = (
+    'f=%(file)s; s=%(store)s; m=%(manifest)s; '
+    'mkdir -p $s/chunks $s/manifests && rm -f $f.part.* && '
+    'split -b %(chunk_size)d -a 5 $f $f.part. && : > $m.tmp && '
+    'for c in $f.part.*; do '
+    '[ -e "$c" ] || continue; '
+    'h=$(sha1sum $c); h=${h%%%% *}; '
+    'if [ -e $s/chunks/$h ]; then touch $s/chunks/$h; '
+    'else cp $c $s/chunks/$h.$$ && mv $s/chunks/$h.$$ $s/chunks/$h || exit 1; '
+    'fi; '
+    'echo $h >> $m.tmp || exit 1; '
+    'done && mv $m.tmp $m && rm -f $f $f.part.*'
+)
+
+# Executed on a core: reassemble a context file from its manifest
+GET_COMMAND = (
+    'f=%(file)s; s=%(store)s; m=%(manifest)s; '
+    'mkdir -p $(dirname $f) && '
+    '(cd $s/chunks && xargs cat < $m) > $f.tmp && mv $f.tmp $f'
+)
+
+
+class CheckpointStore:
+    """
+    Content-addressed store for BLCR contexts on the shared filesystem.
+    Contexts are split into fixed-size chunks named by their SHA-1 hash, so
+    chunks that are equal between checkpoints are written only once. A
+    context is referred to by the name of its manifest. Chunks that are no
+    longer referred to by any manifest are removed by gc().
+    """
+
+    def __init__(self, agents, **kwargs):
+        self.logger = logging.getLogger('CheckpointStore')
+
+        self.agents = agents
+        self.path = kwargs.get('path', STORE_DIR)
+        self.chunk_size = kwargs.get('chunk_size', 65536)
+
+        # Chunks younger than the grace period may belong to a manifest
+        # that is still being written
+        self.grace = kwargs.get('grace', 600)
+
+        self.lock = Lock()
+        self._count = 0
+
+    def _manifest(self, name):
+        """Return the path of the manifest with given name."""
+        return os.path.join(self.path, 'manifests', name)
+
+    def _name(self, tid):
+        """Return a new, unique manifest name for the given task."""
+        with self.lock:
+            self._count += 1
+            return "%s.%d.%d" % (tid, int(time()), self._count)
+
+    def put(self, core, cfile, tid):
+        """
+        Store the context file 'cfile' on the given core and remove it.
+        Returns the name of the stored context.
+        """
+        name = self._name(tid)
+        rc, out = self.agents[core].call(PUT_COMMAND % {
+            'file': cfile,
+            'store': self.path,
+            'manifest': self._manifest(name),
+            'chunk_size': self.chunk_size
+        }, background=True)
+        if rc != 0:
+            raise Exception("Could not store %s: %s" % (cfile, "".join(out)))
+        return name
+
+    def get(self, core, name, cfile):
+        """Restore the stored context 'name' to 'cfile' on the given core."""
+        rc, out = self.agents[core].call(GET_COMMAND % {
+            'file': cfile,
+            'store': self.path,
+            'manifest': self._manifest(name)
+        }, background=True)
+        if rc != 0:
+            raise Exception("Could not restore %s: %s" % (name, "".join(out)))
+
+    def link(self, name, tid):
+        """
+        Refer to the stored context 'name' for the given task, without
+        copying any chunks. Returns the new name.
+        """
+        new_name = self._name(tid)
+        shutil.copyfile(self._manifest(name), self._manifest(new_name))
+        return new_name
+
+    def release(self, name):
+        """Drop the reference to the stored context 'name'."""
+        try:
+            os.unlink(self._manifest(name))
+        except OSError as e:
+            self.logger.warning("Could not release %s: %s" % (name, e))
+
+    def gc(self):
+        """Remove all chunks that are not referred to by a manifest."""
+        manifests = os.path.join(self.path, 'manifests')
+        chunks = os.path.join(self.path, 'chunks')
+        if not os.path.isdir(manifests) or not os.path.isdir(chunks):
+            return 0
+
+        referenced = set()
+        for name in os.listdir(manifests):
+            try:
+                f = open(os.path.join(manifests, name), 'r')
+                try:
+                    referenced.update(f.read().split())
+                finally:
+                    f.close()
+            except IOError:
+                # Released in the meantime
+                pass
+
+        removed = 0
+        deadline = time() - self.grace
+        for chunk in os.listdir(chunks):
+            if chunk in referenced:
+                continue
+            path = os.path.join(chunks, chunk)
+            try:
+                if os.path.getmtime(path) < deadline:
+                    os.unlink(path)
+                    removed += 1
+            except OSError:
+                pass
+
+        if removed:
+            self.logger.info("Removed %d unreferenced chunks" % removed)
+        return removed
@@ -18,13 +18,59 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+from pipes import quote
 from random import randint
 from task import Status as TaskStatus
 from threading import Thread
 from time import sleep
 import logging
+import os
 import subprocess as sp
 
+# Sampler that is executed on the cores. Every second it writes one frame:
+# "C <busy jiffies> <total jiffies> <used mem kB> <total mem kB>", a line
+# "P <pid> <utime + stime> <rss pages>" for every tracked pid and a closing
+# "E". The tracked pids are written to its stdin as one line at a time.
+SAMPLER_SCRIPT = r'''
+f=/tmp/manyman.$$
+: > $f
+while :; do
+    read -r cpu user nice system idle iowait irq softirq rest < /proc/stat
+    total=$((user + nice + system + idle + ${iowait:-0} + ${irq:-0} + ${softirq:-0}))
+    while read -r key value unit; do
+        case $key in
+            MemTotal:) mem_total=$value ;;
+            MemFree:) mem_free=$value ;;
+        esac
+    done < /proc/meminfo
+    echo "C $((total - idle - ${iowait:-0})) $total $((mem_total - mem_free)) $mem_total"
+    read -r pids < $f
+    for p in $pids; do
+        if read -r s < /proc/$p/stat && read -r size rss r < /proc/$p/statm; then
+            set -- ${s#*) }
+            echo "P $p $((${12} + ${13})) $rss"
+        fi 2>/dev/null
+    done
+    echo E
+    sleep 1
+done &
+trap 'kill $!; rm -f $f $f.new' EXIT
+while IFS= read -r line; do
+    echo "$line" > $f.new && mv $f.new $f
+done
+'''
+
+# Size of a memory page on the cores in kB
+PAGE_SIZE = 4
+
+# Task statuses in which the task's process exists and can be sampled
+SAMPLED_STATUSES = (
+    TaskStatus.RUNNING,
+    TaskStatus.STOPPING,
+    TaskStatus.STOPPED,
+    TaskStatus.CONTINUING
+)
+
 class Status:
     """Core statuses."""
 
@@ -57,6 +103,13 @@ class Core(Thread):
         self._frequency = 533
         self._voltage = 1.
 
+        # Tracked tasks keyed by pid, and the samples of the last frame
+        self.pids = dict()
+        self._cpu = None
+        self._d_total = 0
+        self._mem_total = 0
+        self._jiffies = dict()
+
         Thread.__init__(self)
 
         self.setup()
@@ -106,20 +159,27 @@ class Core(Thread):
             return dict_repr
 
     def setup(self):
-        """Setup a connection to the core and execute top."""
+        """
+        Setup a connection to the core and execute the sampler. This ssh
+        session is the master connection for all others to the core.
+        """
         self.status = Status.CONNECTING
 
         if not self.dummy_mode:
+            host = "root@rck%02d" % self.id
             self.p = sp.Popen(
-                'ssh -M -S ~/.ssh/root@rck%02d root@rck%02d \'top -b -d1\'' % \
-                    (self.id, self.id),
-                shell=True,
+                [
+                    'ssh', '-M', '-S', os.path.expanduser('~/.ssh/%s' % host),
+                    host, 'sh -c %s' % quote(SAMPLER_SCRIPT)
+                ],
+                stdin=sp.PIPE,
                 stdout=sp.PIPE,
-                stderr=sp.STDOUT
+                stderr=sp.STDOUT,
+                close_fds=True
             )
 
     def run(self):
-        """Continuously read the output of top."""
+        """Continuously read the output of the sampler."""
         if self.dummy_mode:
             self.status = Status.RUNNING
             return
@@ -135,32 +195,85 @@ class Core(Thread):
 
             self.parse_perf(line)
 
+    def stop(self):
+        """Stop the sampler, which ends the connection to the core."""
+        if not self.dummy_mode:
+            try:
+                self.p.stdin.close()
+            except (IOError, OSError):
+                pass
+
+    def track_tasks(self):
+        """
+        Rebuild the pid to task dictionary and send the tracked pids to the
+        sampler when they have changed.
+        """
+        pids = dict()
+        for task in self.tasks.values():
+            if task.status not in SAMPLED_STATUSES:
+                continue
+            try:
+                pids[task.pid] = task
+            except Exception:
+                # The process id is not known (yet)
+                pass
+
+        if set(pids) != set(self.pids):
+            try:
+                self.p.stdin.write(
+                    "%s\n" % " ".join(str(pid) for pid in pids)
+                )
+                self.p.stdin.flush()
+            except (IOError, OSError) as e:
+                self.logger.warning("Could not update the sampler: %s" % e)
+        self.pids = pids
+
     def parse_perf(self, line):
-        """Retrieve the process data from top's output."""
-        if line.lower().find("cpu:") >= 0:
-            # Retrieve core ovrall CPU usage
-            self.cpu_usage = \
-                max(0, 100.0 - float(line.split('%')[3].split()[1]))
-
-        elif line.lower().find("mem:") >= 0:
-            # Retrieve core overall memory usage
-            self.mem_usage = \
-                100 * float(line.split()[1][:-1]) / \
-                (float(line.split()[1][:-1]) + float(line.split()[3][:-1]))
-
-        elif len(line.split()) >= 8:
-            # Retrieve per task performance data
-            parts = line.split()
-            pid = parts[0]
-            mem = parts[5]
-            cpu = parts[6]
-            for task in self.tasks.values():
-                try:
-                    if task.pid == int(pid):
-                        task.cpu_usage = float(cpu[:-1])
-                        task.mem_usage = float(mem[:-1])
-                except:
-                    pass
+        """Process a line of a frame of the sampler."""
+        parts = line.split()
+        if not parts:
+            return
+
+        try:
+            if parts[0] == 'C' and len(parts) == 5:
+                busy, total, mem_used, mem_total = map(int, parts[1:])
+                if self._cpu and total > self._cpu[1]:
+                    self._d_total = total - self._cpu[1]
+                    self.cpu_usage = max(
+                        0.0,
+                        100.0 * (busy - self._cpu[0]) / self._d_total
+                    )
+                self._cpu = (busy, total)
+                if mem_total > 0:
+                    self.mem_usage = 100.0 * mem_used / mem_total
+                self._mem_total = mem_total
+
+            elif parts[0] == 'P' and len(parts) == 4:
+                pid, jiffies, rss = map(int, parts[1:])
+                task = self.pids.get(pid)
+                if task is None:
+                    return
+
+                prev = self._jiffies.get(pid)
+                if prev is not None and self._d_total > 0:
+                    task.cpu_usage = max(
+                        0.0,
+                        100.0 * (jiffies - prev) / self._d_total
+                    )
+                self._jiffies[pid] = jiffies
+                if self._mem_total > 0:
+                    task.mem_usage = 100.0 * rss * PAGE_SIZE / self._mem_total
+
+            elif parts[0] == 'E':
+                for pid in self._jiffies.keys():
+                    if pid not in self.pids:
+                        del self._jiffies[pid]
+                self.track_tasks()
+
+            else:
+                self.logger.debug("Core %d: %s" % (self.id, line[:-1]))
+        except ValueError:
+            self.logger.warning("Invalid sampler line: %s" % line[:-1])
 
     def add_task(self, t):
         """Add the given task to this core."""
@@ -194,6 +307,9 @@ class Core(Thread):
                 # Allow for a context switch
                 sleep(.1)
                 pass
+            return True
+        else:
+            return False
 
     def resume_task(self, t):
         """Resume the given task."""
@@ -202,6 +318,9 @@ class Core(Thread):
                 # Allow for a context switch
                 sleep(.1)
                 pass
+            return True
+        else:
+            return False
 
     def kill_task(self, t):
         """Kill the given task."""
@@ -0,0 +1,181 @@
+"""
+ManyMan - A Many-core Visualization and Management System
+Copyright (C) 2012
+University of Amsterdam - Computer Systems Architecture
+Jimi van der Woning and Roy Bakker
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Load test of the back-end's event loop with many simultaneous front-ends.
+# A back-end is started in dummy mode and all clients connect before any of
+# them initializes. Every client then sends its client_init message and
+# counts the status updates it receives. The test fails when a client does
+# not receive its server_init message or no status updates at all.
+#
+# Usage: python load_test.py [options] [settings file]
+
+from server import default_settings
+from threading import Thread
+from time import sleep, time
+import argparse
+import config
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+
+
+class LoadClient(Thread):
+    """Simulated front-end connection."""
+
+    def __init__(self, name, address, duration):
+        Thread.__init__(self, name=name)
+        self.daemon = True
+
+        self.address = address
+        self.duration = duration
+
+        self.sock = None
+        self.init_latency = None
+        self.status_count = 0
+        self.error = None
+
+    def connect(self):
+        """Connect to the back-end."""
+        self.sock = socket.create_connection(self.address, 10)
+
+    def run(self):
+        """Initialize and receive messages for the configured duration."""
+        try:
+            f = self.sock.makefile()
+            start = time()
+            self.sock.sendall("%s\n" % json.dumps({
+                'type': 'client_init',
+                'content': {
+                    'name': self.name
+                }
+            }))
+
+            while time() - start < self.duration:
+                line = f.readline()
+                if not line:
+                    raise Exception("Connection closed")
+
+                msg = json.loads(line)
+                if msg['type'] == 'server_init':
+                    self.init_latency = time() - start
+                elif msg['type'] in ('status', 'status_delta'):
+                    if self.init_latency is None:
+                        raise Exception("Status before server_init")
+                    self.status_count += 1
+                elif msg['type'] == 'invalid_message':
+                    raise Exception(msg['content']['message'])
+        except Exception, e:
+            self.error = e
+        finally:
+            self.sock.close()
+
+
+def start_server(settings_file):
+    """Start a back-end in dummy mode."""
+    return subprocess.Popen(
+        [sys.executable, 'server.py', '-d', os.path.abspath(settings_file)],
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+
+
+def stop_server(p):
+    """Stop the back-end like an interrupt from the console does."""
+    p.send_signal(signal.SIGINT)
+    for _ in range(50):
+        if p.poll() is not None:
+            return
+        sleep(.1)
+    p.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve many simultaneous front-ends from a dummy chip."
+    )
+    parser.add_argument('settings', nargs='?', default='settings.cfg')
+    parser.add_argument('--clients', type=int, default=50,
+        help="number of simultaneous clients")
+    parser.add_argument('--duration', type=float, default=10.,
+        help="time every client receives messages in seconds")
+    parser.add_argument('--no-server', action='store_true',
+        help="connect to a running back-end instead of starting one")
+    args = parser.parse_args()
+
+    settings = default_settings.copy()
+    try:
+        settings.update(config.Config(file(args.settings)))
+    except Exception, err:
+        print 'Settings could not be loaded: %s' % err
+        exit(1)
+
+    host, port = settings['address']
+    address = (host or '127.0.0.1', port)
+
+    server = None
+    if not args.no_server:
+        server = start_server(args.settings)
+        # Give the back-end time to set up its chip
+        sleep(2)
+
+    try:
+        clients = [LoadClient("Load%d" % i, address, args.duration)
+            for i in range(args.clients)]
+        for c in clients:
+            c.connect()
+        for c in clients:
+            c.start()
+        for c in clients:
+            c.join(args.duration + 10)
+    finally:
+        if server:
+            stop_server(server)
+
+    failed = [c for c in clients
+        if c.error or c.init_latency is None or c.status_count == 0]
+    counts = sorted(c.status_count for c in clients)
+    latencies = [c.init_latency for c in clients
+        if c.init_latency is not None]
+
+    print "%-24s %d" % ("Clients", len(clients))
+    print "%-24s %d" % ("Failed", len(failed))
+    print "%-24s %d / %d / %d" % (
+        "Status min/median/max",
+        counts[0],
+        counts[len(counts) / 2],
+        counts[-1]
+    )
+    if latencies:
+        print "%-24s %.3f s" % ("Max server_init latency", max(latencies))
+
+    for c in failed:
+        print "%s: %s" % (
+            c.name,
+            c.error or "no server_init or status received"
+        )
+
+    if failed:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
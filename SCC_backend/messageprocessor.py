@@ -18,12 +18,17 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+from Queue import Queue
+from framing import encodings
+from threading import Thread, Event, Lock
+from time import time
 import json
 import logging
 
 # List of all valid message types
 known_msg_types = (
     'client_init',
+    'status_resync',
     'task_start',
     'task_move',
     'task_pause',
@@ -31,16 +36,130 @@ known_msg_types = (
     'task_stop',
     'task_duplicate',
     'task_output_request',
+    'task_start_batch',
+    'task_move_batch',
+    'task_pause_batch',
+    'task_resume_batch',
+    'task_stop_batch',
     'core_set_frequency'
 )
 
+# Message types that control tasks or cores. These are executed by the
+# command pool and answered with a command_result message.
+command_msg_types = (
+    'task_start',
+    'task_move',
+    'task_pause',
+    'task_resume',
+    'task_stop',
+    'task_duplicate',
+    'task_start_batch',
+    'task_move_batch',
+    'task_pause_batch',
+    'task_resume_batch',
+    'task_stop_batch',
+    'core_set_frequency'
+)
+
+# Status modes a client can choose from in its client_init message
+status_modes = (
+    'full',
+    'delta'
+)
+
+class CommandPool:
+    """
+    Pool of worker threads that execute commands off the network thread.
+    Every command has keys, e.g. the ids of the tasks it controls. Commands
+    that share a key are executed in their order of arrival.
+
+    Every key belongs to one worker. A command with keys of several workers
+    is executed by the first of them once the others have reached it in
+    their queues, and those are held until it is done. All commands are
+    queued in one global order, so such commands cannot wait on each other.
+    """
+
+    def __init__(self, workers=4):
+        self.logger = logging.getLogger('CommandPool')
+        self.queues = [Queue() for _ in range(max(1, workers))]
+        self.lock = Lock()
+        self._next = 0
+
+        self.threads = []
+        for queue in self.queues:
+            thread = Thread(target=self.work, args=(queue, ))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, keys, function, *args):
+        """
+        Execute function(*args) after all earlier commands that share any
+        of the given keys and before all later ones. Commands without keys
+        are spread over all workers.
+        """
+        with self.lock:
+            queues = []
+            for key in keys:
+                queue = self.queues[hash(key) % len(self.queues)]
+                if queue not in queues:
+                    queues.append(queue)
+
+            if not queues:
+                self._next = (self._next + 1) % len(self.queues)
+                queues.append(self.queues[self._next])
+
+            if len(queues) == 1:
+                queues[0].put((function, args))
+                return
+
+            arrived = [Event() for _ in queues[1:]]
+            done = Event()
+            for queue, event in zip(queues[1:], arrived):
+                queue.put((self.hold, (event, done)))
+            queues[0].put((self.gather, (arrived, done, function, args)))
+
+    def hold(self, arrived, done):
+        """Hold a worker until the command that it has reached is done."""
+        arrived.set()
+        done.wait()
+
+    def gather(self, arrived, done, function, args):
+        """Execute function(*args) once all other workers are held."""
+        try:
+            for event in arrived:
+                event.wait()
+            function(*args)
+        finally:
+            done.set()
+
+    def work(self, queue):
+        """Keep executing the commands in 'queue'."""
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+
+            function, args = item
+            try:
+                function(*args)
+            except Exception, e:
+                self.logger.warning('Exception in command: %s' % e)
+
+    def stop(self):
+        """Stop all workers once their queued commands are done."""
+        for queue in self.queues:
+            queue.put(None)
+
+
 class MessageProcessor:
     """Processor for all messages that arrive in ManyMan's back-end."""
 
-    def __init__(self, server, max_lines):
+    def __init__(self, server, max_lines, workers=4):
         self.logger = logging.getLogger('MessageProcessor')
         self.server = server
         self.max_lines = max_lines
+        self.commands = CommandPool(workers)
         self.logger.debug("Processor inited")
 
     def process(self, client, msg):
@@ -55,6 +174,18 @@ class MessageProcessor:
             elif not client.initialized and data['type'] != 'client_init':
                 raise Exception('Did not recieve initialization message ' \
                                 'first.')
+            elif data['type'] in command_msg_types:
+                # Commands can block on process control, so they are
+                # executed by the command pool. Commands on the same task,
+                # alone or in a batch, keep their order.
+                self.commands.submit(
+                    self.command_keys(data['type'], data['content']),
+                    self.execute,
+                    client,
+                    data['type'],
+                    data['content'],
+                    time()
+                )
             else:
                 getattr(self, "process_" + data['type'])(
                     client,
@@ -66,58 +197,159 @@ class MessageProcessor:
             self.logger.error(traceback.format_exc())
             self.send_invalid(client, e)
 
+    def command_keys(self, msg_type, msg):
+        """
+        Return the keys of a command for the command pool: the ids of the
+        tasks it controls, or its type for the other commands.
+        """
+        if not msg_type.startswith('task_'):
+            return [msg_type]
+        elif 'ids' in msg:
+            return list(msg['ids'])
+        elif 'moves' in msg:
+            return [move['id'] for move in msg['moves']]
+        elif 'id' in msg:
+            return [msg['id']]
+
+        # New tasks can not conflict with any other command
+        return []
+
+    def execute(self, client, msg_type, msg, received):
+        """
+        Execute a command. The result is sent in a command_result message
+        when the command has a request_id, otherwise only a failure is
+        reported. Batch commands return the result of every task, the batch
+        fails when any of them has failed. A started task is returned as
+        the result with its new ID.
+        """
+        error = None
+        results = None
+        try:
+            results = getattr(self, "process_" + msg_type)(client, msg)
+        except Exception, e:
+            import traceback
+            self.logger.warning('Command %s failed: %s' % (msg_type, e))
+            self.logger.debug(traceback.format_exc())
+            error = e
+
+        if results is not None:
+            failed = len([r for r in results if not r['success']])
+            if failed:
+                error = Exception(
+                    '%d of %d tasks failed.' % (failed, len(results))
+                )
+
+        if 'request_id' in msg:
+            self.send_command_result(
+                client,
+                msg['request_id'],
+                msg_type,
+                error,
+                time() - received,
+                results
+            )
+        elif error is not None:
+            self.send_invalid(client, error)
+
     def process_client_init(self, client, msg):
         """Process the client_init message."""
         if client.initialized:
             raise Exception('Already initialized')
         
         client.name = msg['name']
-        client.initialized = True
+        if msg.get('status') in status_modes:
+            client.status_mode = msg['status']
+
+        # Use the first offered encoding, all later messages are sent in it
+        for encoding in msg.get('encodings', []):
+            if encoding in encodings:
+                client.encoding = encoding
+                break
+
         self.logger.debug('Set client name to %s.' % msg['name'])
         self.send_server_init(client)
+        if self.server.balancer:
+            self.send_migration_log(client, list(self.server.balancer.log))
+        client.initialized = True
+
+    def process_status_resync(self, client, msg):
+        """Process the status_resync message."""
+        client.resync = True
+        self.logger.debug('%s requested a status resync.' % client.name)
+
+    def start_core(self, core=None):
+        """
+        Return the core to start a task on, which is the least loaded core
+        unless 'core' is given: smart-start. The task is accounted for in
+        the chip's placement index.
+        """
+        chip = self.server.chip
+        if core is not None and not 0 <= core < len(chip.cores):
+            raise Exception('Invalid core %d.' % core)
+
+        placement = chip.placement
+        if core is None:
+            return placement.place()
+
+        placement.add(core)
+        return core
+
+    def move_core(self, task, core=None):
+        """
+        Return the core to move the given task to, which is the least
+        loaded other core unless 'core' is given: smart-move. The move is
+        accounted for in the chip's placement index. A negative core parks
+        the task.
+        """
+        chip = self.server.chip
+        if core is not None and core >= len(chip.cores):
+            raise Exception('Invalid core %d.' % core)
+
+        placement = chip.placement
+        if core is None:
+            core = placement.place(exclude=task.core)
+            if core is None:
+                raise Exception('No core to move task %s to.' % task.tid)
+        else:
+            placement.add(core)
+
+        placement.add(task.core, -1)
+        return core
 
     def process_task_start(self, client, msg):
-        """Process the task_start message."""
+        """
+        Process the task_start message. Returns the result with the ID of
+        the new task.
+        """
         if 'core' in msg:
-            core = int(msg['core'])
+            core = self.start_core(int(msg['core']))
         else:
-            # Find the best core to start the task on: smart-start
-            best = self.server.chip.cores[0]
-            for c in self.server.chip.cores:
-                if (c.cpu_usage + c.mem_usage + len(c.tasks)) < \
-                    (best.cpu_usage + best.mem_usage + len(best.tasks)):
-                    best = c
-            core = best.id
+            core = self.start_core()
         task_id = self.server.chip.add_task(msg['name'], msg['program'], core)
         self.logger.debug('%s started task %s.' % (client.name, task_id))
+        return [{'id': task_id, 'success': True}]
 
     def process_task_move(self, client, msg):
         """Process the task_move message."""
+        task = self.server.chip.tasks[msg['id']]
         if 'to_core' in msg:
-            core = int(msg['to_core'])
+            core = self.move_core(task, int(msg['to_core']))
         else:
-            # Find the best core to move the task to: smart-move
-            task = self.server.chip.tasks[msg['id']]
-            best = self.server.chip.cores[
-                (task.core + 1) % len(self.server.chip.cores)
-            ]
-            for c in self.server.chip.cores:
-                if (c.cpu_usage + c.mem_usage + len(c.tasks)) < \
-                    (best.cpu_usage + best.mem_usage + len(best.tasks)) and \
-                    c.id != task.core:
-                    best = c
-            core = best.id
-        self.server.chip.move_task(msg['id'], core)
+            core = self.move_core(task)
+        if not self.server.chip.move_task(msg['id'], core):
+            raise Exception('Could not move task %s.' % msg['id'])
         self.logger.debug('%s moved task %s.' % (client.name, msg['id']))
 
     def process_task_pause(self, client, msg):
         """Process the task_pause message."""
-        self.server.chip.pause_task(msg['id'])
+        if not self.server.chip.pause_task(msg['id']):
+            raise Exception('Could not pause task %s.' % msg['id'])
         self.logger.debug('%s paused task %s.' % (client.name, msg['id']))
 
     def process_task_resume(self, client, msg):
         """Process the task_resume message."""
-        self.server.chip.resume_task(msg['id'])
+        if not self.server.chip.resume_task(msg['id']):
+            raise Exception('Could not resume task %s.' % msg['id'])
         self.logger.debug('%s resumed task %s.' % (client.name, msg['id']))
 
     def process_task_stop(self, client, msg):
@@ -131,6 +363,97 @@ class MessageProcessor:
         self.server.chip.duplicate_task(msg['id'])
         self.logger.debug('%s duplicated task %s.' % (client.name, msg['id']))
 
+    def process_task_start_batch(self, client, msg):
+        """
+        Process the task_start_batch message. All tasks are placed before
+        any of them is started. Returns the result of every task.
+        """
+        chip = self.server.chip
+        specs = []
+        for spec in msg['tasks']:
+            if 'core' in spec:
+                core = self.start_core(int(spec['core']))
+            else:
+                core = self.start_core()
+            specs.append((spec['name'], spec['program'], core))
+
+        task_ids = chip.add_tasks(specs)
+        self.logger.debug(
+            '%s started %d tasks.' % (client.name, len(task_ids))
+        )
+        return [{'id': task_id, 'success': True} for task_id in task_ids]
+
+    def process_task_move_batch(self, client, msg):
+        """
+        Process the task_move_batch message. The destinations of all tasks
+        are chosen first and the moves are then applied together. Returns
+        the result of every task.
+        """
+        chip = self.server.chip
+        moves = []
+        for move in msg['moves']:
+            task = chip.tasks.get(move['id'])
+            if task is None:
+                continue
+            if 'to_core' in move:
+                core = self.move_core(task, int(move['to_core']))
+            else:
+                core = self.move_core(task)
+            moves.append((move['id'], core))
+
+        moved = chip.move_tasks(moves)
+        self.logger.debug('%s moved %d tasks.' % (client.name, len(moved)))
+        return self.batch_results(
+            [move['id'] for move in msg['moves']],
+            moved,
+            'move'
+        )
+
+    def process_task_pause_batch(self, client, msg):
+        """Process the task_pause_batch message."""
+        tids = [tid for tid in msg['ids'] if tid in self.server.chip.tasks]
+        paused = self.server.chip.pause_tasks(tids)
+        self.logger.debug('%s paused %d tasks.' % (client.name, len(paused)))
+        return self.batch_results(msg['ids'], paused, 'pause')
+
+    def process_task_resume_batch(self, client, msg):
+        """Process the task_resume_batch message."""
+        tids = [tid for tid in msg['ids'] if tid in self.server.chip.tasks]
+        resumed = self.server.chip.resume_tasks(tids)
+        self.logger.debug(
+            '%s resumed %d tasks.' % (client.name, len(resumed))
+        )
+        return self.batch_results(msg['ids'], resumed, 'resume')
+
+    def process_task_stop_batch(self, client, msg):
+        """
+        Process the task_stop_batch message. The output of every task is
+        sent once all tasks have been killed.
+        """
+        tids = [tid for tid in msg['ids'] if tid in self.server.chip.tasks]
+        outputs = self.server.chip.kill_tasks(tids)
+        for tid in tids:
+            self.send_task_output(client, tid, outputs.get(tid) or "No output")
+        self.logger.debug('%s killed %d tasks.' % (client.name, len(outputs)))
+        return self.batch_results(msg['ids'], outputs, 'kill')
+
+    def batch_results(self, tids, done, action):
+        """
+        Return the result of every task in 'tids' of a batch command, given
+        the IDs of the tasks on which the command succeeded in 'done'.
+        """
+        results = []
+        for tid in tids:
+            if tid in done:
+                results.append({'id': tid, 'success': True})
+            else:
+                results.append({
+                    'id': tid,
+                    'success': False,
+                    'error': 'Could not %s task %s.' % (action, tid)
+                })
+        return results
+
     def process_task_output_request(self, client, msg):
         """Process the task_output_request message."""
         output = self.server.chip.get_task_output(msg['id'])
@@ -161,12 +484,49 @@ class MessageProcessor:
                     'message': '%s' % error
                 }
             }
-            client.request.sendall("%s\n" % json.dumps(msg))
+            client.send_msg(msg)
         except Exception, e:
             self.logger.debug('Exception: %s' % e)
         except:
             self.logger.debug('No exception, but still exception...')
 
+    def send_command_result(self, client, request_id, command, error,
+            latency, results=None):
+        """
+        Send the command_result message of a finished command, including
+        the result of every task of a batch command.
+        """
+        try:
+            msg = {
+                'type': 'command_result',
+                'content': {
+                    'request_id': request_id,
+                    'command': command,
+                    'success': error is None,
+                    'latency': latency
+                }
+            }
+            if error is not None:
+                msg['content']['error'] = '%s' % error
+            if results is not None:
+                msg['content']['results'] = results
+            client.send_msg(msg)
+        except Exception, e:
+            self.logger.debug('Exception: %s' % e)
+
+    def send_migration_log(self, client, migrations):
+        """Send the migration_log message with the given moved tasks."""
+        try:
+            msg = {
+                'type': 'migration_log',
+                'content': {
+                    'migrations': migrations
+                }
+            }
+            client.send_msg(msg)
+        except Exception, e:
+            self.logger.debug('Exception: %s' % e)
+
     def send_server_init(self, client):
         """Send the server_init message."""
         try:
@@ -174,11 +534,15 @@ class MessageProcessor:
                 'type': 'server_init',
                 'content': {
                     'name': self.server.chip.name,
+                    'status': client.status_mode,
+                    'encoding': client.encoding,
                     'cores': len(self.server.chip.cores),
                     'orientation': self.server.chip.orientation
                 }
             }
-            client.request.sendall("%s\n" % json.dumps(msg))
+
+            # The server_init message is always sent as JSON
+            client.send("%s\n" % json.dumps(msg))
         except Exception, e:
             self.logger.debug('Exception: %s' % e)
         except:
@@ -198,7 +562,7 @@ class MessageProcessor:
                         ]
                     }
                 }
-                client.request.sendall("%s\n" % json.dumps(msg))
+                client.send_msg(msg)
                 offset += 100
         except Exception, e:
             self.logger.debug('Exception: %s' % e)
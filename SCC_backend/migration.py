@@ -0,0 +1,380 @@
+"""
+ManyMan - A Many-core Visualization and Management System
+Copyright (C) 2012
+University of Amsterdam - Computer Systems Architecture
+Jimi van der Woning and Roy Bakker
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from Queue import Queue, Empty
+from task import Status as TaskStatus, CONTEXTS_DIR
+from threading import Thread, Lock
+from time import sleep, time
+import logging
+import os
+import subprocess as sp
+
+# Directory on the cores' RAM disks in which the contexts are staged
+STAGING_DIR = "/tmp/contexts"
+
+
+def ssh_command(core, command):
+    """Return the arguments to execute 'command' on the given core."""
+    host = "root@rck%02d" % core
+    return ['ssh', '-S', os.path.expanduser('~/.ssh/%s' % host), host,
+        command]
+
+
+class Stage:
+    """Migration stages."""
+
+    PENDING = 0
+    CHECKPOINTING = 1
+    TRANSFERRING = 2
+    RESTARTING = 3
+    DONE = 4
+    FAILED = 5
+
+    names = (
+        "Pending",
+        "Checkpointing",
+        "Transferring",
+        "Restarting",
+        "Done",
+        "Failed"
+    )
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return self.names[self.value]
+
+
+class Migration:
+    """Progress and timings of the migration of a single task."""
+
+    def __init__(self, task, to_core):
+        self.task = task
+        self.from_core = task.core
+        self.to_core = to_core
+        self.stage = Stage.PENDING
+        self.error = None
+
+        # Duration of every completed stage in seconds, keyed by stage
+        self.timings = dict()
+        self._started = None
+
+    def enter(self, stage):
+        """Start the given stage, completing the current one."""
+        now = time()
+        if self._started is not None:
+            self.timings[self.stage] = now - self._started
+        self._started = now
+        self.stage = stage
+
+    def fail(self, error):
+        """Abort the migration with the given error."""
+        self.error = error
+        self.enter(Stage.FAILED)
+
+    def as_dict(self):
+        """Represent the migration as a dictionary."""
+        return {
+            "ID": self.task.tid,
+            "From": self.from_core,
+            "To": self.to_core,
+            "Stage": "%s" % Stage(self.stage),
+            "Timings": dict(
+                ("%s" % Stage(s), t) for s, t in self.timings.iteritems()
+            )
+        }
+
+
+class MigrationEngine:
+    """
+    Migrates tasks between cores with BLCR. Each task is checkpointed to
+    the RAM disk of its core, streamed to the RAM disk of its destination
+    and restarted there. Multiple tasks are migrated in parallel, so the
+    checkpoints of one task overlap with the transfers of another.
+    """
+
+    def __init__(self, chip, **kwargs):
+        self.logger = logging.getLogger('MigrationEngine')
+
+        self.chip = chip
+        self.store = kwargs.get('store', None)
+        self.workers = kwargs.get('workers', 8)
+        self.staging_dir = kwargs.get('staging_dir', STAGING_DIR)
+        self.compress = kwargs.get('compress', True)
+        self.restart_timeout = kwargs.get('restart_timeout', 60)
+
+        # Active migrations, keyed by task id
+        self.migrations = dict()
+        self.lock = Lock()
+        self._staged = set()
+
+    def migrate(self, moves):
+        """
+        Migrate the tasks in 'moves', a list of (task, to_core) tuples, and
+        wait until all have completed. Returns the list of migrations.
+        """
+        queue = Queue()
+        migrations = []
+        with self.lock:
+            for t, to_core in moves:
+                if t.tid in self.migrations:
+                    self.logger.warning("Task %s is already migrating" % t.tid)
+                    continue
+                m = Migration(t, to_core)
+                self.migrations[t.tid] = m
+                migrations.append(m)
+                queue.put(m)
+
+        threads = []
+        for _ in xrange(min(self.workers, len(migrations))):
+            thread = Thread(target=self._work, args=(queue, ))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+
+        with self.lock:
+            for m in migrations:
+                self.migrations.pop(m.task.tid, None)
+
+        return migrations
+
+    def park(self, t):
+        """
+        Checkpoint the given task off its core, into the checkpoint store.
+        Returns whether the task was checkpointed.
+        """
+        core = t.core
+        if t.dummy_mode or self.store is None:
+            return self.chip.cores[core].checkpoint_task(t)
+
+        self._stage_dir(core)
+        if not t.checkpoint(self.staging_dir):
+            return False
+        self.chip.cores[core].tasks.pop(t.tid, None)
+        self._keep(t, core)
+        return True
+
+    def _keep(self, t, core):
+        """
+        Move the context of the checkpointed task 't' off the RAM disk of
+        the given core, into the checkpoint store or else into the shared
+        contexts directory.
+        """
+        if self.store is not None:
+            try:
+                t.context = self.store.put(core, t._cfile, t.tid)
+                return
+            except Exception as e:
+                self.logger.warning(
+                    "%s, keeping it in %s" % (e, CONTEXTS_DIR)
+                )
+
+        path = os.path.join(CONTEXTS_DIR, os.path.basename(t._cfile))
+        rc, out = self.chip.agents[core].call(
+            'mv %s %s' % (t._cfile, path), background=True
+        )
+        if rc == 0:
+            t._cfile = path
+        else:
+            self.logger.warning("Could not move %s off core %02d: %s" %
+                (t._cfile, core, "".join(out)))
+
+    def progress(self):
+        """Return the progress of all active migrations."""
+        with self.lock:
+            return [m.as_dict() for m in self.migrations.values()]
+
+    def _work(self, queue):
+        """Migrate tasks from the queue until it is empty."""
+        while 1:
+            try:
+                m = queue.get_nowait()
+            except Empty:
+                return
+
+            try:
+                self._migrate(m)
+            except Exception as e:
+                m.fail("%s" % e)
+
+            if m.stage == Stage.FAILED:
+                self.logger.warning(
+                    "Migration of %s failed: %s" % (m.task.tid, m.error)
+                )
+            else:
+                self.logger.info(
+                    "Migrated %s from core %02d to core %02d: %s" % (
+                        m.task.tid, m.from_core, m.to_core,
+                        ", ".join("%s %.2fs" % (Stage(s), m.timings[s])
+                            for s in sorted(m.timings))
+                    )
+                )
+
+    def _stage_dir(self, core):
+        """Make sure the staging directory exists on the given core."""
+        if core in self._staged:
+            return
+        rc, out = self.chip.agents[core].call('mkdir -p %s' % self.staging_dir)
+        if rc != 0:
+            raise Exception("Could not create %s on core %02d: %s" %
+                (self.staging_dir, core, "".join(out)))
+        self._staged.add(core)
+
+    def _transfer(self, src, dst, path):
+        """Stream the file 'path' from core 'src' to core 'dst'."""
+        if self.compress:
+            send, receive = 'gzip -1 -c %s' % path, 'gunzip -c > %s' % path
+        else:
+            send, receive = 'cat %s' % path, 'cat > %s' % path
+
+        sender = sp.Popen(
+            ssh_command(src, send),
+            stdout=sp.PIPE,
+            stderr=sp.PIPE,
+            close_fds=True
+        )
+        receiver = sp.Popen(
+            ssh_command(dst, receive),
+            stdin=sender.stdout,
+            stdout=sp.PIPE,
+            stderr=sp.STDOUT,
+            close_fds=True
+        )
+        sender.stdout.close()
+
+        out = receiver.communicate()[0]
+        err = sender.communicate()[1]
+        if sender.returncode != 0 or receiver.returncode != 0:
+            raise Exception("Transfer failed: %s%s" % (err, out))
+
+    def _wait_restart(self, t):
+        """Wait until the given task has restarted or the timeout passed."""
+        deadline = time() + self.restart_timeout
+        while t.status == TaskStatus.RESTARTING and time() < deadline:
+            sleep(.05)
+
+    def _migrate(self, m):
+        """Execute all stages of the given migration."""
+        t = m.task
+        dst = self.chip.cores[m.to_core]
+        restored = False
+
+        if t.status != TaskStatus.CHECKPOINTED:
+            src = self.chip.cores[m.from_core]
+            if not t.dummy_mode:
+                self._stage_dir(m.from_core)
+
+            m.enter(Stage.CHECKPOINTING)
+            if not t.checkpoint(self.staging_dir):
+                m.fail("Could not checkpoint the task")
+                return
+            src.tasks.pop(t.tid, None)
+            staged = True
+        elif t.context and not t.dummy_mode:
+            # Parked in the checkpoint store, restore it on the destination
+            self._stage_dir(m.to_core)
+            m.enter(Stage.TRANSFERRING)
+            t._cfile = "%s/context.%s.cxt" % (self.staging_dir, t.tid)
+            self.store.get(m.to_core, t.context, t._cfile)
+            staged = restored = True
+        else:
+            # Parked in the shared contexts directory, restart it from there
+            staged = False
+
+        # Core on whose RAM disk the only copy of the context is
+        where = m.from_core if staged and not restored else None
+        try:
+            if where is not None and not t.dummy_mode and \
+                    m.to_core != m.from_core:
+                self._stage_dir(m.to_core)
+                m.enter(Stage.TRANSFERRING)
+                self._transfer(m.from_core, m.to_core, t._cfile)
+                where = m.to_core
+                self.chip.agents[m.from_core].submit('rm -f %s' % t._cfile)
+
+            m.enter(Stage.RESTARTING)
+            if not t.restart(m.to_core):
+                raise Exception("Could not restart the task")
+        except Exception as e:
+            m.fail("%s" % e)
+            self._recover(m, where)
+            return
+
+        self._wait_restart(t)
+        dst.add_task(t)
+
+        if t.status != TaskStatus.RUNNING:
+            m.fail("The task did not restart")
+            return
+
+        if restored:
+            self.store.release(t.context)
+            t.context = None
+
+        if staged and not t.dummy_mode:
+            # The task is reported running before cr_restart has read the
+            # context, so remove it in the background once it has
+            self.chip.agents[m.to_core].submit(
+                '(sleep %d; rm -f %s) >/dev/null 2>&1 &' %
+                (self.restart_timeout, t._cfile)
+            )
+
+        m.enter(Stage.DONE)
+
+    def _recover(self, m, where):
+        """
+        Put the task of a migration that failed after its checkpoint back in
+        a known place. 'where' is the core whose RAM disk holds the context,
+        or None when it is kept off the cores. A task whose context is
+        still on its source core is restarted there, any other task is
+        parked.
+        """
+        t = m.task
+        t.status = TaskStatus.CHECKPOINTED
+        t.core = m.from_core
+
+        if where == m.from_core:
+            try:
+                if t.restart(where):
+                    self._wait_restart(t)
+                    self.chip.cores[where].add_task(t)
+                    self.logger.info(
+                        "Restarted %s on core %02d" % (t.tid, where)
+                    )
+                    return
+            except Exception as e:
+                self.logger.warning(
+                    "Could not restart %s on core %02d: %s" % (t.tid, where, e)
+                )
+            t.status = TaskStatus.CHECKPOINTED
+
+        if not t.dummy_mode:
+            if where is not None:
+                self._keep(t, where)
+            elif t.context:
+                # The store still holds the context, drop the restored copy
+                self.chip.agents[m.to_core].submit('rm -f %s' % t._cfile)
+        t.core = -1
+        self.logger.info("Parked %s" % t.tid)
+
@@ -0,0 +1,174 @@
+"""
+ManyMan - A Many-core Visualization and Management System
+Copyright (C) 2012
+University of Amsterdam - Computer Systems Architecture
+Jimi van der Woning and Roy Bakker
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Tests of the recovery of failed migrations. The chip, its agents and the
+# task are stand-ins, so no SCC is needed.
+#
+# Usage: python migration_test.py
+
+from migration import MigrationEngine, Stage, STAGING_DIR
+from task import Status as TaskStatus, CONTEXTS_DIR
+import logging
+import unittest
+
+
+class FakeAgent:
+    """Agent that records the commands and lets all of them succeed."""
+
+    def __init__(self):
+        self.commands = []
+
+    def call(self, command, background=False):
+        self.commands.append(command)
+        return 0, []
+
+    def submit(self, command, background=False):
+        self.commands.append(command)
+
+
+class FakeCore:
+    def __init__(self, core):
+        self.id = core
+        self.tasks = dict()
+
+    def add_task(self, t):
+        self.tasks[t.tid] = t
+
+
+class FakeChip:
+    def __init__(self, cores):
+        self.cores = [FakeCore(i) for i in range(cores)]
+        self.agents = [FakeAgent() for _ in range(cores)]
+
+
+class FakeStore:
+    """Checkpoint store that keeps the names of the stored contexts."""
+
+    def __init__(self):
+        self.contexts = []
+
+    def put(self, core, cfile, tid):
+        self.contexts.append((core, cfile))
+        return "ctx-%s" % tid
+
+
+class FakeTask:
+    """Task whose restarts succeed on the cores in 'restartable'."""
+
+    def __init__(self, tid, core, restartable):
+        self.tid = tid
+        self.core = core
+        self.restartable = restartable
+        self.dummy_mode = False
+        self.context = None
+        self._cfile = ""
+        self.status = TaskStatus.RUNNING
+
+    def checkpoint(self, directory):
+        self._cfile = "%s/context.%d.%s.cxt" % (directory, self.core, self.tid)
+        self.status = TaskStatus.CHECKPOINTED
+        return True
+
+    def restart(self, core):
+        if self.status != TaskStatus.CHECKPOINTED or \
+                core not in self.restartable:
+            return False
+        self.core = core
+        self.status = TaskStatus.RUNNING
+        return True
+
+
+def failed_transfer(src, dst, path):
+    raise Exception("Transfer failed")
+
+
+class MigrationRecoveryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chip = FakeChip(4)
+        self.engine = MigrationEngine(self.chip, restart_timeout=1)
+
+    def start(self, core, restartable):
+        t = FakeTask('T0001', core, restartable)
+        self.chip.cores[core].add_task(t)
+        return t
+
+    def test_success(self):
+        self.engine._transfer = lambda src, dst, path: None
+        t = self.start(1, [2])
+        m, = self.engine.migrate([(t, 2)])
+
+        self.assertEqual(m.stage, Stage.DONE)
+        self.assertEqual(t.core, 2)
+        self.assertIn(t.tid, self.chip.cores[2].tasks)
+        self.assertNotIn(t.tid, self.chip.cores[1].tasks)
+
+    def test_failed_transfer_restarts_on_source(self):
+        self.engine._transfer = failed_transfer
+        t = self.start(1, [1, 2])
+        m, = self.engine.migrate([(t, 2)])
+
+        self.assertEqual(m.stage, Stage.FAILED)
+        self.assertEqual(t.status, TaskStatus.RUNNING)
+        self.assertEqual(t.core, 1)
+        self.assertIn(t.tid, self.chip.cores[1].tasks)
+        self.assertNotIn(t.tid, self.chip.cores[2].tasks)
+
+    def test_failed_transfer_parks_in_contexts_dir(self):
+        self.engine._transfer = failed_transfer
+        t = self.start(1, [])
+        m, = self.engine.migrate([(t, 2)])
+
+        self.assertEqual(m.stage, Stage.FAILED)
+        self.assertEqual(t.status, TaskStatus.CHECKPOINTED)
+        self.assertEqual(t.core, -1)
+        self.assertTrue(t._cfile.startswith(CONTEXTS_DIR))
+        self.assertTrue(any(c.startswith('mv %s/' % STAGING_DIR)
+            for c in self.chip.agents[1].commands))
+        for core in self.chip.cores:
+            self.assertNotIn(t.tid, core.tasks)
+
+    def test_failed_restart_parks_from_destination(self):
+        self.engine._transfer = lambda src, dst, path: None
+        self.engine.store = FakeStore()
+        t = self.start(1, [])
+        m, = self.engine.migrate([(t, 2)])
+
+        self.assertEqual(m.stage, Stage.FAILED)
+        self.assertEqual(t.core, -1)
+        self.assertEqual(t.context, 'ctx-T0001')
+        # The context was transferred, so it is stored from the destination
+        self.assertEqual(self.engine.store.contexts, [(2, t._cfile)])
+
+    def test_parked_task_can_move_again(self):
+        self.engine._transfer = failed_transfer
+        t = self.start(1, [3])
+        self.engine.migrate([(t, 2)])
+        self.assertEqual(t.core, -1)
+
+        m, = self.engine.migrate([(t, 3)])
+        self.assertEqual(m.stage, Stage.DONE)
+        self.assertEqual(t.core, 3)
+        self.assertIn(t.tid, self.chip.cores[3].tasks)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.CRITICAL)
+    unittest.main()
@@ -0,0 +1,151 @@
+"""
+ManyMan - A Many-core Visualization and Management System
+Copyright (C) 2012
+University of Amsterdam - Computer Systems Architecture
+Jimi van der Woning and Roy Bakker
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from heapq import heapify, heappop, heappush
+from task import Status as TaskStatus
+from threading import Lock
+
+# Statuses of tasks that no longer occupy their core
+ENDED = (TaskStatus.KILLED, TaskStatus.FINISHED, TaskStatus.FAILED)
+
+
+def core_loads(cores, tasks):
+    """
+    The load of every core as used for smart placement, keyed by core id.
+    Every task that has not ended counts on the core it is currently on.
+    """
+    counts = dict((c.id, 0) for c in cores)
+    for t in tasks:
+        if t.core in counts and t.status not in ENDED:
+            counts[t.core] += 1
+
+    return dict(
+        (c.id, c.cpu_usage + c.mem_usage + counts[c.id]) for c in cores
+    )
+
+
+class PlacementIndex:
+    """
+    Index of the load of every core for smart-start and smart-move. The
+    loads are snapshotted once per sampling tick into a min-heap over all
+    cores and one min-heap per cluster. Every placement adds to the load of
+    its core in the snapshot, so a burst of placements between two ticks is
+    spread over the cores without rescanning them.
+
+    Heap entries are (load, core) tuples. An entry whose load differs from
+    the core's current load is stale and is dropped once it reaches the top.
+    """
+
+    def __init__(self, clusters):
+        self.clusters = clusters
+
+        # Cluster of every core, keyed by core id
+        self.cluster_of = dict()
+        for i, cluster in enumerate(clusters):
+            for core in cluster:
+                self.cluster_of[core] = i
+
+        self.loads = dict()
+        self.heap = []
+        self.cluster_heaps = [[] for _ in clusters]
+        self.lock = Lock()
+
+    def update(self, loads):
+        """Replace the snapshot with 'loads', the load keyed by core id."""
+        heap = [(load, core) for core, load in loads.iteritems()]
+        cluster_heaps = [[] for _ in self.clusters]
+        for entry in heap:
+            if entry[1] in self.cluster_of:
+                cluster_heaps[self.cluster_of[entry[1]]].append(entry)
+
+        heapify(heap)
+        for h in cluster_heaps:
+            heapify(h)
+
+        with self.lock:
+            self.loads = dict(loads)
+            self.heap = heap
+            self.cluster_heaps = cluster_heaps
+
+    def _top(self, heap, exclude):
+        """
+        Return the least loaded core in 'heap' that is not 'exclude', or
+        None when there is none. Must be called with the lock held.
+        """
+        skipped = None
+        core = None
+        while heap:
+            load, c = heap[0]
+            if self.loads.get(c) != load:
+                heappop(heap)
+            elif c == exclude:
+                skipped = heappop(heap)
+            else:
+                core = c
+                break
+
+        if skipped is not None:
+            heappush(heap, skipped)
+        return core
+
+    def _add(self, core, load):
+        """
+        Add 'load' to the load of 'core'. Must be called with the lock
+        held.
+        """
+        if core not in self.loads:
+            # E.g. a parked task, which is on no core
+            return
+
+        self.loads[core] += load
+        entry = (self.loads[core], core)
+        heappush(self.heap, entry)
+        if core in self.cluster_of:
+            heappush(self.cluster_heaps[self.cluster_of[core]], entry)
+
+    def least_loaded(self, cluster=None, exclude=None):
+        """
+        Return the least loaded core, in the cluster with index 'cluster'
+        when given and never the core 'exclude'. Returns None when there
+        is no such core.
+        """
+        with self.lock:
+            if cluster is None:
+                return self._top(self.heap, exclude)
+            return self._top(self.cluster_heaps[cluster], exclude)
+
+    def place(self, cluster=None, exclude=None, load=1):
+        """
+        Choose the least loaded core like least_loaded() and add 'load' to
+        it in the same step, so concurrent placements are spread.
+        """
+        with self.lock:
+            if cluster is None:
+                core = self._top(self.heap, exclude)
+            else:
+                core = self._top(self.cluster_heaps[cluster], exclude)
+            if core is not None:
+                self._add(core, load)
+            return core
+
+    def add(self, core, load=1):
+        """Add 'load' to the load of 'core', e.g. for a placed task."""
+        with self.lock:
+            self._add(core, load)
@@ -20,8 +20,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from random import random, randint
 from string import split
-from threading import Thread
-from time import sleep
+from threading import Event
 import logging
 import subprocess as sp
 
@@ -68,7 +67,7 @@ class Status:
         return self.names[self.value]
 
 
-class Task(Thread):
+class Task(object):
     """Task object, contains all information about a task."""
 
     def __init__(self, tid, core, name, program, **kwargs):
@@ -79,10 +78,16 @@ class Task(Thread):
         self.pname = name
         self.program = program
         self.dummy_mode = kwargs.get('dummy_mode', False)
+        self.reactor = kwargs.get('reactor', None)
+        self.agents = kwargs.get('agents', None)
+        self.p = None
+        self.ended = Event()
 
         self._pid = -1
         self.ppid = -1
         self._cfile = ""
+        # Name of the context in the checkpoint store, while parked
+        self.context = None
         self._error_count = 0
 
         self._status = kwargs.get('status', Status.NEW)
@@ -90,12 +95,11 @@ class Task(Thread):
         self.mem_usage = 0.0
         self.output = []
 
-        Thread.__init__(self)
-
         if self._status == Status.NEW:
             self.create()
 
-        self.start()
+        if self.dummy_mode:
+            self.status = Status.RUNNING
 
     def __repr__(self):
         return "Task %s: %.1f%% CPU, %.1f%% MEM" % (
@@ -161,61 +165,88 @@ class Task(Thread):
             stdout=sp.PIPE,
             stderr=sp.STDOUT
         )
+        self.reactor.register(self, self.p.stdout)
+
+    def process_line(self, line):
+        """
+        Process a line of output of the task. Returns False when no further
+        output should be read.
+        """
+        if self.status in (Status.CREATING, Status.RESTARTING):
+            # Setup the task, i.e. retrieve its parent's process id (ppid)
+            try:
+                parts = line.split()
+                if parts and parts[0] == "ERROR:":
+                    raise ValueError(" ".join(parts[1:]))
+                if not parts or parts[0] != "PPID:":
+                    if self._error_count > 100:
+                        raise ValueError("Could not determine ppid.")
+                    self._error_count += 1
+                    return True
+
+                self.ppid = int(parts[1])
+                self.logger.debug("Set ppid to %d" % self.ppid)
+                self.status = Status.RUNNING
+            except ValueError as e:
+                self.logger.critical("Could not start the task:\n %s" % e)
+                self.status = Status.FAILED
+                return False
+        else:
+            self.logger.debug("%s: %s" % (self.tid, line[:-1]))
+            self.output += [line]
 
-    def run(self):
-        """Read and process the output of the task."""
-        if self.dummy_mode:
-            self.status = Status.RUNNING
-            return
+        return True
 
-        while 1:
-            if self.status in (Status.CHECKPOINTED, Status.STOPPED):
-                # Skip when checkpointed or stopped
-                sleep(.1)
-                continue
+    def process_eof(self, pipe):
+        """The output pipe of the task has been closed."""
+        if self.p is None or pipe is not self.p.stdout:
+            # Output of an earlier process of this task
+            return
 
-            line = self.p.stdout.readline()
-
-            if not line:
-                if self.status in (Status.CHECKPOINTED, Status.STOPPED):
-                    # Skip when checkpointed or stopped
-                    continue
-                else:
-                    # The task will have ended
-                    self.logger.debug("Breaking")
-                    break
-
-            if self.status in (Status.CREATING, Status.RESTARTING):
-                # Setup the task, i.e. retrieve its parent's process id (ppid)
-                try:
-                    parts = line.split()
-                    if parts[0] == "ERROR:":
-                        raise ValueError(" ".join(parts[1:]))
-                    if parts[0] != "PPID:":
-                        if self._error_count > 100:
-                            raise ValueError("Could not determine ppid.")
-                        self._error_count += 1
-                        continue
-
-                    self.ppid = int(parts[1])
-                    self.logger.debug("Set ppid to %d" % self.ppid)
-                    self.status = Status.RUNNING
-                except ValueError as e:
-                    self.logger.critical("Could not start the task:\n %s" % e)
-                    self.status = Status.FAILED
-                    break
-            else:
-                self.logger.debug("%s: %s" % (self.name, line[:-1]))
-                self.output += [line]
+        if self.status in (Status.CHECKPOINTING, Status.CHECKPOINTED):
+            # The process was killed by the checkpoint, it will be restarted
+            return
 
+        self.logger.debug("Output of %s ended" % self.tid)
         if self.status not in (Status.KILLED, Status.FAILED):
             # The task has successfully ended
             self.status = Status.FINISHED
             self.cpu_usage = 0.0
             self.mem_usage = 0.0
 
-    def checkpoint(self):
-        """Checkpoint the task."""
+        self.ended.set()
+
+    def join(self, timeout=None):
+        """Wait until the output of the task has ended."""
+        if self.dummy_mode or self.p is None:
+            return
+        self.ended.wait(timeout)
+
+    def remote(self, command, action, background=False):
+        """
+        Execute 'command' through the agent on the task's core. 'action'
+        describes the operation in the log messages. Long-running commands
+        are run with 'background' set. Returns the output of the command, or
+        None when it failed.
+        """
+        rc, out = self.agent.call(command, background=background)
+        if rc is None:
+            self.logger.warning(
+                "%s failed: no reply from core %02d" % (action, self.core)
+            )
+            return None
+        if rc != 0:
+            self.logger.warning(
+                "%s exited with some errors: %s" % (action, "".join(out))
+            )
+            return None
+        return out
+
+    def checkpoint(self, directory=CONTEXTS_DIR):
+        """
+        Checkpoint the task. The context file is written to 'directory' on
+        the task's core, which defaults to the shared contexts directory.
+        """
         if self.dummy_mode:
             self.status = Status.CHECKPOINTED
             return True
@@ -228,26 +259,20 @@ class Task(Thread):
         self.status = Status.CHECKPOINTING
 
         self._cfile = "%s/context.%d.%d.%s.cxt" % \
-            (CONTEXTS_DIR, self.core, self.ppid, self.tid)
+            (directory, self.core, self.ppid, self.tid)
 
         # The -d option is yet to be implemented in cr_checkpoint(!)
-        p = sp.Popen(
-            'ssh -S ~/.ssh/root@rck%02d root@rck%02d \'source "%s"; ' \
-            'cr_checkpoint --kill -f %s %d\'' % \
-            (self.core, self.core, BLCR_SETUP_PATH, self._cfile, self.pid),
-            shell=True,
-            stdout=sp.PIPE,
-            stderr=sp.PIPE
+        out = self.remote(
+            'source "%s"; cr_checkpoint --kill -f %s %d' % \
+            (BLCR_SETUP_PATH, self._cfile, self.pid),
+            "Checkpointing",
+            background=True
         )
-
-        # Show output, if any
-        out, err = p.communicate()
-        if len(err) > 0:
-            self.logger.warning(
-                "Checkpointing exited with some errors: %s" % err
-            )
-        if len(out) > 0:
-            self.output += [out]
+        if out is None:
+            self.status = Status.RUNNING
+            return False
+        if out:
+            self.output += out
 
         # Reset all data
         self.ppid = -1
@@ -275,6 +300,8 @@ class Task(Thread):
 
         self.logger.debug("Attempting to restart on core %02d" % core)
 
+        self.core = core
+        self.status = Status.RESTARTING
         self.p = sp.Popen(
             'ssh -S ~/.ssh/root@rck%02d root@rck%02d \'echo "PPID: $$"; ' \
                 'source "%s"; cr_restart --no-restore-pid %s\'' \
@@ -283,9 +310,7 @@ class Task(Thread):
             stdout=sp.PIPE,
             stderr=sp.STDOUT
         )
-
-        self.core = core
-        self.status = Status.RESTARTING
+        self.reactor.register(self, self.p.stdout)
         return True
 
     def stop(self):
@@ -301,20 +326,9 @@ class Task(Thread):
         self.logger.debug("Stopping the program...")
         self.status = Status.STOPPING
 
-        p = sp.Popen(
-            'ssh -S ~/.ssh/root@rck%02d root@rck%02d \'kill -SIGSTOP %d\'' % \
-            (self.core, self.core, self.pid),
-            shell=True,
-            stdout=sp.PIPE,
-            stderr=sp.PIPE
-        )
-
-        # Show output, if any
-        out, err = p.communicate()
-        if len(err) > 0:
-            self.logger.warning("Stopping exited with some errors: %s" % err)
-        if len(out) > 0:
-            self.output += [out]
+        out = self.remote('kill -STOP %d' % self.pid, "Stopping")
+        if out:
+            self.output += out
 
         self.status = Status.STOPPED
         self.logger.debug("Stopped the program")
@@ -333,20 +347,9 @@ class Task(Thread):
         self.logger.debug("Continuing the program...")
         self.status = Status.CONTINUING
 
-        p = sp.Popen(
-            'ssh -S ~/.ssh/root@rck%02d root@rck%02d \'kill -SIGCONT %d\'' % \
-            (self.core, self.core, self.pid),
-            shell=True,
-            stdout=sp.PIPE,
-            stderr=sp.PIPE
-        )
-
-        # Show output, if any
-        out, err = p.communicate()
-        if len(err) > 0:
-            self.logger.warning("Continuing exited with some errors: %s" % err)
-        if len(out) > 0:
-            self.output += [out]
+        out = self.remote('kill -CONT %d' % self.pid, "Continuing")
+        if out:
+            self.output += out
 
         self.status = Status.RUNNING
         self.logger.debug("Continued the program")
@@ -365,20 +368,9 @@ class Task(Thread):
         self.logger.debug("Killing the program...")
         self.status = Status.KILLING
 
-        p = sp.Popen(
-            'ssh -S ~/.ssh/root@rck%02d root@rck%02d \'kill %d\'' \
-                % (self.core, self.core, self.pid),
-            shell=True,
-            stdout=sp.PIPE,
-            stderr=sp.PIPE
-        )
-
-        # Show output, if any
-        out, err = p.communicate()
-        if len(err) > 0:
-            self.logger.warning("Killing exited with some errors: %s" % err)
-        if len(out) > 0:
-            self.output += [out]
+        out = self.remote('kill %d' % self.pid, "Killing")
+        if out:
+            self.output += out
 
         self.status = Status.KILLED
         self.logger.debug("Killed the program")
@@ -387,21 +379,14 @@ class Task(Thread):
     def get_child_pid(self, ppid):
         """Retrieve the child PID from its PPID."""
         # Obtain all processes with the given ppid
-        p2 = sp.Popen(
-            'ssh -S ~/.ssh/root@rck%02d root@rck%02d \'ps -a -o ' \
-            'pid,ppid,comm | grep %d\'' %
-            (self.core, self.core, ppid),
-            shell=True,
-            stdout=sp.PIPE,
-            stderr=sp.PIPE
-        )
-        out, err = p2.communicate()
-        if len(err) > 0:
-            raise Exception("Get_pid exited with errors: %s" % err)
+        rc, out = self.agent.call('ps -a -o pid,ppid,comm | grep %d' % ppid)
+        if rc is None:
+            raise Exception("Get_pid failed: no reply from core %02d" % \
+                self.core)
 
         pid = -1
 
-        for i, line in enumerate(split(out, '\n')[:-1]):
+        for i, line in enumerate(out):
             self.logger.debug("Line %d: %s" % (i, line))
 
             # Retrieve the pid, ppid and command
@@ -448,6 +433,10 @@ class Task(Thread):
 
         return self._pid
 
+    def get_agent(self):
+        """Get the agent on the task's core."""
+        return self.agents[self.core]
+
     def get_status(self):
         """Getter for the task status."""
         return self._status
@@ -460,5 +449,6 @@ class Task(Thread):
         self.logger.debug("Status changed to %s" % Status(self.status))
 
     # Define getters and setters
+    agent = property(get_agent)
     pid = property(get_pid)
     status = property(get_status, set_status)
@@ -20,11 +20,15 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from core import Core, Status as CoreStatus
+from cpufreq import CpuFreq, CPU_PATH
 from random import randint
 from math import floor
-import subprocess as sp
-from task import Task
-from threading import Thread
+from placement import PlacementIndex, core_loads
+from reactor import OutputReactor
+from sampler import CoreSampler
+from sensors import PowerSampler, INA231_SENSORS
+from task import Task, Status as TaskStatus
+from threading import Thread, Lock
 from time import sleep
 import logging
 import sys
@@ -61,16 +65,50 @@ class Chip(Thread):
         self.cores = []
         self.tasks = dict()
         self.dummy_mode = kwargs.get('dummy_mode', False)
+        self.sampler = None
+        self.reactor = None
+        self.power_sampler = None
+        self.cpufreq = None
 
         self.running = True
         self.power_usage = {"A15": 1, "A7": 1}
         self.status = Status.PENDING
         self.task_count = 0
+        self.task_lock = Lock()
+
+        if not self.dummy_mode:
+            try:
+                self.cpufreq = CpuFreq(
+                    path=kwargs.get('cpufreq_path', CPU_PATH)
+                )
+            except (IOError, OSError, ValueError) as e:
+                self.logger.critical("Could not read cpufreq: %s" % e)
 
         for i in range(cores):
             self.cores.append(
                 Core(i, frequency_table=self.frequency_tables[int(floor(i/4))], 
-                        dummy_mode=self.dummy_mode))
+                        dummy_mode=self.dummy_mode, cpufreq=self.cpufreq))
+
+        if not self.dummy_mode:
+            self.reactor = OutputReactor()
+            self.reactor.start()
+
+            self.sampler = CoreSampler(
+                self.cores,
+                tasks=self.tasks,
+                interval=1. / kwargs.get('sample_frequency', 1)
+            )
+
+            self.power_sampler = PowerSampler(
+                sensors=kwargs.get('power_sensors', INA231_SENSORS),
+                interval=1. / kwargs.get('power_sample_frequency', 10)
+            )
+
+        # Load of every core for smart placement, per frequency island
+        self.placement = PlacementIndex(
+            kwargs.get('clusters', voltage_islands)
+        )
+        self.update_placement()
 
         self.status = Status.CONNECTING
         self.start()
@@ -106,20 +144,8 @@ class Chip(Thread):
         """Setup the connection to all cores and retrieve power usage."""
         
         if not self.dummy_mode:
-            p = sp.Popen(
-                    './enable_sensors.sh',
-                    shell=True,
-                    stdout=sp.PIPE,
-                    stderr=sp.PIPE
-            )
-
-            # Show output, if any
-            out, err = p.communicate()
-            if len(err) > 0:
-                self.logger.warning(
-                    "Error when enabling sensors: %s" % err
-                )
-
+            self.sampler.start()
+            self.power_sampler.start()
 
         while self.running:
             sleep(1)
@@ -139,21 +165,33 @@ class Chip(Thread):
             else:
                 self.get_power()
 
+            # The placement index is refreshed once per tick
+            self.update_placement()
+
     def stop(self):
         """Stop the chip control."""
         self.status = Status.EXITING
         self.running = False
 
+        if self.sampler:
+            self.sampler.stop()
+
+        if self.power_sampler:
+            self.power_sampler.stop()
+
         # Stop all cores and tasks
         for core in self.cores:
             for task in core.tasks.values():
-                self.logger.debug("Joining task %s..." % task.name)
+                self.logger.debug("Joining task %s..." % task.tid)
                 task.kill()
                 task.join()
                 self.logger.debug("Joined")
-            self.logger.debug("Joining core %s..." % core)
-            core.join()
-            self.logger.debug("Joined")
+
+        if self.reactor:
+            self.reactor.stop()
+
+        if self.cpufreq:
+            self.cpufreq.close()
 
 
 
@@ -168,66 +206,135 @@ class Chip(Thread):
                 5,
                 max(0, self.power_usage["A7"] + 0.1*randint(-10, 10))
             )
-        else: 
-            p = sp.Popen(
-                './core_sensors.sh',
-                shell=True,
-                stdout=sp.PIPE,
-                stderr=sp.PIPE
-            )
+        else:
+            # The sensors are sampled in the background by the power sampler
+            sampler = self.power_sampler
+            for i, sensor in enumerate(sampler.sensors):
+                if sensor.name not in sampler.power:
+                    continue
+
+                self.power_usage[sensor.name] = sampler.power[sensor.name]
+                for c in self.voltage_islands[i]:
+                    self.cores[c].voltage = sampler.voltage[sensor.name]
+
+    def set_frequency(self, cores, frequency):
+        """
+        Set the frequency of the given cores, with one write per frequency
+        island.
+        """
+        if self.cpufreq:
+            try:
+                actual = self.cpufreq.set_frequency(cores, frequency)
+            except (IOError, OSError, ValueError) as e:
+                raise Exception("Frequency set failed with errors: %s" % e)
+        else:
+            actual = dict((c, frequency) for c in cores)
 
-            # Show output, if any
-            out, err = p.communicate()
-            if len(err) > 0:
-                self.logger.warning(
-                    "Error when retrieving power: %s" % err
-                )
+        for c, f in actual.iteritems():
+            if c < len(self.cores):
+                self.cores[c]._frequency = f
 
-            # Retrieve power usage information
-            for line in out.split('\n'):
-                if "A15 Power:" in line:
-                    _, _, v, a, w = line.split()
-                    self.power_usage["A15"] = float(w[:-1])
-                    
-                    for c in self.voltage_islands[0]:
-                        self.cores[c].voltage = float(v[:-2])
-                
-                elif "A7 Power:" in line:
-                    _, _, v, a, w = line.split()
-                    self.power_usage["A7"] = float(w[:-1])
-                    for c in self.voltage_islands[1]:
-                        self.cores[c].voltage = float(v[:-2])
-     
+    def update_placement(self):
+        """Snapshot the load of every core into the placement index."""
+        self.placement.update(core_loads(self.cores, self.tasks.values()))
+
+    def new_task_id(self):
+        """
+        Return a new task ID. Commands are executed concurrently, so the
+        task count is incremented under a lock.
+        """
+        with self.task_lock:
+            self.task_count += 1
+            return "T%04d" % self.task_count
 
     def add_task(self, name, program, core):
         """Add a task with the given name and program to the given core."""
-        self.task_count += 1
-        task_id = "T%04d" % self.task_count
+        if not 0 <= core < len(self.cores):
+            raise Exception("Invalid core %d." % core)
+        c = self.cores[core]
+
+        task_id = self.new_task_id()
         self.logger.debug("Adding task %s" % task_id)
-        t = Task(task_id, core, name, program, dummy_mode=self.dummy_mode)
-        self.cores[core].add_task(t)
+        t = Task(task_id, core, name, program, dummy_mode=self.dummy_mode,
+            reactor=self.reactor)
+        c.add_task(t)
         self.tasks[task_id] = t
         return task_id
 
+    def add_tasks(self, specs):
+        """
+        Add the tasks in 'specs', a list of (name, program, core) tuples.
+        Returns the IDs of the new tasks.
+        """
+        return [self.add_task(name, program, core)
+            for name, program, core in specs]
+
     def move_task(self, tid, to_core):
-        """Move the task with given Task ID (tid) to core 'to_core'."""
+        """
+        Move the task with given Task ID (tid) to core 'to_core'. Returns
+        whether the task was moved.
+        """
         t = self.tasks[tid]
         if to_core < 0:
             if self.cores[t.core].pause_task(t):
                 self.cores[t.core].tasks.pop(t.tid)
                 t.core = -1
+                return True
         else:
             self.cores[t.core].move_task(t, self.cores[to_core])
+            return True
+        return False
+
+    def move_tasks(self, moves):
+        """
+        Move the tasks in 'moves', a list of (tid, to_core) tuples, in one
+        pass. Returns the IDs of the moved tasks.
+        """
+        moved = []
+        for tid, to_core in moves:
+            if self.move_task(tid, to_core):
+                moved.append(tid)
+        return moved
+
+    def wait_for(self, tasks, status):
+        """
+        Wait until all given tasks have reached the given status, or have
+        ended. Returns the IDs of the tasks that reached the status.
+        """
+        ended = (TaskStatus.KILLED, TaskStatus.FINISHED, TaskStatus.FAILED)
+        for t in tasks:
+            while t.status != status and t.status not in ended:
+                # Allow for a context switch
+                sleep(.1)
+        return [t.tid for t in tasks if t.status == status]
 
     def pause_task(self, tid):
         """Pause the task with ID 'tid'."""
         t = self.tasks[tid]
-        self.cores[t.core].pause_task(t)
+        return self.cores[t.core].pause_task(t)
 
     def resume_task(self, tid):
         """Resume the task with ID 'tid'."""
         t = self.tasks[tid]
-        self.cores[t.core].resume_task(t)
+        return self.cores[t.core].resume_task(t)
+
+    def pause_tasks(self, tids):
+        """
+        Pause the tasks with the IDs in 'tids'. All tasks are signalled
+        before waiting for any of them. Returns the IDs of the paused tasks.
+        """
+        tasks = [self.tasks[tid] for tid in tids]
+        stopped = [t for t in tasks if t.stop()]
+        return self.wait_for(stopped, TaskStatus.STOPPED)
+
+    def resume_tasks(self, tids):
+        """
+        Resume the tasks with the IDs in 'tids'. All tasks are signalled
+        before waiting for any of them. Returns the IDs of the resumed tasks.
+        """
+        tasks = [self.tasks[tid] for tid in tids]
+        continued = [t for t in tasks if t.cont()]
+        return self.wait_for(continued, TaskStatus.RUNNING)
 
     def kill_task(self, tid):
         """Kill the task with ID 'tid'."""
@@ -237,20 +344,36 @@ class Chip(Thread):
             self.tasks.pop(t.tid)
             return output
 
+    def kill_tasks(self, tids):
+        """
+        Kill the tasks with the IDs in 'tids'. All tasks are signalled
+        before any of them is joined. Returns the output of every killed
+        task, keyed by its ID.
+        """
+        tasks = [self.tasks[tid] for tid in tids]
+        killed = [t for t in tasks if t.kill()]
+
+        outputs = dict()
+        for t in killed:
+            t.join()
+            outputs[t.tid] = t.output
+            self.tasks.pop(t.tid)
+        return outputs
+
     def duplicate_task(self, tid):
         """Duplicate the task with ID 'tid'."""
         t = self.tasks[tid]
         if t.core >= 0:
             raise Exception("Running tasks cannot be duplicated.")
 
-        self.task_count += 1
-        task_id = "T%04d" % self.task_count
+        task_id = self.new_task_id()
         d = Task(
             task_id,
             -1,
             t.pname,
             t.program,
             dummy_mode=t.dummy_mode,
+            reactor=self.reactor,
             status=t._status
         )
         d.output = t.output
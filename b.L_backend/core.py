@@ -21,10 +21,8 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from random import randint
 from task import Status as TaskStatus
-from threading import Thread
 from time import sleep
 import logging
-import subprocess as sp
 
 class Status:
     """Core statuses."""
@@ -42,7 +40,7 @@ class Status:
         return self.names[self.value]
 
 
-class Core(Thread):
+class Core(object):
     """Core object, containing all information about a core."""
 
     def __init__(self, core, **kwargs):
@@ -52,6 +50,7 @@ class Core(Thread):
         self.frequency_table = kwargs.get('frequency_table', None)
         self.tasks = dict()
         self.dummy_mode = kwargs.get('dummy_mode', False)
+        self.cpufreq = kwargs.get('cpufreq', None)
 
         self.status = Status.PENDING
         self.cpu_usage = 0.0
@@ -59,12 +58,8 @@ class Core(Thread):
         self._frequency = max(self.frequency_table)
         self._voltage = 1.
 
-        Thread.__init__(self)
-
         self.setup()
 
-        self.start()
-
     def __repr__(self):
         if self.status != Status.RUNNING:
             return "Core %d: connection not yet established." % self.id
@@ -109,69 +104,38 @@ class Core(Thread):
 
     def setup(self):
         """
-        Execute mpstat on the given core, and set the cpufreq governor to
-        userspace.
+        Set the cpufreq governor to userspace. The core's utilization is
+        published by the chip's CoreSampler.
         """
         self.status = Status.CONNECTING
 
-        if not self.dummy_mode:
-            self.p = sp.Popen(
-                'mpstat -P %d 1' % self.id,
-                shell=True,
-                stdout=sp.PIPE,
-                stderr=sp.STDOUT
-            )
-
-
-            sp.Popen(
-                'cpufreq-set -c %d -g userspace --min %dMHz --max %dMHz' % (
-                    self.id, min(self.frequency_table), max(self.frequency_table)),
-                shell=True,
-                stdout=sp.PIPE,
-                stderr=sp.PIPE
-            )
-
-
-    def run(self):
-        """Continuously read the output of mpstat."""
         if self.dummy_mode:
             self.status = Status.RUNNING
-            return
-
-        while 1:
-            line = self.p.stdout.readline()
-
-            if not line:
-                break
-
-            if self.status == Status.CONNECTING:
-                self.status = Status.RUNNING
-
-            for task in self.tasks.values():
-                try:
-                    if task.p_top != None:
-                        task_line = task.p_top.stdout.readline()
-                        if task_line:
-                            task.parse_perf(task_line)                
-                except:
-                    continue
-            
-            self.parse_perf(line)
-            
+        elif self.cpufreq:
+            try:
+                self.cpufreq.set_governor(
+                    [self.id],
+                    'userspace',
+                    min(self.frequency_table),
+                    max(self.frequency_table)
+                )
+            except (IOError, OSError, ValueError) as e:
+                self.logger.warning(
+                    "Could not set the userspace governor: %s" % e
+                )
 
-    def parse_perf(self, line):
-        """Retrieve the process data from mpstat's output."""
+    def update_usage(self, cpu_usage):
+        """
+        Set the CPU usage as measured by the chip's CoreSampler and the
+        memory usage of this core's tasks.
+        """
+        self.cpu_usage = cpu_usage
+        self.logger.debug("Core %d CPU_usage: %f" % (self.id, self.cpu_usage))
 
-        stats = line.split()
-        if len(stats) >= 4:
-            if stats[1] in ("PM", "AM"):
-                if stats[2] == str(self.id):
-                    self.cpu_usage = float(stats[3].replace(",", "."))
-                    self.logger.debug("Core %d CPU_usage: %f" % (self.id, self.cpu_usage))
-            elif stats[1] == str(self.id):
-                self.cpu_usage = float(stats[2].replace(",", "."))
-                self.logger.debug("Core %d CPU_usage: %f" % (self.id, self.cpu_usage))
+        if self.status == Status.CONNECTING:
+            self.status = Status.RUNNING
 
+        # The tasks have been sampled in the same tick
         total_mem = 0
         for task in self.tasks.values():
             total_mem += task.mem_usage
@@ -188,6 +152,7 @@ class Core(Thread):
         """Move the given task 't' to core 'to_core'.""" 
 
         t.move(to_core.id)
+        self.tasks.pop(t.tid, None)
         to_core.add_task(t)
 
 
@@ -209,6 +174,9 @@ class Core(Thread):
                 # Allow for a context switch
                 sleep(.1)
                 pass
+            return True
+        else:
+            return False
 
     def kill_task(self, t):
         """Kill the given task."""
@@ -226,17 +194,17 @@ class Core(Thread):
         if self.frequency == value:
             return
 
-        p = sp.Popen("cpufreq-set -c %d -f %dMHz" % (self.id, value),
-            shell=True,
-            stdout=sp.PIPE,
-            stderr=sp.PIPE
-        )
-
-        out, err = p.communicate()
-        self.logger.debug("cpufreq-set response: %s \n%s" % (out, err))
-        if len(out) > 0:
-            self.logger.warning("Set freq: %s" % out)
-            raise Exception("Frequency set failed with errors: %s" % out)
+        if self.cpufreq:
+            try:
+                result = self.cpufreq.set_frequency([self.id], value)
+                if self.id not in result:
+                    raise ValueError(
+                        "Cpu %d has no cpufreq policy" % self.id
+                    )
+                value = result[self.id]
+            except (IOError, OSError, ValueError) as e:
+                self.logger.warning("Set freq: %s" % e)
+                raise Exception("Frequency set failed with errors: %s" % e)
         self._frequency = value
 
     def get_voltage(self):
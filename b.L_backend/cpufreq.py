@@ -0,0 +1,220 @@
+"""
+ManyMan - A Many-core Visualization and Management System
+Copyright (C) 2015
+University of Amsterdam - Computer Systems Architecture
+Jimi van der Woning and Roy Bakker
+Extended for big.LITTLE by: Floris Turkenburg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from sampler import read_file
+from threading import Lock
+import logging
+import os
+import re
+
+CPU_PATH = "/sys/devices/system/cpu"
+
+
+def read_value(path):
+    """Read the contents of a single sysfs file."""
+    f = open(path, 'r')
+    try:
+        return f.read().strip()
+    finally:
+        f.close()
+
+
+def write_value(fd, value):
+    """Write 'value' to the kept-open sysfs file descriptor 'fd'."""
+    os.lseek(fd, 0, os.SEEK_SET)
+    os.write(fd, "%s\n" % value)
+
+
+class Policy:
+    """
+    A cpufreq policy, i.e. a group of cpus that share their clock. The
+    capabilities of the policy are read once, the files that are written
+    and read on every frequency change are kept open.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.cpus = [int(c) for c in read_value(
+            os.path.join(path, 'related_cpus')).split()]
+        self.governors = read_value(
+            os.path.join(path, 'scaling_available_governors')).split()
+
+        # Frequencies in kHz
+        try:
+            self.frequencies = sorted(int(f) for f in read_value(
+                os.path.join(path, 'scaling_available_frequencies')).split())
+        except IOError:
+            # Not all drivers list their frequencies
+            self.frequencies = []
+        self.min_frequency = int(read_value(
+            os.path.join(path, 'cpuinfo_min_freq')))
+        self.max_frequency = int(read_value(
+            os.path.join(path, 'cpuinfo_max_freq')))
+
+        self.governor = read_value(os.path.join(path, 'scaling_governor'))
+        self._fds = dict()
+
+    def _fd(self, name, flags):
+        """Return the kept-open descriptor of the file 'name'."""
+        fd = self._fds.get(name)
+        if fd is None:
+            fd = os.open(os.path.join(self.path, name), flags)
+            self._fds[name] = fd
+        return fd
+
+    def set_governor(self, governor, min_frequency=None, max_frequency=None):
+        """Select the governor and the frequency limits, in kHz."""
+        if governor not in self.governors:
+            raise ValueError("Governor %s is not available" % governor)
+
+        if governor != self.governor:
+            write_value(self._fd('scaling_governor', os.O_WRONLY), governor)
+            self.governor = governor
+
+        # Widen the limits first, so they are never crossed
+        if max_frequency:
+            write_value(self._fd('scaling_max_freq', os.O_WRONLY),
+                self.max_frequency)
+        if min_frequency:
+            write_value(self._fd('scaling_min_freq', os.O_WRONLY),
+                min_frequency)
+        if max_frequency:
+            write_value(self._fd('scaling_max_freq', os.O_WRONLY),
+                max_frequency)
+
+    def set_frequency(self, frequency):
+        """
+        Set the frequency of all cpus of the policy, in kHz. Returns the
+        frequency as read back from the hardware.
+        """
+        if self.governor != 'userspace':
+            raise ValueError("The userspace governor is not selected")
+
+        write_value(self._fd('scaling_setspeed', os.O_WRONLY), frequency)
+        return self.get_frequency()
+
+    def get_frequency(self):
+        """Return the current frequency of the policy, in kHz."""
+        return int(read_file(self._fd('scaling_cur_freq', os.O_RDONLY)))
+
+    def close(self):
+        """Close all kept-open descriptors."""
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+
+
+class CpuFreq:
+    """
+    Frequency control of all cpus through the cpufreq sysfs interface. The
+    policies are discovered once. All frequencies are in MHz, like in the
+    frequency tables.
+    """
+
+    def __init__(self, **kwargs):
+        self.logger = logging.getLogger('CpuFreq')
+
+        self.path = kwargs.get('path', CPU_PATH)
+        self.policies = []
+        self.lock = Lock()
+
+        # Policy of each cpu, keyed by cpu number
+        self._policy = dict()
+
+        for entry in sorted(os.listdir(self.path)):
+            if not re.match(r'cpu\d+$', entry):
+                continue
+
+            cpu = int(entry[3:])
+            path = os.path.join(self.path, entry, 'cpufreq')
+            if cpu in self._policy or not os.path.isdir(path):
+                continue
+
+            policy = Policy(os.path.realpath(path))
+            self.policies.append(policy)
+            for c in policy.cpus:
+                self._policy[c] = policy
+
+        self.logger.debug("Found policies for cpus %s" %
+            [p.cpus for p in self.policies])
+
+    def policy(self, cpu):
+        """Return the policy of the given cpu."""
+        return self._policy[cpu]
+
+    def has_governor(self, governor):
+        """Whether the given governor is available for all cpus."""
+        return len(self.policies) > 0 and \
+            all(governor in p.governors for p in self.policies)
+
+    def _group(self, cpus):
+        """
+        Return the policies of the given cpus, each policy once. Cpus
+        without a cpufreq policy are skipped.
+        """
+        policies = []
+        for cpu in cpus:
+            policy = self._policy.get(cpu)
+            if policy is None:
+                self.logger.debug("Cpu %d has no cpufreq policy" % cpu)
+            elif policy not in policies:
+                policies.append(policy)
+        return policies
+
+    def set_governor(self, cpus, governor, min_frequency=None,
+            max_frequency=None):
+        """Select the governor and frequency limits of the given cpus."""
+        with self.lock:
+            for policy in self._group(cpus):
+                policy.set_governor(
+                    governor,
+                    min_frequency and min_frequency * 1000,
+                    max_frequency and max_frequency * 1000
+                )
+
+    def set_frequency(self, cpus, frequency):
+        """
+        Set the frequency of the given cpus, with one write per policy.
+        Returns the frequency of each cpu as read back from the hardware,
+        keyed by cpu number.
+        """
+        result = dict()
+        with self.lock:
+            for policy in self._group(cpus):
+                actual = policy.set_frequency(frequency * 1000) / 1000
+                if actual != frequency:
+                    self.logger.warning(
+                        "Cpus %s run at %dMHz instead of %dMHz" %
+                        (policy.cpus, actual, frequency)
+                    )
+                for c in policy.cpus:
+                    result[c] = actual
+        return result
+
+    def get_frequency(self, cpu):
+        """Return the current frequency of the given cpu."""
+        with self.lock:
+            return self._policy[cpu].get_frequency() / 1000
+
+    def close(self):
+        """Close all kept-open descriptors."""
+        for policy in self.policies:
+            policy.close()
@@ -0,0 +1,228 @@
+"""
+ManyMan - A Many-core Visualization and Management System
+Copyright (C) 2015
+University of Amsterdam - Computer Systems Architecture
+Jimi van der Woning and Roy Bakker
+Extended for big.LITTLE by: Floris Turkenburg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from collections import deque
+from task import Status as TaskStatus
+from threading import Thread, Event
+from time import time
+import logging
+
+
+class HmpPolicy(Thread):
+    """
+    Heterogeneous multi-processing policy for big.LITTLE. The CPU demand of
+    every running task is tracked as an exponentially decaying average of
+    its utilization, scaled by the frequency of its core. A task on a
+    LITTLE core whose demand rises above 'up_threshold' is moved up to a
+    big core, a task on a big core whose demand drops below
+    'down_threshold' is moved down to a LITTLE core.
+
+    Tasks are only moved up to an idle big core and while the power of the
+    big cluster, named 'big_name' in the chip's power usage, is below
+    'power_cap'. A task stays on its cluster for at least 'residency'
+    seconds and at most 'max_moves' tasks are moved per interval. Every
+    move is kept in 'log' and handed to 'callback'.
+    """
+
+    def __init__(self, chip, big, little, **kwargs):
+        self.logger = logging.getLogger('HmpPolicy')
+
+        self.chip = chip
+        self.big = list(big)
+        self.little = list(little)
+        self.big_name = kwargs.get('big_name', 'A15')
+        self.interval = kwargs.get('interval', 1.)
+        self.half_life = kwargs.get('half_life', 2.)
+        self.up_threshold = kwargs.get('up_threshold', 80.)
+        self.down_threshold = kwargs.get('down_threshold', 30.)
+        self.residency = kwargs.get('residency', 5.)
+        self.max_moves = kwargs.get('max_moves', 2)
+        self.power_cap = kwargs.get('power_cap', None)
+        self.callback = kwargs.get('callback', None)
+
+        self.log = deque(maxlen=kwargs.get('log_size', 100))
+        self.moves = 0
+
+        # Tracked demand of every running task and the time since which it
+        # is on its current cluster, keyed by task id
+        self.demand = dict()
+        self.since = dict()
+        self._last = None
+
+        self.running = True
+        self._stop_event = Event()
+
+        Thread.__init__(self)
+        self.daemon = True
+
+    def cluster(self, core):
+        """Return 'big' or 'little' for the given core, or None."""
+        if core in self.big:
+            return 'big'
+        elif core in self.little:
+            return 'little'
+        return None
+
+    def running_tasks(self):
+        """Return the running tasks on the cores of both clusters."""
+        return [t for t in self.chip.tasks.values()
+            if t.status == TaskStatus.RUNNING and self.cluster(t.core)]
+
+    def track(self, tasks, now):
+        """Update the tracked demand of the given tasks."""
+        if self._last is None:
+            alpha = 1.
+        else:
+            alpha = 1. - .5 ** ((now - self._last) / self.half_life)
+        self._last = now
+
+        demand = dict()
+        since = dict()
+        for t in tasks:
+            core = self.chip.cores[t.core]
+            usage = t.cpu_usage * core.frequency / \
+                float(max(core.frequency_table))
+
+            prev = self.demand.get(t.tid)
+            if prev is None:
+                demand[t.tid] = usage
+            else:
+                demand[t.tid] = prev + alpha * (usage - prev)
+
+            # A task that changed cluster outside of the policy, e.g. by a
+            # move of the user, starts a new residency
+            entry = self.since.get(t.tid)
+            if entry is None or entry[0] != self.cluster(t.core):
+                entry = (self.cluster(t.core), now)
+            since[t.tid] = entry
+
+        self.demand = demand
+        self.since = since
+
+    def plan(self, tasks, now):
+        """
+        Plan the moves of this interval. Returns a list of (task, from_core,
+        to_core, direction) tuples.
+        """
+        queues = dict((c, 0) for c in self.big + self.little)
+        for t in tasks:
+            queues[t.core] += 1
+
+        settled = [t for t in tasks
+            if now - self.since[t.tid][1] >= self.residency]
+        down = sorted(
+            [t for t in settled if t.core in self.big and
+                self.demand[t.tid] <= self.down_threshold],
+            key=lambda t: self.demand[t.tid]
+        )
+        up = sorted(
+            [t for t in settled if t.core in self.little and
+                self.demand[t.tid] >= self.up_threshold],
+            key=lambda t: self.demand[t.tid],
+            reverse=True
+        )
+
+        def target(cores):
+            return min(cores,
+                key=lambda c: (queues[c], self.chip.cores[c].cpu_usage))
+
+        moves = []
+
+        # Moving tasks down first frees big cores for the moves up
+        for t in down[:self.max_moves]:
+            dst = target(self.little)
+            queues[t.core] -= 1
+            queues[dst] += 1
+            moves.append((t, t.core, dst, 'down'))
+
+        power = self.chip.power_usage.get(self.big_name, 0)
+        if self.power_cap is not None and power >= self.power_cap:
+            return moves
+
+        for t in up:
+            if len(moves) >= self.max_moves:
+                break
+
+            dst = target(self.big)
+            if queues[dst] > 0:
+                # No idle big core is left
+                break
+            queues[t.core] -= 1
+            queues[dst] += 1
+            moves.append((t, t.core, dst, 'up'))
+
+        return moves
+
+    def apply(self, moves, now):
+        """Apply the planned moves through the chip."""
+        placement = self.chip.placement
+        for t, src, dst, direction in moves:
+            try:
+                moved = self.chip.move_task(t.tid, dst)
+            except Exception as e:
+                self.logger.warning("Could not move %s: %s" % (t.tid, e))
+                moved = False
+
+            if moved:
+                placement.add(dst)
+                placement.add(src, -1)
+                self.since[t.tid] = (self.cluster(dst), now)
+                self.moves += 1
+                self.logger.info("Moved %s %s from core %d to core %d" %
+                    (t.tid, direction, src, dst))
+
+            entry = {
+                "Time": now,
+                "ID": t.tid,
+                "From": src,
+                "To": dst,
+                "Direction": direction,
+                "Demand": self.demand[t.tid],
+                "Success": bool(moved)
+            }
+            self.log.append(entry)
+
+            if self.callback:
+                self.callback(entry)
+
+    def step(self):
+        """Track the demand of all tasks once and move tasks when needed."""
+        now = time()
+        tasks = self.running_tasks()
+        self.track(tasks, now)
+        self.apply(self.plan(tasks, now), now)
+
+    def run(self):
+        """Keep applying the policy on the configured interval."""
+        while self.running:
+            self._stop_event.wait(self.interval)
+            if not self.running:
+                break
+
+            try:
+                self.step()
+            except Exception as e:
+                self.logger.warning("Exception in the HMP policy: %s" % e)
+
+    def stop(self):
+        """Stop the policy."""
+        self.running = False
+        self._stop_event.set()
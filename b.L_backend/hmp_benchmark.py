@@ -0,0 +1,203 @@
+"""
+ManyMan - A Many-core Visualization and Management System
+Copyright (C) 2015
+University of Amsterdam - Computer Systems Architecture
+Jimi van der Woning and Roy Bakker
+Extended for big.LITTLE by: Floris Turkenburg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Benchmark of the HMP policy against static placement on the ODROID-XU3.
+# Both runs start the same mixed workload of CPU-bound and bursty workers.
+# With static placement the workers are spread over all cores and never
+# moved. With the HMP policy they all start on the LITTLE cluster and the
+# policy moves them between the clusters. Every worker prints a line per
+# unit of work, so the throughput is the number of output lines. The
+# energy is integrated by the chip's power sampler.
+#
+# Usage: python hmp_benchmark.py [options] [settings file]
+
+from chip import Chip
+from hmp import HmpPolicy
+from server import default_settings
+from time import sleep, time
+import argparse
+import config
+import logging
+import os
+import sys
+
+# Iterations of the worker loop per unit of work
+UNIT_ITERATIONS = 100000
+
+
+def work(kind, duty):
+    """
+    Worker program of the benchmark. A 'cpu' worker computes all the time,
+    a 'bursty' worker only for a 'duty' fraction of every second.
+    """
+    busy = 1. if kind == 'cpu' else duty
+    x = 0
+    while True:
+        start = time()
+        while time() - start < busy:
+            for i in xrange(UNIT_ITERATIONS):
+                x ^= i
+            print "unit"
+            sys.stdout.flush()
+
+        if busy < 1.:
+            sleep(1. - busy)
+
+
+def init_chip(settings):
+    """Initialize chip control like the back-end does."""
+    return Chip(
+        settings['chip_name'],
+        settings['chip_cores'],
+        settings['chip_orientation'],
+        settings['voltage_islands'],
+        frequency_tables=[settings['frequency_table_A7'],
+            settings['frequency_table_A15']],
+        sample_frequency=settings['sample_frequency'],
+        power_sensors=settings['power_sensors'],
+        cpufreq_path=settings['cpufreq_path'],
+        power_sample_frequency=settings['power_sample_frequency'],
+        clusters=settings['frequency_islands']
+    )
+
+
+def run(policy, settings, args):
+    """
+    Run the workload with the given policy, 'static' or 'hmp'. Returns the
+    units of work done, the consumed energy in Joules and the number of
+    moves of the policy.
+    """
+    big = settings['frequency_islands'][settings['hmp_big_cluster']]
+    little = settings['frequency_islands'][settings['hmp_little_cluster']]
+
+    chip = init_chip(settings)
+    hmp = None
+    if policy == 'hmp':
+        cores = little
+        hmp = HmpPolicy(
+            chip,
+            big,
+            little,
+            big_name=settings['power_sensors'][
+                settings['hmp_big_cluster']
+            ][0],
+            interval=settings['hmp_interval'],
+            half_life=settings['hmp_half_life'],
+            up_threshold=settings['hmp_up_threshold'],
+            down_threshold=settings['hmp_down_threshold'],
+            residency=settings['hmp_residency'],
+            max_moves=settings['hmp_max_moves'],
+            power_cap=settings['hmp_power_cap']
+        )
+    else:
+        cores = big + little
+
+    program = "%s %s --worker %%s --duty %f" % (
+        sys.executable,
+        os.path.abspath(__file__),
+        args.duty
+    )
+    workload = ['cpu'] * args.cpu + ['bursty'] * args.bursty
+    for i, kind in enumerate(workload):
+        chip.add_task(kind, program % kind, cores[i % len(cores)])
+
+    sampler = chip.power_sampler
+    energy = sum(sampler.energy.values())
+    if hmp:
+        hmp.start()
+
+    sleep(args.duration)
+
+    units = sum(len(t.output) for t in chip.tasks.values())
+    energy = sum(sampler.energy.values()) - energy
+
+    moves = 0
+    if hmp:
+        hmp.stop()
+        hmp.join()
+        moves = hmp.moves
+    chip.stop()
+    chip.join()
+
+    return units, energy, moves
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the HMP policy with static placement."
+    )
+    parser.add_argument('settings', nargs='?', default='settings.cfg')
+    parser.add_argument('--cpu', type=int, default=4,
+        help="number of CPU-bound workers")
+    parser.add_argument('--bursty', type=int, default=8,
+        help="number of bursty workers")
+    parser.add_argument('--duty', type=float, default=.2,
+        help="fraction of every second a bursty worker computes")
+    parser.add_argument('--duration', type=float, default=60.,
+        help="duration of every run in seconds")
+    parser.add_argument('--pause', type=float, default=10.,
+        help="pause between the runs in seconds")
+    parser.add_argument('--worker', choices=('cpu', 'bursty'),
+        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        work(args.worker, args.duty)
+        return
+
+    settings = default_settings.copy()
+    try:
+        settings.update(config.Config(file(args.settings)))
+    except Exception, err:
+        print 'Settings could not be loaded: %s' % err
+        exit(1)
+
+    logging.basicConfig(
+        format=settings['logging_format'],
+        datefmt=settings['logging_datefmt'],
+        level=logging.WARNING
+    )
+
+    results = []
+    for i, policy in enumerate(('static', 'hmp')):
+        if i > 0:
+            # Let the chip cool down between the runs
+            sleep(args.pause)
+        print "Running %s for %d seconds..." % (policy, args.duration)
+        results.append((policy, ) + run(policy, settings, args))
+
+    print
+    print "%-8s %10s %12s %10s %8s" % (
+        "Policy", "Units", "Energy (J)", "Units/J", "Moves"
+    )
+    for policy, units, energy, moves in results:
+        if energy > 0:
+            efficiency = "%10.1f" % (units / energy)
+        else:
+            # The power sensors could not be read
+            efficiency = "%10s" % "-"
+        print "%-8s %10d %12.1f %s %8d" % (
+            policy, units, energy, efficiency, moves
+        )
+
+
+if __name__ == "__main__":
+    main()
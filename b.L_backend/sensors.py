@@ -0,0 +1,152 @@
+"""
+ManyMan - A Many-core Visualization and Management System
+Copyright (C) 2015
+University of Amsterdam - Computer Systems Architecture
+Jimi van der Woning and Roy Bakker
+Extended for big.LITTLE by: Floris Turkenburg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from sampler import read_file
+from threading import Thread, Event
+from time import time
+import logging
+import os
+
+# INA231 power sensors of the ODROID-XU3, in the order of the voltage islands
+INA231_SENSORS = [
+    ['A15', '/sys/bus/i2c/drivers/INA231/3-0040'],
+    ['A7', '/sys/bus/i2c/drivers/INA231/3-0045']
+]
+
+
+class PowerSensor:
+    """
+    A single INA231 power sensor. The sensor_V, sensor_A and sensor_W files
+    in its sysfs directory are opened once and re-read on every sample.
+    """
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self._fds = None
+
+    def enable(self):
+        """Enable the sensor, which is disabled after boot."""
+        fd = os.open(os.path.join(self.path, 'enable'), os.O_WRONLY)
+        try:
+            os.write(fd, "1")
+        finally:
+            os.close(fd)
+
+    def open(self):
+        """Open the sensor files."""
+        fds = []
+        try:
+            for f in ('sensor_V', 'sensor_A', 'sensor_W'):
+                fds.append(os.open(os.path.join(self.path, f), os.O_RDONLY))
+        except OSError:
+            for fd in fds:
+                os.close(fd)
+            raise
+        self._fds = fds
+
+    def read(self):
+        """Return the current voltage, current and power of the sensor."""
+        if self._fds is None:
+            self.open()
+        return tuple(float(read_file(fd)) for fd in self._fds)
+
+    def close(self):
+        """Close the sensor files."""
+        for fd in self._fds or ():
+            os.close(fd)
+        self._fds = None
+
+
+class PowerSampler(Thread):
+    """
+    Samples all power sensors on a fixed interval. The last reading of
+    every sensor is kept in 'voltage', 'current' and 'power', and the
+    consumed energy in Joules is integrated into 'energy'.
+    """
+
+    def __init__(self, **kwargs):
+        self.logger = logging.getLogger('PowerSampler')
+
+        self.sensors = [
+            PowerSensor(name, path)
+            for name, path in kwargs.get('sensors', INA231_SENSORS)
+        ]
+        self.interval = kwargs.get('interval', .1)
+        self.enable = kwargs.get('enable', True)
+
+        self.voltage = dict()
+        self.current = dict()
+        self.power = dict()
+        self.energy = dict((s.name, 0.0) for s in self.sensors)
+
+        self.running = True
+        self._stop_event = Event()
+        self._last = None
+
+        Thread.__init__(self)
+        self.daemon = True
+
+    def sample(self):
+        """Read all sensors once and integrate the consumed energy."""
+        now = time()
+        for sensor in self.sensors:
+            try:
+                v, a, w = sensor.read()
+            except (IOError, OSError, ValueError) as e:
+                self.logger.warning(
+                    "Could not read sensor %s: %s" % (sensor.name, e)
+                )
+                sensor.close()
+                continue
+
+            if self._last is not None and sensor.name in self.power:
+                # Trapezoidal integration over the last interval
+                self.energy[sensor.name] += \
+                    (now - self._last) * (w + self.power[sensor.name]) / 2.
+
+            self.voltage[sensor.name] = v
+            self.current[sensor.name] = a
+            self.power[sensor.name] = w
+        self._last = now
+
+    def run(self):
+        """Keep sampling on the configured interval."""
+        if self.enable:
+            for sensor in self.sensors:
+                try:
+                    sensor.enable()
+                except (IOError, OSError) as e:
+                    self.logger.warning(
+                        "Error when enabling sensor %s: %s" % (sensor.name, e)
+                    )
+
+        while self.running:
+            self.sample()
+            self._stop_event.wait(self.interval)
+
+        for sensor in self.sensors:
+            sensor.close()
+
+    def stop(self):
+        """Stop sampling."""
+        self.running = False
+        self._stop_event.set()
@@ -58,6 +58,8 @@ default_settings = {
     'address': ['sccsa.science.uva.nl', 11111],
     'framerate': 60.,
     'bufsize': 1024,
+    'status_mode': 'delta',
+    'encoding': 'binary',
     'tasks': [
         {'name': 'Hello World', 'command': '/shared/bakkerr/jimivdw/tests/hello'},
         {'name': 'Simple Counter', 'command': '/shared/bakkerr/jimivdw/tests/count'},
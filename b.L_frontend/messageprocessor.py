@@ -27,6 +27,9 @@ import json
 known_msg_types = (
     'server_init',
     'status',
+    'status_delta',
+    'command_result',
+    'migration_log',
     'task_output',
     'invalid_message'
 )
@@ -43,10 +46,19 @@ class MessageProcessor:
     def __init__(self, comm):
         self.comm = comm
 
+        # Last full status and its sequence number, for the delta mode
+        self.status = None
+        self.status_seq = None
+        self.status_tasks = dict()
+        self.resyncing = False
+
     def process(self, msg):
-        """Process the given message 'msg'."""
+        """Process the given message 'msg', either JSON or already decoded."""
         try:
-            data = json.loads(msg)
+            if isinstance(msg, dict):
+                data = msg
+            else:
+                data = json.loads(msg)
 
             if not data['type'] in known_msg_types:
                 raise InvalidMessage('Unknown message type: %s' % data['type'])
@@ -66,6 +78,7 @@ class MessageProcessor:
     def process_server_init(self, msg):
         """Process the server_init message."""
         self.comm.manyman.chip_name = msg['name']
+        self.comm.binary = msg.get('encoding') == 'binary'
         self.comm.manyman.chip_cores = msg['cores']
         if 'orientation' in msg:
             self.comm.manyman.chip_orientation = msg['orientation']
@@ -81,6 +94,15 @@ class MessageProcessor:
 
     def process_status(self, msg):
         """Process a status message."""
+        if 'seq' in msg:
+            # Keep the status that the following deltas apply to
+            self.status = msg['chip']
+            self.status_seq = msg['seq']
+            self.status_tasks = dict(
+                (task['ID'], task) for task in msg['chip']['Tasks']
+            )
+            self.resyncing = False
+
         mm = self.comm.manyman
         total_load = 0
 
@@ -153,6 +175,65 @@ class MessageProcessor:
         mm.cpu_load = total_load
         mm.cpu_power = msg['chip']['Power']
 
+    def process_status_delta(self, msg):
+        """Process a status_delta message."""
+        if self.status is None or msg['seq'] != self.status_seq + 1:
+            if not self.resyncing:
+                Logger.warning(
+                    "MsgProcessor: Missed a status update, resyncing"
+                )
+                self.status = None
+                self.resyncing = True
+                self.comm.resync_status()
+            return
+
+        chip = self.status
+        self.status_seq = msg['seq']
+        chip.update(msg['chip'])
+        for i, fields in msg['cores'].iteritems():
+            chip['Cores'][int(i)].update(fields)
+
+        for task_id in msg['removed']:
+            self.status_tasks.pop(task_id, None)
+        for task_id, fields in msg['tasks'].iteritems():
+            if task_id in self.status_tasks:
+                self.status_tasks[task_id].update(fields)
+            else:
+                self.status_tasks[task_id] = fields
+        chip['Tasks'] = self.status_tasks.values()
+
+        self.process_status({'chip': chip})
+
+    def process_command_result(self, msg):
+        """Process a command_result message."""
+        self.comm.pending.pop(msg['request_id'], None)
+        if msg['success']:
+            Logger.debug("MsgProcessor: %s %d done in %.3f s" %
+                (msg['command'], msg['request_id'], msg['latency']))
+        else:
+            Logger.warning("MsgProcessor: %s %d failed: %s" %
+                (msg['command'], msg['request_id'], msg['error']))
+
+        # Results of the tasks of a batch command
+        for result in msg.get('results', []):
+            if not result['success']:
+                Logger.warning("MsgProcessor: %s" % result['error'])
+
+    def process_migration_log(self, msg):
+        """
+        Process a migration_log message of the load balancer or the HMP
+        policy.
+        """
+        for m in msg['migrations']:
+            # Moves of the HMP policy are either up or down
+            policy = 'HMP' if 'Direction' in m else 'Balancer'
+            if m['Success']:
+                Logger.info("MsgProcessor: %s moved %s from core %d " \
+                    "to core %d" % (policy, m['ID'], m['From'], m['To']))
+            else:
+                Logger.warning("MsgProcessor: %s could not move %s " \
+                    "from core %d" % (policy, m['ID'], m['From']))
+
     def process_task_output(self, msg):
         """Process a task_output message."""
         if not self.comm.manyman.has_task(msg['id']):